@@ -17,6 +17,7 @@ install_requires = [
     'xlrd',
     'docopt',
     'arrow',
+    'numpy',
 ]
 
 dependency_links = [
@@ -42,6 +43,7 @@ setup(name='spartan',
     entry_points={
         'console_scripts':
             #['spartan=spartan:main']
-            ['xls_to_csvs=spartan.scripts.xls_to_csvs:main']
+            ['xls_to_csvs=spartan.scripts.xls_to_csvs:main',
+             'filter_interleaved_fastq=spartan.scripts.filter_interleaved_fastq:main']
     }
 )
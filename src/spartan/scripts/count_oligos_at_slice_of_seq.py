@@ -16,125 +16,29 @@ __author__ = 'Gus Dunn'
 
 import sys
 import os
-import gzip
 
 from collections import defaultdict
+from itertools import imap
 
 import argparse
 
+import numpy as np
 
-class ParseFastQ(object):
-    """Returns a read-by-read fastQ parser analogous to file.readline()"""
-    def __init__(self,filePath,headerSymbols=['@','+']):
-        """Returns a read-by-read fastQ parser analogous to file.readline().
-        Exmpl: parser.next()
-        -OR-
-        Its an iterator so you can do:
-        for rec in parser:
-            ... do something with rec ...
-
-        rec is tuple: (seqHeader,seqStr,qualHeader,qualStr)
-        """
-        if filePath.endswith('.gz'):
-            self._file = self._open_gzip_or_not(filePath)
-        else:
-            self._file = open(filePath, 'rU')
-        self._currentLineNumber = 0
-        self._hdSyms = headerSymbols
-        
-    def __iter__(self):
-        return self
-
-    def _open_gzip_or_not(self, filename):
-        f = open(filename,'rb')
-        if (f.read(2) == '\x1f\x8b'):
-            f.seek(0)
-            return gzip.GzipFile(fileobj=f)
-        else:
-            f.seek(0)
-            return f
-
-    def next(self):
-        """Reads in next element, parses, and does minimal verification.
-        Returns: tuple: (seqHeader,seqStr,qualHeader,qualStr)"""
-        # ++++ Get Next Four Lines ++++
-        elemList = []
-        for i in range(4):
-            line = self._file.readline()
-            self._currentLineNumber += 1 ## increment file position
-            if line:
-                elemList.append(line.strip('\n'))
-            else: 
-                elemList.append(None)
-        
-        # ++++ Check Lines For Expected Form ++++
-        trues = [bool(x) for x in elemList].count(True)
-        nones = elemList.count(None)
-        # -- Check for acceptable end of file --
-        if nones == 4:
-            raise StopIteration
-        # -- Make sure we got 4 full lines of data --
-        assert trues == 4,\
-               "** ERROR: It looks like I encountered a premature EOF or empty line.\n\
-               Please check FastQ file near line number %s (plus or minus ~4 lines) and try again**" % (self._currentLineNumber)
-        # -- Make sure we are in the correct "register" --
-        assert elemList[0].startswith(self._hdSyms[0]),\
-               "** ERROR: The 1st line in fastq element does not start with '%s'.\n\
-               Please check FastQ file near line number %s (plus or minus ~4 lines) and try again**" % (self._hdSyms[0],self._currentLineNumber) 
-        assert elemList[2].startswith(self._hdSyms[1]),\
-               "** ERROR: The 3rd line in fastq element does not start with '%s'.\n\
-               Please check FastQ file near line number %s (plus or minus ~4 lines) and try again**" % (self._hdSyms[1],self._currentLineNumber) 
-        # -- Make sure the seq line and qual line have equal lengths --
-        assert len(elemList[1]) == len(elemList[3]), "** ERROR: The length of Sequence data and Quality data of the last record aren't equal.\n\
-               Please check FastQ file near line number %s (plus or minus ~4 lines) and try again**" % (self._currentLineNumber) 
-        
-        # ++++ Return fatsQ data as tuple ++++
-        return tuple(elemList)
-    
-    def get_next_readSeq(self):
-        """Convenience method: calls self.next and returns only the readSeq."""
-        try:
-            record = self.next()
-            return record[1]
-        except StopIteration:
-            return None
-        
-    def filter_SEfastQ_headings(self,filteredPath,key=None):
-        """
-        Iterates through a single-end fastQ file and writes only those recs
-        that satisfy the <key> lambda func to <filteredPath>.
-        """
-        fastqLen = 0
-        filteredLen = 0
-        
-        if key == None:
-            key = lambda x: x
-        filtered = open(filteredPath, 'w')
-        
-        while 1:
-            try:
-                qRec = self.next()
-                fastqLen += 1
-            except StopIteration:
-                break
-            
-            if key(qRec[0]) == True:
-                for line in qRec:
-                    filtered.write('%s\n' % (line))
-                    filteredLen += 1
-            elif key(qRec[0]) == False:
-                pass
-            else:
-                raise UnexpectedValueError("ERROR: in ParseFastQ.filter_fastQ_headings() 'key' returned a non-T/F value.")
-        
-        filtered.flush()
-        filtered.close()
-        
-        return Bag({"path":os.path.abspath(filtered.name),
-                "original":fastqLen,
-                "filtered":filteredLen})
+from spartan.utils.files import ParseFastQ
+from spartan.utils.misc import pool_imap
 
 
+# maps ASCII codes of 'ACGT' to 0-3, everything else (N, lowercase, ...) to 255
+BASE_CODES = np.empty(256, dtype=np.uint8)
+BASE_CODES.fill(255)
+for code, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = code
+
+# widest oligo that fits in a uint64 at 2 bits per base
+MAX_PACKED_WIDTH = 32
+
+# widest oligo counted with a dense np.bincount table (4**10 bins) instead of np.unique
+MAX_BINCOUNT_WIDTH = 10
 
 
 def count_oligo_slices(fastq_path, first=0, last=-1):
@@ -150,6 +54,114 @@ def count_oligo_slices(fastq_path, first=0, last=-1):
     return oligo_count
 
 
+def pack_oligos(oligos, width):
+    """
+    Returns tuple (packed, valid): a uint64 array with each oligo of length ``width`` encoded
+    2 bits per base and a bool array that is ``False`` for oligos containing anything but 'ACGT'.
+    """
+    seqs = np.frombuffer(''.join(oligos), dtype=np.uint8).reshape(len(oligos), width)
+    codes = BASE_CODES[seqs]
+    valid = (codes != 255).all(axis=1)
+
+    packed = np.zeros(len(oligos), dtype=np.uint64)
+    for column in range(width):
+        packed <<= np.uint64(2)
+        packed |= (codes[:, column] & 3).astype(np.uint64)
+
+    return packed, valid
+
+
+def unpack_oligos(packed, width):
+    """
+    Returns list of oligo strings decoded from the uint64 array ``packed``.
+    """
+    packed = np.asarray(packed, dtype=np.uint64)
+    codes = np.empty((len(packed), width), dtype=np.uint8)
+    for column in range(width):
+        shift = np.uint64(2 * (width - 1 - column))
+        codes[:, column] = (packed >> shift) & np.uint64(3)
+    letters = np.frombuffer('ACGT', dtype=np.uint8)[codes]
+    return [row.tostring() for row in letters]
+
+
+def count_oligo_slices_packed(fastq_path, first=0, last=-1, batch_size=100000):
+    """
+    Same result as ``count_oligo_slices()`` -- including the iteration order of the returned dict --
+    but counts each batch of reads with NumPy.
+
+    Slices of the batch's most common length made only of 'ACGT' are packed into 2-bit integers and
+    counted with ``np.bincount``/``np.unique``; anything else (N-containing or short slices) falls back to
+    counting strings.  Every oligo remembers the first read it was seen in so the final dict can be filled
+    in the same order as the plain per-read loop would have.
+    """
+    records = ParseFastQ(fastq_path)
+
+    packed_counts = {}   # (width, code): count
+    first_seen = {}      # (width, code) or oligo string: index of first read it was seen in
+    other_counts = defaultdict(int)
+    read_num = 0
+
+    for batch in records.iter_batches(batch_size):
+        oligos = [rec[1][first:last] for rec in batch]
+        lengths = np.fromiter(imap(len, oligos), dtype=np.int64, count=len(oligos))
+        width = int(np.bincount(lengths).argmax())
+
+        is_packable = (lengths == width) & (0 < width <= MAX_PACKED_WIDTH)
+        packable = np.flatnonzero(is_packable)
+        if len(packable):
+            packed, valid = pack_oligos([oligos[i] for i in packable], width)
+            is_packable[packable[~valid]] = False
+            packable = packable[valid]
+            packed = packed[valid]
+
+        if len(packable):
+            if width <= MAX_BINCOUNT_WIDTH:
+                counts = np.bincount(packed.astype(np.int64), minlength=4 ** width)
+                codes = np.flatnonzero(counts)
+                counts = counts[codes]
+                # first occurrence of each code
+                first_pos = np.empty(4 ** width, dtype=np.int64)
+                first_pos.fill(len(batch))
+                np.minimum.at(first_pos, packed.astype(np.int64), packable)
+                first_pos = first_pos[codes]
+            else:
+                codes, first_idx, counts = np.unique(packed, return_index=True, return_counts=True)
+                first_pos = packable[first_idx]
+
+            for code, count, pos in zip(codes.tolist(), counts.tolist(), first_pos.tolist()):
+                key = (width, code)
+                if key in packed_counts:
+                    packed_counts[key] += count
+                else:
+                    packed_counts[key] = count
+                    first_seen[key] = read_num + pos
+
+        for i in np.flatnonzero(~is_packable).tolist():
+            oligo = oligos[i]
+            if oligo not in other_counts:
+                first_seen[oligo] = read_num + i
+            other_counts[oligo] += 1
+
+        read_num += len(batch)
+
+    # decode the packed oligos
+    oligo_count = defaultdict(int)
+    decoded = {}
+    keys_by_width = defaultdict(list)
+    for key in packed_counts:
+        keys_by_width[key[0]].append(key)
+    for width, keys in keys_by_width.iteritems():
+        for key, oligo in zip(keys, unpack_oligos([code for w, code in keys], width)):
+            decoded[key] = oligo
+
+    # fill the result in first-seen order
+    for key in sorted(first_seen, key=first_seen.get):
+        if key in packed_counts:
+            oligo_count[decoded[key]] = packed_counts[key]
+        else:
+            oligo_count[key] = other_counts[key]
+
+    return oligo_count
 
 
 def write_table(oligos, out_path):
@@ -193,7 +205,14 @@ def main():
     
     parser.add_argument('-d','--dir', type=str, default=".",
                         help="""Path to a directory that hopefully contains at least one fastq file. (default: %(default)s)""")
-    
+
+    parser.add_argument('-p','--processes', type=int, default=1,
+                        help="""Number of fastq files to process at the same time. (default: %(default)s)""")
+
+    parser.add_argument('--engine', choices=['packed', 'dict'], default='packed',
+                        help="""Counting engine: 'packed' counts 2-bit encoded oligos in NumPy batches,
+                        'dict' counts one read at a time in a python dict. (default: %(default)s)""")
+
 
 
     if len(sys.argv) == 1:
@@ -204,36 +223,50 @@ def main():
 
     fastq_names = get_files(args.dir)
 
-    count_name_template = "{fastq_name}.{start}_{end}_count.tsv"
+    jobs = [(os.path.join(args.dir, fastq), args) for fastq in fastq_names]
 
-    for fastq in fastq_names:
-        count_name = count_name_template.format(fastq_name=fastq, 
-                                                start=args.start, 
-                                                end=args.end
-                                                )
-        # assemble in and out paths
-        fastq_path = os.path.join(args.dir,fastq)
-        out_path = os.path.join(args.dir,count_name)
-
-        # do the counting
-        try:
-            oligo_counts = count_oligo_slices(fastq_path=fastq_path, 
-                                              first=args.start, 
-                                              last=args.end
-                                              )
-        except IOError:
-            print "-!- WARNING: file ({file}) was not processed because it is not actually a gzipped file.".format(file=fastq_path)
-            continue
-        except AssertionError:
-            print "-!- WARNING: file ({file}) was not able to be processed; it may be corrupted.".format(file=fastq_path)
-
-        # write the outfile
-        write_table(oligos=oligo_counts, out_path=out_path)
-
-        # Comfort you that things are happening
-        print "Completed file: {file}".format(file=out_path)
+    for message in pool_imap(process_fastq, jobs, processes=args.processes):
+        print message
 
 
+def process_fastq(job):
+    """
+    Counts the oligos of one fastq file and writes its table.
+    Returns the message to report.
+
+    :param job: tuple (fastq_path, args)
+    """
+    fastq_path, args = job
+
+    count_name_template = "{fastq_name}.{start}_{end}_count.tsv"
+    count_name = count_name_template.format(fastq_name=os.path.basename(fastq_path),
+                                            start=args.start,
+                                            end=args.end
+                                            )
+    out_path = os.path.join(args.dir,count_name)
+
+    if args.engine == 'packed':
+        count_func = count_oligo_slices_packed
+    else:
+        count_func = count_oligo_slices
+
+    # do the counting
+    try:
+        oligo_counts = count_func(fastq_path=fastq_path,
+                                  first=args.start,
+                                  last=args.end
+                                  )
+    except IOError:
+        return "-!- WARNING: file ({file}) was not processed because it is not actually a gzipped file.".format(file=fastq_path)
+    except AssertionError:
+        return "-!- WARNING: file ({file}) was not able to be processed; it may be corrupted.".format(file=fastq_path)
+
+    # write the outfile
+    write_table(oligos=oligo_counts, out_path=out_path)
+
+    # Comfort you that things are happening
+    return "Completed file: {file}".format(file=out_path)
+
 
 
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# filter_interleaved_fastq.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+filter_interleaved_fastq.py
+=================================================
+Purpose:
+Filter interleaved paired-end fastq data inside a shell pipeline (stdin -> stdout).
+"""
+__author__ = 'Gus Dunn'
+
+import argparse
+
+from spartan.utils.files import filter_interleaved_PEfastQ
+from spartan.utils import fastqs
+
+
+def build_filter(args):
+    """
+    Returns a single BatchReadFilter combining the filters asked for in ``args`` or ``None``.
+    """
+    filters = []
+    if args.min_mean_qual is not None:
+        filters.append(fastqs.MeanQualFilter(args.min_mean_qual, offset=args.phred_offset))
+    if args.min_qual is not None:
+        filters.append(fastqs.MinQualFilter(args.min_qual, offset=args.phred_offset))
+    if args.max_low_qual_frac is not None:
+        filters.append(fastqs.LowQualFracFilter(args.low_qual, args.max_low_qual_frac, offset=args.phred_offset))
+    if args.max_ns is not None:
+        filters.append(fastqs.NCountFilter(args.max_ns))
+    if args.min_trimmed_length is not None:
+        filters.append(fastqs.TrailingQualFilter(args.low_qual, args.min_trimmed_length, offset=args.phred_offset))
+
+    if not filters:
+        return None
+    return fastqs.AllOfFilter(*filters)
+
+
+def main():
+    """
+    The main loop.  Lets ROCK!
+    """
+
+    desc = """Reads interleaved paired-end fastq data (fwd, rev, fwd, rev...), checks that mates share their read
+    name and writes the pairs where both mates pass all of the requested filters, still interleaved.
+    Use '-' for stdin/stdout."""
+
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('-i', '--input', type=str, default='-',
+                        help="""Interleaved fastq file to filter. (default: %(default)s)""")
+    parser.add_argument('-o', '--output', type=str, default='-',
+                        help="""Where to write passing pairs; '*.gz' paths are gzipped. (default: %(default)s)""")
+    parser.add_argument('--singles', type=str, default=None,
+                        help="""Optional file for reads that passed while their mate did not.""")
+    parser.add_argument('--failed', type=str, default=None,
+                        help="""Optional file for reads that did not pass.""")
+
+    parser.add_argument('--min-mean-qual', type=float, default=None,
+                        help="""Minimum mean quality score of a read.""")
+    parser.add_argument('--min-qual', type=int, default=None,
+                        help="""Minimum quality score of every base of a read.""")
+    parser.add_argument('--low-qual', type=int, default=20,
+                        help="""Quality score below which a base is "low quality". (default: %(default)s)""")
+    parser.add_argument('--max-low-qual-frac', type=float, default=None,
+                        help="""Maximum fraction of low quality bases in a read.""")
+    parser.add_argument('--max-ns', type=int, default=None,
+                        help="""Maximum number of N bases in a read.""")
+    parser.add_argument('--min-trimmed-length', type=int, default=None,
+                        help="""Minimum read length left after trimming trailing low quality bases.""")
+    parser.add_argument('--phred-offset', type=int, default=33,
+                        help="""ASCII offset of the quality scores. (default: %(default)s)""")
+
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help="""Number of worker processes to filter with. (default: %(default)s)""")
+    parser.add_argument('--compress-level', type=int, default=None,
+                        help="""gzip level to compress the output(s) with (default: only '*.gz' paths).""")
+
+    args = parser.parse_args()
+
+    read_filter = build_filter(args)
+    if read_filter is None:
+        parser.error("Give at least one filter option.")
+
+    filter_interleaved_PEfastQ(read_filter,
+                               inPath=args.input,
+                               matchedPassPath=args.output,
+                               singlePassPath=args.singles,
+                               nonPassPath=args.failed,
+                               processes=args.processes,
+                               compressLevel=args.compress_level)
+
+
+if __name__ == '__main__':
+    main()
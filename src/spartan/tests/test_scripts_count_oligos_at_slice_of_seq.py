@@ -0,0 +1,60 @@
+# test_scripts_count_oligos_at_slice_of_seq.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_scripts_count_oligos_at_slice_of_seq.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import random
+
+from spartan.scripts import count_oligos_at_slice_of_seq as c
+
+
+def write_reads(path, num=3000):
+    rand = random.Random(7)
+    with open(str(path), 'w') as out:
+        for i in range(num):
+            seq = ''.join(rand.choice('ACGT') for j in range(30))
+            if i % 17 == 0:
+                seq = seq[:4] + 'N' + seq[5:]
+            if i % 23 == 0:
+                seq = seq[:8]
+            if i % 29 == 0:
+                seq = seq.lower()
+            out.write('@r%s\n%s\n+\n%s\n' % (i, seq, 'I' * len(seq)))
+    return str(path)
+
+
+class TestCountOligoSlicesPacked():
+    """
+    tests c.count_oligo_slices_packed against c.count_oligo_slices
+    """
+
+    def test_small_width(self, tmpdir):
+        path = write_reads(tmpdir.join('reads.fastq'))
+        expected = c.count_oligo_slices(path, 2, 7)
+        result = c.count_oligo_slices_packed(path, 2, 7, batch_size=500)
+
+        assert result == expected
+        assert result.items() == expected.items()
+
+    def test_wide_slices(self, tmpdir):
+        path = write_reads(tmpdir.join('reads.fastq'))
+        expected = c.count_oligo_slices(path)
+        result = c.count_oligo_slices_packed(path, batch_size=500)
+
+        assert result.items() == expected.items()
+
+    def test_pack_roundtrip(self):
+        oligos = ['ACGT', 'TTTT', 'GACA']
+        packed, valid = c.pack_oligos(oligos, 4)
+
+        assert valid.all()
+        assert c.unpack_oligos(packed, 4) == oligos
@@ -0,0 +1,45 @@
+# test_utils_annotations_ensembl_gff3.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_annotations_ensembl_gff3.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import os
+import shutil
+
+import pytest
+
+from spartan.utils.annotations.ensembl import gff3
+from spartan.utils.errors import InvalidFileFormatError
+
+
+TESTING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'testing')
+GFF3_PATH = os.path.join(TESTING_DIR, 'gff3', 'test1.ensembl.gff3')
+FASTA_PATH = os.path.join(TESTING_DIR, 'fasta', 'AGAP004685.fasta')
+
+
+class TestGFF3FastaAccess():
+    """
+    tests gff3.GFF3.install_fasta_access
+    """
+
+    def test_default_backend_opens_fixture(self, tmpdir):
+        # copy so the index files the backends write stay out of the source tree
+        fastaPath = str(tmpdir.join('AGAP004685.fasta'))
+        shutil.copy(FASTA_PATH, fastaPath)
+
+        gff = gff3.GFF3(GFF3_PATH, fasta_path=fastaPath)
+        assert gff.fasta_backend == 'pyfasta'
+        assert len(gff.fasta_db.keys()) == 47
+        assert 'AGAP004685:AGAP004685-RA cdna:KNOWN_protein_coding' in gff.fasta_db
+
+        with pytest.raises(InvalidFileFormatError):
+            gff3.GFF3(GFF3_PATH, fasta_path=fastaPath, fasta_backend='fai')
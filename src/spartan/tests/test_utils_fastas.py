@@ -0,0 +1,303 @@
+# test_utils_fastas.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_fastas.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import gzip
+import os
+
+import pytest
+
+from spartan.utils import fastas, seqs
+from spartan.utils.errors import InvalidFileFormatError, InvalidOptionError, SanityCheckError
+
+
+FASTA_TEXT = '\n>chr1 first contig\nACGTACGTAC\nGTAC\n>chr2\nNNNNacgt\n>empty\n>chr3 last\nAC\nGT'
+
+
+def write_fasta(path, text=FASTA_TEXT):
+    with open(str(path), 'w') as out:
+        out.write(text)
+    return str(path)
+
+
+class TestMappedFastA():
+    """
+    tests fastas.MappedFastA
+    """
+
+    def test_matches_ParseFastA(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+
+        for blockSize in (3, 7, 1000):
+            recs = list(fastas.MappedFastA(path, blockSize=blockSize))
+            assert [rec.to_tuple() for rec in recs] == list(fastas.ParseFastA(path))
+
+    def test_lazy_fields(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+
+        rec = list(fastas.MappedFastA(path, joinWith='|'))[0]
+
+        assert rec.header == '>chr1 first contig'
+        assert rec[1] == 'ACGTACGTAC|GTAC'
+
+
+class TestIndexedFastA():
+    """
+    tests fastas.build_fai and fastas.IndexedFastA
+    """
+
+    def test_build_fai(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+
+        fastas.build_fai(path)
+
+        assert open(path + '.fai').read().splitlines() == ['chr1\t14\t20\t10\t11',
+                                                           'chr2\t8\t42\t8\t9',
+                                                           'empty\t0\t58\t0\t0',
+                                                           'chr3\t4\t69\t2\t3']
+
+    def test_fetch(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+        fasta = fastas.IndexedFastA(path)
+        whole = dict(fastas.ParseFastA(path))
+
+        assert fasta.keys() == ['chr1', 'chr2', 'empty', 'chr3']
+        assert fasta.length('chr1') == 14
+        assert fasta.fetch('chr1') == whole['chr1']
+        assert fasta.fetch('chr1', 9, 12) == 'ACGT'
+        assert fasta.fetch('chr2', 3, 100, strand=-1) == 'acgtNN'
+        assert fasta.sequence({'chr': 'chr3', 'start': 1, 'stop': 3, 'strand': '-'}) == 'CGT'
+        assert fasta['chr1'][8:12] == 'ACGT'
+        assert fasta.fetch('empty') == ''
+
+    def test_ragged_lines_rejected(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'), '>bad\nACG\nACGT\n')
+
+        with pytest.raises(InvalidFileFormatError):
+            fastas.build_fai(path)
+
+
+class TestScanFastaHeaders():
+    """
+    tests fastas.scan_fasta_headers
+    """
+
+    def test_headers_and_offsets(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+        expected = [(1, '>chr1 first contig'), (36, '>chr2'), (51, '>empty'), (58, '>chr3 last')]
+
+        for blockSize in (1, 2, 5, 1000):
+            assert list(fastas.scan_fasta_headers(path, block_size=blockSize)) == expected
+        assert all(FASTA_TEXT[offset:].startswith(header) for offset, header in expected)
+        assert fastas.count_fasta_recs_in_file(path) == 4
+
+    def test_count_rejects_duplicate_names(self, tmpdir):
+        path = write_fasta(tmpdir.join('dups.fasta'), FASTA_TEXT + '\n>chr2 again\nACGT\n')
+
+        with pytest.raises(InvalidFileFormatError):
+            fastas.count_fasta_recs_in_file(path)
+
+    def test_gzipped(self, tmpdir):
+        path = str(tmpdir.join('seqs.fasta.gz'))
+        out = gzip.open(path, 'wb')
+        out.write(FASTA_TEXT)
+        out.close()
+
+        assert [header for offset, header in fastas.scan_fasta_headers(path)] == ['>chr1 first contig', '>chr2',
+                                                                                 '>empty', '>chr3 last']
+
+
+class TestDivideFastaFile():
+    """
+    tests fastas.divide_fasta_file
+    """
+
+    def write_contigs(self, tmpdir):
+        lengths = [1000, 10, 20, 400, 300, 250, 30]
+        text = ''.join(['>c%s\n%s\n' % (i, 'A' * length) for i, length in enumerate(lengths)])
+        return write_fasta(tmpdir.join('contigs.fa'), text), lengths
+
+    def test_greedy_balances_bases(self, tmpdir):
+        path, lengths = self.write_contigs(tmpdir)
+
+        outPaths = fastas.divide_fasta_file(path, divide_by=2)
+
+        shards = [dict(fastas.ParseFastA(outPath)) for outPath in outPaths]
+        assert outPaths == [str(tmpdir.join('contigs.%s.fa' % n)) for n in (0, 1)]
+        assert sorted(shards[0].keys() + shards[1].keys()) == sorted('c%s' % i for i in range(len(lengths)))
+        assert sorted(sum(map(len, shard.values())) for shard in shards) == [1000, 1010]
+
+    def test_index_lpt(self, tmpdir):
+        path, lengths = self.write_contigs(tmpdir)
+        fastas.build_fai(path)
+
+        outPaths = fastas.divide_fasta_file(path, divide_by=3, method='index', balance_by='bytes')
+
+        assert len(outPaths) == 3
+        sizes = sorted(sum(map(len, dict(fastas.ParseFastA(outPath)).values())) for outPath in outPaths)
+        assert sizes == [460, 550, 1000]
+
+
+class TestRecLengths():
+    """
+    tests fastas.fasta_rec_lengths and fastas.fastaRec_length_indexer
+    """
+
+    def test_fasta_rec_lengths(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+        expected = [(name, len(seq)) for name, seq in fastas.ParseFastA(path)]
+
+        for blockSize in (1, 4, 1000):
+            assert fastas.fasta_rec_lengths(path, block_size=blockSize) == expected
+
+    def test_indexer_lengths_only(self, tmpdir):
+        seqDir = tmpdir.mkdir('assemblies')
+        write_fasta(seqDir.join('a.fa'))
+        path = write_fasta(seqDir.join('b.fa'), '>chr1\nACGTACGTACGTAC\n>chr9\nAC\n')
+        os.utime(path, (1000000000, 1000000000))
+        write_fasta(seqDir.join('notes.txt'), 'not a fasta\n')
+        seqDir.mkdir('subdir')
+        cachePath = str(tmpdir.join('cache', 'lengths'))
+
+        recDict, seqDict = fastas.fastaRec_length_indexer([str(seqDir)], lengthsOnly=True, processes=2,
+                                                          cachePath=cachePath)
+
+        assert seqDict is None
+        assert recDict == {'chr1': 14, 'chr2': 8, 'empty': 0, 'chr3': 4, 'chr9': 2}
+        assert recDict == fastas.fastaRec_length_indexer([str(seqDir)])[0]
+
+        # same size and mtime: answered from the cache without reading the file
+        write_fasta(path, '>chrX\nACGTACGTACGTAC\n>chr9\nAC\n')
+        os.utime(path, (1000000000, 1000000000))
+        recDict, seqDict = fastas.fastaRec_length_indexer([str(seqDir)], lengthsOnly=True, cachePath=cachePath)
+        assert 'chrX' not in recDict
+
+    def test_conflicting_lengths(self, tmpdir):
+        pathA = write_fasta(tmpdir.join('a.fa'), '>chr1\nACGT\n')
+        pathB = write_fasta(tmpdir.join('b.fa'), '>chr1\nACG\n')
+
+        with pytest.raises(SanityCheckError):
+            fastas.fastaRec_length_indexer([pathA, pathB], lengthsOnly=True)
+
+
+class TestPackedGenome():
+    """
+    tests fastas.pack_fasta and fastas.PackedGenome
+    """
+
+    def test_round_trip(self, tmpdir):
+        text = '>chr1\nACGTNNNNacgtnnAC\nGTRYacgtA\n>chr2\nnnnn\n>empty\n>chr3\nT\n'
+        path = write_fasta(tmpdir.join('genome.fa'), text)
+        whole = dict(fastas.ParseFastA(path))
+        whole['chr1'] = whole['chr1'].replace('R', 'N').replace('Y', 'N')
+
+        genome = fastas.PackedGenome(path)
+
+        assert os.path.exists(path + '.spkg')
+        assert fastas.is_packed_genome(path + '.spkg')
+        assert genome.keys() == ['chr1', 'chr2', 'empty', 'chr3']
+        for name, seq in whole.items():
+            assert genome.length(name) == len(seq)
+            assert genome.fetch(name) == seq
+            for start in range(1, len(seq) + 1):
+                for end in range(start, len(seq) + 1):
+                    assert genome.fetch(name, start, end) == seq[start - 1:end]
+
+        assert genome.sequence({'chr': 'chr1', 'start': 3, 'stop': 10, 'strand': -1}) == 'gtNNNNAC'
+        assert fastas.PackedGenome(path + '.spkg')['chr1'][12:16] == 'nnAC'
+
+
+class TestHeaderRewriting():
+    """
+    tests fastas.ParseFastA.rewrite_headers and fastas.rename_fasta_headers
+    """
+
+    def test_rewrite_headers(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'), '>a:1 b c\nACGTA\nCG\n>d:2 e f\nTT\n')
+        outPath = str(tmpdir.join('out.fasta'))
+
+        fastas.ParseFastA(path, key=lambda x: x[1:]).rewrite_headers(outPath, lineLen=3, order=[2, 0, 1], chmod=640)
+
+        assert open(outPath).read() == '>c a:1 b\nACG\nTAC\nG\n>f d:2 e\nTT\n'
+        assert oct(os.stat(outPath).st_mode & 0777) == '0640'
+
+        for chmod in (0755, '755', '0755'):
+            fastas.ParseFastA(path, key=lambda x: x[1:]).rewrite_headers(outPath, order=[0], chmod=chmod)
+            assert oct(os.stat(outPath).st_mode & 0777) == '0755'
+
+        badPath = str(tmpdir.join('bad.fasta'))
+        for chmod in ('rwx', 0o17777, 'u+x'):
+            with pytest.raises(InvalidOptionError):
+                fastas.ParseFastA(path, key=lambda x: x[1:]).rewrite_headers(badPath, order=[0], chmod=chmod)
+            assert not os.path.exists(badPath)
+
+    def test_rewrite_headers_overwrite(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'), '>a b\nACGTA\nCG\n')
+
+        fastas.ParseFastA(path, key=lambda x: x[1:]).rewrite_headers(None, lineLen=None, order=[1, 0], ow=True)
+
+        assert open(path).read() == '>b a\nACGTA\nCG\n'
+        assert os.listdir(str(tmpdir)) == ['seqs.fasta']
+
+    def test_rename_fasta_headers(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+        outPath = str(tmpdir.join('out.fasta'))
+
+        fastas.rename_fasta_headers(path, outPath, lambda line: line.replace('chr', 'Chr'))
+
+        assert open(outPath).read() == FASTA_TEXT.replace('>chr', '>Chr') + '\n'
+
+
+class TestFetchMany():
+    """
+    tests fastas.SeqStore.fetch_many and fastas.SeqStore.write_regions
+    """
+
+    def test_matches_fetch(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+        regions = [('chr3', 1, 4, -1), ('chr1', 5, 12), ('chr2', 2, 5, '-'), ('chr1', 1, 3, 1), ('empty', 1, 5),
+                   ('chr1', 10, 100, -1), ('chr1', 4, 3)]
+
+        for store in (fastas.IndexedFastA(path), fastas.PackedGenome(path)):
+            expected = [store.fetch(*region) for region in regions]
+            for maxSpan in (1, 5, 1000):
+                assert store.fetch_many(regions, chunkSize=3, maxSpan=maxSpan) == expected
+
+    def test_write_regions(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+        outPath = str(tmpdir.join('regions.fa'))
+
+        count = fastas.IndexedFastA(path).write_regions([('chr2', 3, 8, -1), ('chr1', 1, 5)], outPath, lineLen=4)
+
+        assert count == 2
+        assert open(outPath).read() == '>chr2:3-8(-)\nacgt\nNN\n>chr1:1-5(+)\nACGT\nA\n'
+
+
+class TestWindowStats():
+    """
+    tests fastas.fasta_window_stats
+    """
+
+    def test_per_contig(self, tmpdir):
+        path = write_fasta(tmpdir.join('seqs.fasta'))
+        gzPath = path + '.gz'
+        out = gzip.open(gzPath, 'wb')
+        out.write(FASTA_TEXT)
+        out.close()
+
+        expected = [(name, seqs.window_stats(seq, 4, 2).n_frac.tolist()) for name, seq in fastas.ParseFastA(path)]
+        assert expected == [('chr1', [0.0] * 6), ('chr2', [1.0, 0.5, 0.0]), ('empty', []), ('chr3', [0.0])]
+        for inPath in (path, gzPath):
+            for processes in (None, 2):
+                results = fastas.fasta_window_stats(inPath, 4, step=2, processes=processes)
+                assert [(name, stats.n_frac.tolist()) for name, stats in results] == expected
@@ -0,0 +1,175 @@
+# test_utils_fastqs.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_fastqs.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import pytest
+
+from spartan.utils import fastqs as fq
+from spartan.utils import files
+
+
+RECS = [('@r0', 'ACGTA', '+', 'IIIII'),   # all Q40
+        ('@r1', 'ACNTN', '+', 'II#I#'),   # Q2 at the Ns
+        ('@r2', 'ACGTACGT', '+', 'IIII####'),
+        ('@r3', 'A', '+', '5')]           # Q20
+
+
+class TestQualMath():
+    """
+    tests the vectorized per-read quality functions
+    """
+
+    def test_mean_quals(self):
+        assert list(fq.mean_quals(RECS)) == [40.0, 24.8, 21.0, 20.0]
+
+    def test_min_quals(self):
+        assert list(fq.min_quals(RECS)) == [40, 2, 2, 20]
+
+    def test_frac_quals_below(self):
+        assert list(fq.frac_quals_below(RECS, 20)) == [0.0, 0.4, 0.5, 0.0]
+
+    def test_count_Ns(self):
+        assert list(fq.count_Ns(RECS)) == [0, 2, 0, 0]
+
+    def test_trailing_trim_positions(self):
+        assert list(fq.trailing_trim_positions(RECS, 20)) == [5, 4, 4, 1]
+
+
+class TestFilters():
+    """
+    tests the BatchReadFilter subclasses
+    """
+
+    def test_batch_and_single_agree(self):
+        filt = fq.MeanQualFilter(21)
+        assert list(filt.test_batch(RECS)) == [filt(rec) for rec in RECS] == [True, True, True, False]
+
+    def test_filter_SEfastQ_headings(self, tmpdir):
+        inPath = str(tmpdir.join('in.fastq'))
+        outPath = str(tmpdir.join('out.fastq'))
+        with open(inPath, 'w') as out:
+            out.write(''.join(['%s\n' % ('\n'.join(rec)) for rec in RECS]))
+
+        result = files.ParseFastQ(inPath).filter_SEfastQ_headings(outPath, key=fq.NCountFilter(1))
+
+        assert result.original == 4
+        assert [rec[0] for rec in files.ParseFastQ(outPath)] == ['@r0', '@r2', '@r3']
+
+        files.ParseFastQ(inPath).filter_SEfastQ_headings(outPath, key=lambda header: header != '@r2')
+        assert [rec[0] for rec in files.ParseFastQ(outPath)] == ['@r0', '@r1', '@r3']
+
+    def test_base_class_is_abstract(self):
+        with pytest.raises(TypeError):
+            fq.BatchReadFilter()
+
+
+class TestSubsample():
+    """
+    tests fq.subsample_fastqs
+    """
+
+    def write_mates(self, tmpdir, numRecs=500):
+        paths = []
+        for mate in (1, 2):
+            path = str(tmpdir.join('in_%s.fastq' % mate))
+            with open(path, 'w') as out:
+                for i in range(numRecs):
+                    out.write('@r%s/%s\nACGT\n+\nIIII\n' % (i, mate))
+            paths.append(path)
+        return paths
+
+    def test_fraction_pairs_stay_in_lockstep(self, tmpdir):
+        inPaths = self.write_mates(tmpdir)
+        outPaths = [str(tmpdir.join('out_1.fastq')), str(tmpdir.join('out_2.fastq'))]
+
+        result = fq.subsample_fastqs(inPaths, outPaths, fraction=0.2, seed=1, batchSize=64)
+
+        names = [[rec[0][:-2] for rec in files.ParseFastQ(path)] for path in outPaths]
+        assert result.total == 500
+        assert result.sampled == len(names[0]) == len(names[1])
+        assert names[0] == names[1]
+        assert 50 < result.sampled < 150
+
+    def test_reservoir_exact_number_in_order(self, tmpdir):
+        inPaths = self.write_mates(tmpdir)
+        outPaths = [str(tmpdir.join('out_1.fastq')), str(tmpdir.join('out_2.fastq'))]
+
+        result = fq.subsample_fastqs(inPaths, outPaths, number=30, seed=2, batchSize=16)
+
+        ordinals = [int(rec[0][2:-2]) for rec in files.ParseFastQ(outPaths[0])]
+        assert result.sampled == len(ordinals) == 30
+        assert ordinals == sorted(set(ordinals))
+        assert ordinals == [int(rec[0][2:-2]) for rec in files.ParseFastQ(outPaths[1])]
+
+        again = str(tmpdir.join('again.fastq'))
+        fq.subsample_fastqs(inPaths[:1], [again], number=30, seed=2, batchSize=16)
+        assert open(again).read() == open(outPaths[0]).read()
+
+    def test_reservoir_bounded_within_chunks(self, tmpdir, monkeypatch):
+        inPaths = self.write_mates(tmpdir)
+        outPath = str(tmpdir.join('out.fastq'))
+        pieceSizes = []
+        recs_at = fq._recs_at
+
+        def counting_recs_at(parsers, chunks, indexes):
+            pieceSizes.append(len(indexes))
+            return recs_at(parsers, chunks, indexes)
+
+        monkeypatch.setattr(fq, '_recs_at', counting_recs_at)
+        result = fq.subsample_fastqs(inPaths[:1], [outPath], number=10, seed=3, batchSize=500)
+        assert result.sampled == 10
+        assert max(pieceSizes) <= 10
+        assert len([rec for rec in files.ParseFastQ(outPath)]) == 10
+
+    def test_bad_number(self, tmpdir):
+        inPaths = self.write_mates(tmpdir)
+        with pytest.raises(ValueError):
+            fq.subsample_fastqs(inPaths[:1], [str(tmpdir.join('out.fastq'))], number=0)
+
+
+class TestFastQProfiler():
+    """
+    tests fq.FastQProfiler and fq.profile_fastqs
+    """
+
+    def test_update(self):
+        profiler = fq.FastQProfiler(maxLen=6)
+        profiler.update(RECS[:2])
+        profiler.update(RECS[2:])
+
+        assert profiler.numReads == 4
+        assert profiler.lengthCounts.tolist() == [0, 1, 0, 0, 0, 2, 1]   # the 8 bp read lands in the last bin
+        assert profiler.baseCounts[0].tolist() == [4, 0, 0, 0, 0]
+        assert profiler.baseCounts[2].tolist() == [0, 0, 2, 0, 1]
+        assert profiler.baseCounts[5].tolist() == [0, 1, 1, 1, 0]         # cycles 6-8 of r2 are pooled
+        assert profiler.mean_quals()[0] == 35.0
+        assert profiler.qual_quantiles((0.5,))[1].tolist() == [40]
+        assert profiler.gcCounts[[40, 50, 33, 0]].tolist() == [1, 1, 1, 1]
+
+    def test_profile_fastqs_merges_files(self, tmpdir):
+        paths = []
+        for name in ('a', 'b'):
+            path = str(tmpdir.join('%s.fastq' % name))
+            with open(path, 'w') as out:
+                out.write(''.join(['%s\n' % ('\n'.join(rec)) for rec in RECS]))
+            paths.append(path)
+
+        profiler = fq.profile_fastqs(paths, maxLen=10, processes=2)
+        tablePath = str(tmpdir.join('cycles.tsv'))
+        profiler.write_table(tablePath)
+
+        assert profiler.numReads == 8
+        rows = [line.split('\t') for line in open(tablePath).read().splitlines()]
+        assert rows[0][:3] == ['cycle', 'bases', 'mean_qual']
+        assert len(rows) == 9
+        assert rows[1][:3] == ['1', '8', '35.000']
@@ -0,0 +1,462 @@
+# test_utils_files.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_files.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import os
+import sys
+
+import pytest
+
+from spartan.utils import files as f
+
+
+FASTQ_RECS = [('@read%s 1:N:0:TAGCTT' % i, 'ACGTNACGTA'[:5 + (i % 5)], '+', 'IIII#IIIII'[:5 + (i % 5)])
+              for i in range(23)]
+
+
+def write_fastq(path, recs=FASTQ_RECS):
+    with open(str(path), 'w') as out:
+        for rec in recs:
+            out.write('%s\n' % ('\n'.join(rec)))
+    return str(path)
+
+
+class TestParseFastQIterBatches():
+    """
+    tests f.ParseFastQ.iter_batches
+    """
+
+    def test_matches_next(self, tmpdir):
+        path = write_fastq(tmpdir.join('reads.fastq'))
+        batches = list(f.ParseFastQ(path).iter_batches(n=5, blockSize=17))
+
+        assert [len(b) for b in batches] == [5, 5, 5, 5, 3]
+        assert [rec for b in batches for rec in b] == list(f.ParseFastQ(path))
+
+    def test_bad_register_reports_line(self, tmpdir):
+        recs = list(FASTQ_RECS)
+        recs[6] = ('read6',) + recs[6][1:]
+        path = write_fastq(tmpdir.join('bad.fastq'), recs)
+
+        with pytest.raises(AssertionError) as err:
+            list(f.ParseFastQ(path).iter_batches(n=4))
+        assert 'line number 25 ' in str(err.value)
+
+    def test_bad_length_reports_line(self, tmpdir):
+        recs = list(FASTQ_RECS)
+        recs[2] = recs[2][:3] + ('I',)
+        path = write_fastq(tmpdir.join('bad.fastq'), recs)
+
+        with pytest.raises(AssertionError) as err:
+            list(f.ParseFastQ(path).iter_batches(n=10))
+        assert 'line number 12 ' in str(err.value)
+
+
+def write_bgzf(path, data, blockLen=1000):
+    """Writes ``data`` as a BGZF file with an EOF block."""
+    import struct
+    import zlib
+
+    with open(str(path), 'wb') as out:
+        for start in range(0, len(data), blockLen) + [len(data)]:
+            raw = data[start:start + blockLen]
+            comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+            cdata = comp.compress(raw) + comp.flush()
+            out.write('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00')
+            out.write(struct.pack('<H', len(cdata) + 25))
+            out.write(cdata)
+            out.write(struct.pack('<iI', zlib.crc32(raw), len(raw)))
+    return str(path)
+
+
+class TestGzipReader():
+    """
+    tests f.GzipReader
+    """
+    data = ''.join(['@read%s\nACGTACGTNN\n+\nIIIIIIII##\n' % i for i in range(2000)])
+
+    def test_single_and_multi_member(self, tmpdir):
+        import gzip
+
+        path = str(tmpdir.join('reads.fastq.gz'))
+        for i in range(3):
+            gz = gzip.GzipFile(path, 'ab')
+            gz.write(self.data)
+            gz.close()
+
+        reader = f.GzipReader(path, chunkSize=1000)
+        assert reader.readline() == '@read0\n'
+        assert reader.read() == gzip.GzipFile(path).read()[7:]
+        reader.close()
+
+    def test_bgzf(self, tmpdir):
+        path = write_bgzf(tmpdir.join('reads.fastq.gz'), self.data)
+
+        assert f.is_bgzf(path)
+        reader = f.GzipReader(path, threads=3, chunkSize=500)
+        assert list(reader) == self.data.splitlines(True)
+
+    def test_parsers(self, tmpdir):
+        from spartan.utils.fastas import ParseFastA
+
+        fq = write_bgzf(tmpdir.join('reads.fastq.gz'), self.data)
+        fa = write_bgzf(tmpdir.join('reads.fasta.gz'), '>one\nAC\nGT\n>two\nTT\n', blockLen=5)
+
+        assert len(list(f.ParseFastQ(fq, gzThreads=2))) == 2000
+        assert list(ParseFastA(fa)) == [('one', 'ACGT'), ('two', 'TT')]
+
+    def test_abandoned_readers_stop_their_threads(self, tmpdir):
+        import gc
+        import gzip
+        import time
+        from spartan.utils.fastas import ParseFastA
+
+        def wait_for_exit(thread):
+            for _ in range(50):
+                if not thread.is_alive():
+                    return True
+                time.sleep(0.1)
+            return False
+
+        path = str(tmpdir.join('reads.fastq.gz'))
+        gz = gzip.GzipFile(path, 'wb')
+        gz.write(self.data)
+        gz.close()
+
+        # tiny chunks and queue so the inflating thread is left blocked on a full queue
+        reader = f.GzipReader(path, chunkSize=64, queueSize=1)
+        reader.readline()
+        thread = reader._thread
+        time.sleep(0.2)
+        assert thread.is_alive()
+        del reader
+        gc.collect()
+        assert wait_for_exit(thread)
+
+        reader = f.GzipReader(path, chunkSize=64, queueSize=1)
+        reader.readline()
+        reader.close()
+        assert wait_for_exit(reader._thread)
+
+        faPath = str(tmpdir.join('reads.fasta.gz'))
+        gz = gzip.GzipFile(faPath, 'wb')
+        gz.write('>one\nACGT\n>two\nTT\n')
+        gz.close()
+        for parserClass, parserPath in ((f.ParseFastQ, path), (ParseFastA, faPath)):
+            with parserClass(parserPath) as parser:
+                parser.next()
+            assert parser._file.closed
+            assert wait_for_exit(parser._file._thread)
+
+    def test_truncated_files_raise(self, tmpdir):
+        import gzip
+        from spartan.utils.fastas import ParseFastA
+
+        fq = str(tmpdir.join('reads.fastq.gz'))
+        gz = gzip.GzipFile(fq, 'wb')
+        gz.write(self.data)
+        gz.close()
+        fa = str(tmpdir.join('reads.fasta.gz'))
+        gz = gzip.GzipFile(fa, 'wb')
+        gz.write(''.join(['>rec%s\nACGTACGTNN\n' % i for i in range(2000)]))
+        gz.close()
+
+        for path in (fq, fa):
+            whole = open(path, 'rb').read()
+            for cut in (len(whole) // 2, len(whole) - 1):
+                with open(path, 'wb') as out:
+                    out.write(whole[:cut])
+                with pytest.raises(IOError):
+                    f.GzipReader(path, chunkSize=100).read()
+
+        with pytest.raises(IOError):
+            list(f.ParseFastQ(fq))
+        with pytest.raises(IOError):
+            list(ParseFastA(fa))
+
+
+class TestFilterPEfastQs():
+    """
+    tests f.filter_PEfastQs
+    """
+
+    def run_filter(self, tmpdir, tag, **kwargs):
+        fwd = write_fastq(tmpdir.join('fwd.fastq'))
+        rev = write_fastq(tmpdir.join('rev.fastq'), FASTQ_RECS[::-1])
+        outs = [str(tmpdir.join('%s.%s.fastq' % (tag, name))) for name in ('mp1', 'mp2', 'sp', 'np')]
+
+        f.filter_PEfastQs(lambda rec: len(rec[1]) > 6, fwd, rev, *outs, **kwargs)
+        return [open(out).read() for out in outs]
+
+    def test_serial_output(self, tmpdir):
+        mPass1, mPass2, sPass, nPass = self.run_filter(tmpdir, 'serial')
+
+        assert mPass1.count('@') == mPass2.count('@') == 8
+        assert sPass.count('@') + nPass.count('@') == 30
+        assert mPass1.startswith('@read3 ')
+
+    def test_processes_match_serial(self, tmpdir):
+        assert self.run_filter(tmpdir, 'pool', processes=2, chunkSize=3) == self.run_filter(tmpdir, 'serial')
+
+    def test_nested_serial_calls_keep_their_filters(self, tmpdir):
+        fwd = write_fastq(tmpdir.join('fwd.fastq'))
+        rev = write_fastq(tmpdir.join('rev.fastq'), FASTQ_RECS[::-1])
+        innerOuts = [str(tmpdir.join('inner.%s.fastq' % name)) for name in ('mp1', 'mp2', 'sp', 'np')]
+
+        def outer_filter(rec):
+            # another serial filtering run starts while this one is between chunks
+            f.filter_PEfastQs(lambda x: False, fwd, rev, *innerOuts)
+            return len(rec[1]) > 6
+
+        outs = [str(tmpdir.join('nested.%s.fastq' % name)) for name in ('mp1', 'mp2', 'sp', 'np')]
+        f.filter_PEfastQs(outer_filter, fwd, rev, *outs, chunkSize=3)
+
+        assert [open(out).read() for out in outs] == self.run_filter(tmpdir, 'serial')
+        assert open(innerOuts[0]).read() == ''
+
+
+class TestFastQIndex():
+    """
+    tests f.FastQIndex and the random access methods of f.ParseFastQ
+    """
+    recs = [('@read%s' % i, 'ACGT' * (1 + i % 7), '+', 'IIII' * (1 + i % 7)) for i in range(103)]
+    data = ''.join(['%s\n' % ('\n'.join(rec)) for rec in recs])
+
+    def make_files(self, tmpdir):
+        import gzip
+
+        plain = write_fastq(tmpdir.join('reads.fastq'), self.recs)
+        gz = str(tmpdir.join('reads.fastq.gz'))
+        gzFile = gzip.GzipFile(gz, 'wb')
+        gzFile.write(self.data)
+        gzFile.close()
+        bgzf = write_bgzf(tmpdir.join('reads.bgzf.gz'), self.data, blockLen=97)
+        return plain, gz, bgzf
+
+    def test_get_records(self, tmpdir):
+        for path in self.make_files(tmpdir):
+            parser = f.ParseFastQ(path)
+            index = parser.load_index(every=10)
+
+            assert index.numRecs == 103
+            assert parser.get_record(57) == self.recs[57]
+            assert parser.get_records([99, 3, 40, 41, 0]) == [self.recs[i] for i in (99, 3, 40, 41, 0)]
+            with pytest.raises(IndexError):
+                parser.get_record(103)
+
+    def test_index_is_reused(self, tmpdir):
+        plain = self.make_files(tmpdir)[0]
+        f.FastQIndex(plain, every=10)
+
+        assert f.FastQIndex(plain, every=50).every == 10
+        assert f.FastQIndex(plain, every=50, rebuild=True).every == 50
+
+    def test_split_ranges(self, tmpdir):
+        for path in self.make_files(tmpdir):
+            parser = f.ParseFastQ(path)
+            parser.load_index(every=5)
+            ranges = parser.split_ranges(4)
+
+            assert len(ranges) == 4
+            assert sum(r.numRecs for r in ranges) == 103
+            pieces = [list(f.ParseFastQ(path).iter_range(r.startRec, r.numRecs)) for r in ranges]
+            assert [rec for piece in pieces for rec in piece] == self.recs
+
+
+class TestRecordWriter():
+    """
+    tests f.RecordWriter
+    """
+
+    def test_plain_and_gzip(self, tmpdir):
+        import gzip
+
+        for name in ('out.fastq', 'out.fastq.gz'):
+            path = str(tmpdir.join(name))
+            with f.RecordWriter(path, bufferSize=50) as out:
+                out.write_records(FASTQ_RECS[:10])
+                for rec in FASTQ_RECS[10:]:
+                    out.write_record(rec)
+
+            if name.endswith('.gz'):
+                text = gzip.GzipFile(path).read()
+            else:
+                text = open(path).read()
+            assert text == ''.join(['%s\n' % ('\n'.join(rec)) for rec in FASTQ_RECS])
+
+    def test_filter_PEfastQs_gzip_out(self, tmpdir):
+        import gzip
+
+        fwd = write_fastq(tmpdir.join('fwd.fastq'))
+        outs = [str(tmpdir.join('%s.fastq.gz' % name)) for name in ('mp1', 'mp2', 'sp', 'np')]
+        f.filter_PEfastQs(lambda rec: True, fwd, fwd, *outs, compressLevel=1)
+
+        assert gzip.GzipFile(outs[0]).read() == open(fwd).read()
+
+
+class TestInterleavedPE():
+    """
+    tests interleaved and piped use of f.filter_PEfastQs
+    """
+    pairs = [(('@pair%s/1' % i, 'ACGTA', '+', 'IIIII'), ('@pair%s/2' % i, 'ACGTA', '+', '#####'[:i % 6] + 'IIIII'[i % 6:]))
+             for i in range(12)]
+
+    def test_interleaved_in_and_out(self, tmpdir):
+        inPath = write_fastq(tmpdir.join('pairs.fastq'), [mate for pair in self.pairs for mate in pair])
+        outPath = str(tmpdir.join('passed.fastq'))
+        singles = str(tmpdir.join('singles.fastq'))
+
+        counts = f.filter_interleaved_PEfastQ(lambda rec: '#' not in rec[3], inPath, outPath, singles, chunkSize=5)
+
+        assert counts.pairs_passed == 2
+        assert counts.fwd_passed_as_single == 10
+        assert [rec[0] for rec in f.ParseFastQ(outPath)] == ['@pair0/1', '@pair0/2', '@pair6/1', '@pair6/2']
+        assert len(list(f.ParseFastQ(singles))) == 10
+
+    def test_mate_names_checked(self, tmpdir):
+        mates = [mate for pair in self.pairs for mate in pair]
+        mates[8], mates[10] = mates[10], mates[8]
+        inPath = write_fastq(tmpdir.join('pairs.fastq'), mates)
+
+        with pytest.raises(f.InvalidFileFormatError) as err:
+            f.filter_interleaved_PEfastQ(lambda rec: True, inPath, str(tmpdir.join('out.fastq')))
+        assert 'pair number 5' in str(err.value)
+
+    def test_stdin_to_stdout(self, tmpdir):
+        import subprocess
+
+        inText = open(write_fastq(tmpdir.join('pairs.fastq'), [mate for pair in self.pairs for mate in pair])).read()
+        # run against this source tree whether or not spartan is installed
+        srcDir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(f.__file__))))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([srcDir] + filter(None, [os.environ.get('PYTHONPATH')])))
+        script = subprocess.Popen([sys.executable, '-m', 'spartan.scripts.filter_interleaved_fastq', '--min-qual', '30'],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        outText = script.communicate(inText)[0]
+
+        assert script.returncode == 0
+        assert outText == ''.join(['%s\n' % ('\n'.join(mate)) for mate in self.pairs[0] + self.pairs[6]])
+
+
+class TestMappedFastQ():
+    """
+    tests f.MappedFastQ
+    """
+
+    def test_matches_ParseFastQ(self, tmpdir):
+        path = write_fastq(tmpdir.join('reads.fastq'))
+
+        recs = list(f.MappedFastQ(path, blockSize=37))
+
+        assert [rec.to_tuple() for rec in recs] == FASTQ_RECS
+        assert recs[3].seq_length() == len(FASTQ_RECS[3][1])
+        assert [len(batch) for batch in f.MappedFastQ(path, blockSize=10 ** 6).iter_batches(10)] == [10, 10, 3]
+
+    def test_missing_last_newline(self, tmpdir):
+        path = str(tmpdir.join('reads.fastq'))
+        with open(path, 'w') as out:
+            out.write('@r1\nAC\n+\nII\n@r2\nGT\n+\n#I')
+
+        assert [tuple(rec) for rec in f.MappedFastQ(path, blockSize=5)] == [('@r1', 'AC', '+', 'II'),
+                                                                            ('@r2', 'GT', '+', '#I')]
+
+    def test_bad_length_reports_line(self, tmpdir):
+        recs = list(FASTQ_RECS)
+        recs[2] = (recs[2][0], recs[2][1], '+', recs[2][3][:-1])
+        path = write_fastq(tmpdir.join('reads.fastq'), recs)
+
+        with pytest.raises(AssertionError) as err:
+            list(f.MappedFastQ(path))
+        assert 'line number 12' in str(err.value)
+
+
+class TestRewriteLines():
+    """
+    tests f.rewrite_lines and f.renameChrom_in_SAM
+    """
+
+    def test_headers_only(self, tmpdir):
+        inPath = str(tmpdir.join('in.fa'))
+        with open(inPath, 'w') as out:
+            out.write('>a x\nACGT\nAC\n>b y\nGG\n>c z\nTT')
+
+        for blockSize in (1, 3, 1000):
+            outPath = str(tmpdir.join('out.fa.gz'))
+            f.rewrite_lines(inPath, outPath, lineFunc=lambda line: line.upper(), blockSize=blockSize)
+            assert f.GzipReader(outPath).read() == '>A X\nACGT\nAC\n>B Y\nGG\n>C Z\nTT\n'
+
+            outPath = str(tmpdir.join('out.fa'))
+            f.rewrite_lines(inPath, outPath, lineFunc=lambda line: line, refold=3, blockSize=blockSize)
+            assert open(outPath).read() == '>a x\nACG\nTAC\n>b y\nGG\n>c z\nTT\n'
+
+    def test_fields(self, tmpdir):
+        inPath = str(tmpdir.join('in.vcf'))
+        with open(inPath, 'w') as out:
+            out.write('##contig=<ID=c1>\n#CHROM\tPOS\nc1\t5\tA\nc2\t7\tC\nc1\t9\tG\n')
+        outPath = str(tmpdir.join('out.vcf'))
+        calls = []
+
+        def rename(name):
+            calls.append(name)
+            return name.upper()
+
+        f.rewrite_lines(inPath, outPath, lineFunc=lambda line: line.replace('c1', 'C1'), linePrefixes=('##contig=',),
+                        fieldFunc=rename, commentPrefix='#', blockSize=7)
+
+        assert open(outPath).read() == '##contig=<ID=C1>\n#CHROM\tPOS\nC1\t5\tA\nC2\t7\tC\nC1\t9\tG\n'
+        assert sorted(calls) == ['c1', 'c2']
+
+    def test_renameChrom_in_SAM(self, tmpdir):
+        path = str(tmpdir.join('reads.sam'))
+        text = '@HD\tVN:1.0\n@SQ\tSN:a:b:chr1\tLN:9\nHWI-1\t0\tx:y:chr1\t5\nother\t0\tx:y:chr1\t5\n'
+        with open(path, 'w') as out:
+            out.write(text)
+
+        f.renameChrom_in_SAM(path)
+
+        assert open(path + '.zap_me.backup').read() == text
+        assert open(path).read() == '@HD\tVN:1.0\n@SQ\tSN:chr1\tLN:9\nHWI-1\t0\tchr1\t5\nother\t0\tx:y:chr1\t5\n'
+
+
+class TestMaskConverter():
+    """
+    tests f.mask_converter, f.iter_soft_masked_runs and f.unSoftMask
+    """
+
+    TEXT = '>c1 lower words\nACgt\nacGT\n>c2\nnnAA\n>c3\nAAAa\n'
+
+    def write_fasta(self, tmpdir):
+        path = str(tmpdir.join('genome.fa'))
+        with open(path, 'w') as out:
+            out.write(self.TEXT)
+        return path
+
+    def test_modes(self, tmpdir):
+        path = self.write_fasta(tmpdir)
+        outPath = str(tmpdir.join('out.fa.gz'))
+
+        f.unSoftMask(path, outPath)
+        assert f.GzipReader(outPath).read() == '>c1 lower words\nACGT\nACGT\n>c2\nNNAA\n>c3\nAAAA\n'
+
+        f.mask_converter(path, outPath, mode='hardmask', blockSize=5)
+        assert f.GzipReader(outPath).read() == '>c1 lower words\nACNN\nNNGT\n>c2\nNNAA\n>c3\nAAAN\n'
+
+    def test_bed(self, tmpdir):
+        path = self.write_fasta(tmpdir)
+        bedPath = str(tmpdir.join('masked.bed'))
+
+        for blockSize in (1, 6, 1000):
+            assert list(f.iter_soft_masked_runs(path, blockSize=blockSize)) == [('c1', 2, 6), ('c2', 0, 2),
+                                                                                 ('c3', 3, 4)]
+
+        f.mask_converter(path, bedPath, mode='bed')
+        assert open(bedPath).read() == 'c1\t2\t6\nc2\t0\t2\nc3\t3\t4\n'
@@ -0,0 +1,142 @@
+# test_utils_kmers.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_kmers.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import collections
+import gzip
+import random
+import string
+
+import numpy as np
+
+from spartan.utils import kmers
+
+
+def dict_counts(seqs, k, canonical=False):
+    counts = collections.Counter()
+    for seq in seqs:
+        seq = seq.upper()
+        for i in range(len(seq) - k + 1):
+            kmer = seq[i:i + k]
+            if set(kmer) - set('ACGT'):
+                continue
+            if canonical:
+                kmer = min(kmer, kmer[::-1].translate(string.maketrans('ACGT', 'TGCA')))
+            counts[kmer] += 1
+    return counts
+
+
+def random_seqs(seed, num, length):
+    rand = random.Random(seed)
+    return [''.join(rand.choice('ACGTacgtN') for _ in range(rand.randint(0, length))) for _ in range(num)]
+
+
+def as_dict(counter):
+    return dict((kmers.decode_kmer(key, counter.k), count)
+                for key, count in zip(counter.keys.tolist(), counter.counts.tolist()))
+
+
+class TestKmerCounter():
+    """
+    tests kmers.kmer_codes and kmers.KmerCounter
+    """
+
+    def test_encoding(self):
+        assert kmers.encode_kmer('ACGT') == 27
+        assert kmers.decode_kmer(27, 4) == 'ACGT'
+        assert kmers.decode_kmer(kmers.encode_kmer('T' * 31), 31) == 'T' * 31
+        assert kmers.kmer_codes('ACGTNAcgtA', 3).tolist() == [6, 27, 6, 27, 44]
+        assert kmers.kmer_codes('ACGTNAcgtA', 3, canonical=True).tolist() == [6, 6, 6, 6, 44]
+        assert kmers.kmer_codes('AAC', 3, canonical=True).tolist() == [kmers.encode_kmer('AAC')]
+        assert kmers.kmer_codes('GTT', 3, canonical=True).tolist() == [kmers.encode_kmer('AAC')]
+
+    def test_counts_match_dict(self):
+        seqs = random_seqs(0, 40, 120)
+        for k in (1, 2, 5, 16, 31):
+            for canonical in (False, True):
+                counter = kmers.KmerCounter(k, canonical=canonical, flushSize=50, chunkSize=17)
+                counter.update([('name', seq) for seq in seqs])
+                assert as_dict(counter) == dict_counts(seqs, k, canonical)
+                assert counter.numSeqs == len(seqs)
+
+    def test_merge_and_histogram(self, tmpdir):
+        seqs = random_seqs(1, 30, 60)
+        whole = kmers.KmerCounter(4, canonical=True)
+        whole.update([('s', seq) for seq in seqs])
+        first = kmers.KmerCounter(4, canonical=True)
+        first.update([('s', seq) for seq in seqs[:10]])
+        second = kmers.KmerCounter(4, canonical=True)
+        second.update([('s', seq) for seq in seqs[10:]])
+
+        merged = first.merge(second)
+        assert merged.keys.tolist() == whole.keys.tolist()
+        assert merged.counts.tolist() == whole.counts.tolist()
+        assert merged.count('ACGT') == dict_counts(seqs, 4, True)['ACGT']
+        assert merged.count('TTTT') == merged.count('AAAA')
+
+        expected = collections.Counter(dict_counts(seqs, 4, True).values())
+        path = str(tmpdir.join('histo.tsv'))
+        merged.write_histogram(path)
+        assert [line.split() for line in open(path)] == [[str(c), str(n)] for c, n in sorted(expected.items())]
+
+    def test_count_kmers(self, tmpdir):
+        fasta = str(tmpdir.join('genome.fa'))
+        with open(fasta, 'w') as out:
+            out.write('>chr1\nACGTACGGTT\nNNACGT\n>chr2\nTTTTGGCA\n')
+        fastq = str(tmpdir.join('reads.fq.gz'))
+        out = gzip.open(fastq, 'wb')
+        out.write('@r1\nACGTTGCA\n+\nIIIIIIII\n@r2\nGGGACGT\n+\nIIIIIII\n')
+        out.close()
+
+        counter = kmers.count_kmers([fasta, fastq], 3, processes=2)
+        expected = dict_counts(['ACGTACGGTTNNACGT', 'TTTTGGCA', 'ACGTTGCA', 'GGGACGT'], 3)
+        assert as_dict(counter) == expected
+        assert counter.total() == sum(expected.values())
+        assert counter.most_common(1) == [('ACG', 5)]
+
+    def test_count_kmers_splits_files_into_batches(self, tmpdir, monkeypatch):
+        seqs = random_seqs(2, 25, 50)
+        fasta = str(tmpdir.join('contigs.fa'))
+        with open(fasta, 'w') as out:
+            for i, seq in enumerate(seqs):
+                out.write('>c%s\n%s\n' % (i, seq))
+
+        jobSizes = []
+        countBatch = kmers._count_batch_kmers
+
+        def count_batch(job):
+            jobSizes.append(len(job[0]))
+            return countBatch(job)
+
+        monkeypatch.setattr(kmers, '_count_batch_kmers', count_batch)
+        serial = kmers.count_kmers([fasta], 5, canonical=True, batchSize=4)
+        assert jobSizes == [4] * 6 + [1]
+        assert as_dict(serial) == dict_counts(seqs, 5, True)
+        assert serial.numSeqs == len(seqs)
+
+        monkeypatch.undo()
+        pooled = kmers.count_kmers([fasta], 5, canonical=True, batchSize=4, processes=3)
+        assert pooled.keys.tolist() == serial.keys.tolist()
+        assert pooled.counts.tolist() == serial.counts.tolist()
+
+    def test_format_sniffed_from_contents(self, tmpdir):
+        gzFastq = str(tmpdir.join('reads.fq'))
+        out = gzip.open(gzFastq, 'wb')
+        out.write('@r1\nACGT\n+\nIIII\n')
+        out.close()
+        plainFastq = str(tmpdir.join('reads.fq.gz'))
+        with open(plainFastq, 'w') as out:
+            out.write('@r1\nACGT\n+\nIIII\n')
+
+        assert kmers._is_fastq(gzFastq)
+        assert kmers._is_fastq(plainFastq)
@@ -0,0 +1,51 @@
+# test_utils_misc.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_misc.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import numpy as np
+import pytest
+
+from spartan.utils import misc
+
+
+class TestSlidingWindow():
+    """
+    tests misc.slidingWindow, misc.window_view and misc.iter_window_blocks
+    """
+
+    def test_array_mode_matches_slices(self):
+        seq = 'ACGTTGCAAGGT'
+        for winSize, step in ((3, 1), (4, 3), (12, 5), (1, 1)):
+            view = misc.slidingWindow(seq, winSize, step, asArray=True)
+            assert [row.tostring() for row in view] == list(misc.slidingWindow(seq, winSize, step))
+
+    def test_view_is_zero_copy_and_read_only(self):
+        values = np.arange(10, dtype=np.int64)
+        view = misc.window_view(values, 4, 2)
+        assert view.tolist() == [[0, 1, 2, 3], [2, 3, 4, 5], [4, 5, 6, 7], [6, 7, 8, 9]]
+        assert np.may_share_memory(view, values)
+        with pytest.raises(ValueError):
+            view[0, 0] = 99
+
+        assert misc.window_view('AC', 3).shape == (0, 3)
+        assert misc.window_view(values, 3, 7).tolist() == [[0, 1, 2], [7, 8, 9]]
+        with pytest.raises(ValueError):
+            misc.window_view(values, 0)
+
+    def test_iter_window_blocks(self):
+        values = np.arange(20)
+        blocks = list(misc.iter_window_blocks(values, 5, step=2, blockSize=3))
+        assert [(start, len(block)) for start, block in blocks] == [(0, 3), (6, 3), (12, 2)]
+        stacked = np.concatenate([block for start, block in blocks])
+        assert stacked.tolist() == misc.window_view(values, 5, 2).tolist()
+        assert [block[0, 0] for start, block in blocks] == [start for start, block in blocks]
@@ -0,0 +1,186 @@
+# test_utils_motifs.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_motifs.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import gzip
+import string
+
+import numpy as np
+import pytest
+
+from spartan.utils import motifs
+
+
+GENOME = '>chr1\nAAGATCAACGTTcagg\nTTGGAAAA\n>chr2\nGGATTTTTTTAATCC\n'
+
+
+def write_genome(tmpdir):
+    path = str(tmpdir.join('genome.fa'))
+    with open(path, 'w') as out:
+        out.write(GENOME)
+    return path
+
+
+def rows(hits):
+    return zip(*[hits[column].tolist() for column in motifs.HIT_COLUMNS])
+
+
+class TestMotifScanner():
+    """
+    tests motifs.MotifScanner
+    """
+
+    def test_scan_seq_chunk_edges(self):
+        seq = 'ACCTGGTTCCAGGT'
+        expected = [('s', 2, 5, -1, 'CAGG'), ('s', 2, 6, 1, 'CCWGG'), ('s', 2, 6, -1, 'CCWGG'),
+                    ('s', 9, 13, 1, 'CCWGG'), ('s', 9, 13, -1, 'CCWGG'), ('s', 10, 13, 1, 'CAGG')]
+
+        for chunkSize in (1, 4, 100):
+            scanner = motifs.MotifScanner(['CCWGG', 'CAGG'], chunkSize=chunkSize)
+            assert rows(scanner.scan_seq('s', seq)) == expected
+
+    def test_scan_fasta(self, tmpdir):
+        path = write_genome(tmpdir)
+        scanner = motifs.MotifScanner({'ecoRV': 'GATATC', 'gatc': 'GATC', 'tta': 'TTAA'}, chunkSize=5)
+        expected = [('chr1', 3, 6, 1, 'gatc'), ('chr1', 3, 6, -1, 'gatc'),
+                    ('chr2', 9, 12, 1, 'tta'), ('chr2', 9, 12, -1, 'tta')]
+
+        assert rows(motifs.scan_fasta(scanner, path, processes=2)) == expected
+
+        gzPath = path + '.gz'
+        out = gzip.open(gzPath, 'wb')
+        out.write(GENOME)
+        out.close()
+        assert rows(motifs.scan_fasta(scanner, gzPath)) == expected
+
+
+TRANSFAC = """NA\tacgt_like
+BF\tnone_listed
+XX
+MA\t01\t8\t0\t1\t1\tA
+MA\t02\t0\t9\t1\t0\tC
+MA\t03\t1\t0\t9\t0\tG
+MA\t04\t0\t1\t0\t9\tT
+XX
+//
+ID gg_box
+P0      A      C      G      T
+01      0      0      10     0      G
+02      1      1      7      1      G
+XX
+//
+"""
+
+
+def brute_force_scores(matrix, seq):
+    """Integer score of every window of <seq> that fits (None for windows containing a non-ACGT base)."""
+    scores = []
+    for start in range(len(seq) - len(matrix) + 1):
+        window = seq[start:start + len(matrix)].upper()
+        if set(window) - set('ACGT'):
+            scores.append(None)
+        else:
+            scores.append(sum(matrix.intScores[pos, 'ACGT'.index(base)] for pos, base in enumerate(window)))
+    return scores
+
+
+class TestPWMScanner():
+    """
+    tests motifs.read_transfac, motifs.PositionWeightMatrix and motifs.PWMScanner
+    """
+
+    def test_read_transfac(self, tmpdir):
+        path = str(tmpdir.join('motifs.transfac'))
+        with open(path, 'w') as out:
+            out.write(TRANSFAC)
+
+        acgt, gg = motifs.read_transfac(path)
+        assert (acgt.name, gg.name) == ('acgt_like', 'gg_box')
+        assert acgt.counts.tolist()[1] == [0, 9, 1, 0]
+        assert gg.counts.tolist() == [[0, 0, 10, 0], [1, 1, 7, 1]]
+
+    def test_pvalues_are_exact(self):
+        matrix = motifs.PositionWeightMatrix('m', [[5, 1, 1, 3], [0, 4, 4, 2], [2, 2, 2, 4]])
+        kmers = [a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT']
+        allScores = [brute_force_scores(matrix, kmer)[0] for kmer in kmers]
+
+        for score in set(allScores):
+            expected = sum(1 for other in allScores if other >= score) / 64.0
+            assert abs(matrix.pvalues([score])[0] - expected) < 1e-12
+
+        threshold = matrix.int_threshold(5 / 64.0)
+        assert sum(1 for score in allScores if score >= threshold) <= 5
+        assert sum(1 for score in allScores if score >= threshold - 1) > 5
+
+    def test_scan_seq_both_strands(self):
+        matrices = [motifs.PositionWeightMatrix('acg', [[8, 0, 1, 1], [0, 9, 1, 0], [1, 0, 9, 0]]),
+                    motifs.PositionWeightMatrix('gg', [[0, 0, 10, 0], [1, 1, 7, 1]])]
+        seq = 'TTACGTNACGccGTTcgtaa'
+        scanner = motifs.PWMScanner(matrices, score=2.0)
+
+        expected = []
+        for matrix in matrices:
+            for strand, strandSeq in ((1, seq), (-1, None)):
+                if strand == 1:
+                    windowScores = brute_force_scores(matrix, seq)
+                else:
+                    rc = seq[::-1].upper().translate(string.maketrans('ACGTN', 'TGCAN'))
+                    windowScores = brute_force_scores(matrix, rc)[::-1]
+                for start, score in enumerate(windowScores):
+                    if score is not None and score >= 200:
+                        expected.append((start + 1, start + len(matrix), strand, matrix.name, score / 100.0))
+        expected.sort(key=lambda hit: (hit[0], hit[1], hit[3], -hit[2]))
+        assert len(expected) > 4
+
+        for chunkSize, maxCells in ((1048576, 8388608), (3, 4), (1, 1)):
+            scanner.chunkSize = chunkSize
+            scanner.maxCells = maxCells
+            hits = scanner.scan_seq('s', seq)
+            assert zip(hits.start.tolist(), hits.end.tolist(), hits.strand.tolist(),
+                       hits.motif.tolist(), hits.score.tolist()) == expected
+
+        gg = hits.motif == 'gg'
+        assert hits.pvalue[gg].tolist() == matrices[1].pvalues(np.round(hits.score[gg] * 100).astype(int)).tolist()
+
+    def test_minus_strand_pvalues_asymmetric_background(self):
+        background = [0.4, 0.3, 0.2, 0.1]
+        matrix = motifs.PositionWeightMatrix('m', [[5, 1, 1, 3], [0, 4, 4, 2], [2, 2, 2, 4]], background=background)
+        kmers = [a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT']
+        probs = [np.prod([background['ACGT'.index(base)] for base in kmer]) for kmer in kmers]
+        compl = string.maketrans('ACGT', 'TGCA')
+        minusScores = [brute_force_scores(matrix, kmer[::-1].translate(compl))[0] for kmer in kmers]
+
+        scanner = motifs.PWMScanner([matrix], score=-100.0, strands='minus')
+        for kmer in kmers:
+            hits = scanner.scan_seq('s', kmer)
+            score = int(round(hits.score[0] * 100))
+            expected = sum(prob for prob, other in zip(probs, minusScores) if other >= score)
+            assert abs(hits.pvalue[0] - expected) < 1e-12
+
+        threshold = motifs.PWMScanner([matrix], pvalue=0.05, strands='minus')._thresholds[0]
+        assert sum(prob for prob, other in zip(probs, minusScores) if other >= threshold) <= 0.05
+        assert sum(prob for prob, other in zip(probs, minusScores) if other >= threshold - 1) > 0.05
+
+    def test_scanner_base_is_abstract(self):
+        with pytest.raises(TypeError):
+            motifs.ChunkedScanner()
+
+    def test_scan_fasta(self, tmpdir):
+        path = write_genome(tmpdir)
+        matrix = motifs.PositionWeightMatrix('gatc', [[0, 0, 9, 1], [9, 0, 0, 1], [1, 0, 0, 9], [0, 9, 1, 0]])
+        scanner = motifs.PWMScanner([matrix], pvalue=0.004, chunkSize=4)
+
+        hits = motifs.scan_fasta(scanner, path, processes=2)
+        assert zip(hits.seqid.tolist(), hits.start.tolist(), hits.strand.tolist()) == [('chr1', 3, 1), ('chr1', 3, -1)]
+        assert hits.pvalue.tolist() == [matrix.pvalues([matrix.intScores.max(1).sum()])[0]] * 2
+        assert hits.pvalue[0] == 0.25 ** 4
@@ -0,0 +1,88 @@
+# test_utils_seqs.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+# 
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+test_utils_seqs.py
+=================================================
+Purpose:
+
+"""
+__author__ = 'Gus Dunn'
+
+import random
+
+import numpy as np
+
+from spartan.utils import seqs
+from spartan.utils.misc import slidingWindow
+
+
+class TestRevcomp():
+    """
+    tests seqs.compliment, seqs.revcomp and seqs.revcomp_batch
+    """
+
+    def test_revcomp(self):
+        assert seqs.compliment('ACGTRYacgtn-') == 'TGCAYRtgcan-'
+        assert seqs.revcomp('AACGTRYacgtn') == 'nacgtRYACGTT'
+
+    def test_batch(self):
+        batch = ['AAC', '', 'gT', 'N']
+
+        assert seqs.revcomp_batch(batch) == [seqs.revcomp(seq) for seq in batch]
+        assert seqs.revcomp_batch(np.array(batch)).tolist() == [seqs.revcomp(seq) for seq in batch]
+
+        array = np.frombuffer('AACGtt', dtype=np.uint8).reshape(2, 3)
+        assert seqs.revcomp_batch(array).tostring() == 'GTTaaC'
+
+
+def slow_window_stats(seq, winSize, step):
+    """Stats of the full windows from misc.slidingWindow, one substring at a time."""
+    rows = []
+    for window in slidingWindow(seq, winSize, step):
+        upper = window.upper()
+        a, c, g, t, n = [upper.count(base) for base in 'ACGTN']
+        cpg = sum(1 for i in range(len(upper) - 1) if upper[i:i + 2] == 'CG')
+        lower = sum(1 for base in window if base.islower())
+        rows.append([(g + c) / float(a + c + g + t) if a + c + g + t else None,
+                     (a - t) / float(a + t) if a + t else None,
+                     n / float(len(window)),
+                     lower / float(len(window)),
+                     cpg * len(window) / float(c * g) if c * g else None])
+    return rows
+
+
+class TestWindowStats():
+    """
+    tests seqs.window_stats and seqs.write_bedgraph
+    """
+
+    def test_matches_slidingWindow(self):
+        rand = random.Random(0)
+        seq = ''.join(rand.choice('ACGTacgtNNR') for _ in range(500))
+
+        for winSize, step, blockSize in ((50, 50, 8388608), (37, 11, 8388608), (37, 11, 30), (1, 1, 7)):
+            stats = seqs.window_stats(seq, winSize, step, blockSize=blockSize)
+            expected = slow_window_stats(seq, winSize, step)
+            assert len(stats.start) == len(expected)
+            assert stats.start.tolist() == range(0, len(expected) * step, step)
+            for i, row in enumerate(expected):
+                for stat, value in zip(seqs.WINDOW_STATS, row):
+                    if value is None:
+                        assert np.isnan(stats[stat][i])
+                    else:
+                        assert abs(stats[stat][i] - value) < 1e-12
+
+    def test_partial_and_bedgraph(self, tmpdir):
+        stats = seqs.window_stats('ACGTcgNNAAACGG', 5, partial=True)
+        assert stats.end.tolist() == [5, 10, 14]
+        assert stats.gc.tolist() == [0.6, 1 / 3.0, 0.75]
+
+        path = str(tmpdir.join('gc.bedGraph'))
+        windows = [('chr1', stats), ('chr2', seqs.window_stats('NNNNNNNNNN', 5))]
+        seqs.write_bedgraph(path, windows, stat='gc', trackLine='track type=bedGraph name=gc')
+        assert open(path).read() == 'track type=bedGraph name=gc\nchr1\t0\t5\t0.6\nchr1\t5\t10\t0.333333\nchr1\t10\t14\t0.75\n'
+        assert seqs.window_stats('ACG', 5).start.tolist() == []
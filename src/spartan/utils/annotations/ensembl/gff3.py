@@ -17,6 +17,8 @@ import networkx as nx
 import pyfasta
 
 from spartan.utils.annotations import intervals
+from spartan.utils.errors import InvalidOptionError
+from spartan.utils.fastas import IndexedFastA, PackedGenome
 from spartan.utils.misc import Bunch
 
 __author__ = 'Gus Dunn'
@@ -83,10 +85,11 @@ def parse_gff3(gff3_path):
 
 
 class GFF3(object):
-    def __init__(self, gff3_path, fasta_path=False):
+    def __init__(self, gff3_path, fasta_path=False, fasta_backend='pyfasta'):
 
         self.gff3_path = gff3_path
         self.fasta_path = fasta_path
+        self.fasta_backend = fasta_backend
         self.parents_graph = nx.Graph()
         self.feature_db = dict()
         self.common_to_uniq_id = dict()
@@ -143,7 +146,41 @@ class GFF3(object):
         feature.uniq_id = u_id
 
     def install_fasta_access(self):
-        self.fasta_db = pyfasta.Fasta(self.fasta_path, flatten_inplace=True)
+        """
+        Sets `self.fasta_db` to an object with a pyfasta style `sequence()` method over `self.fasta_path`.
+
+        `self.fasta_backend` chooses it:
+        * 'pyfasta' (default): `pyfasta.Fasta`, keyed by the full header line
+        * 'fai': `spartan.utils.fastas.IndexedFastA` (memory-mapped, .fai indexed)
+        * 'packed': `spartan.utils.fastas.PackedGenome` (2-bit packed copy, shared between processes through mmap)
+
+        The 'fai' and 'packed' backends key records by the first word of the header and refuse files in
+        which that word repeats, so they are opt-in.
+        """
+        if self.fasta_backend == 'pyfasta':
+            self.fasta_db = pyfasta.Fasta(self.fasta_path, flatten_inplace=True)
+        elif self.fasta_backend == 'fai':
+            self.fasta_db = IndexedFastA(self.fasta_path)
+        elif self.fasta_backend == 'packed':
+            self.fasta_db = PackedGenome(self.fasta_path)
+        else:
+            raise InvalidOptionError(wrong_value=self.fasta_backend, option_name='fasta_backend',
+                                     valid_values=['pyfasta', 'fai', 'packed'])
+
+    def get_dna_sequences(self, features):
+        """
+        Returns list of the DNA sequences of `features` (in the same order).
+
+        With the 'fai' and 'packed' backends all features are fetched as one batch
+        (sorted reads, shared spans, bulk reverse complements); otherwise one at a time.
+
+        :param features: iterable of `SimpleFeatureGFF3` objects
+        """
+        vitals = [feature.get_vitals() for feature in features]
+        if hasattr(self.fasta_db, 'fetch_many'):
+            return self.fasta_db.fetch_many([(v.seqid, v.start, v.end, v.strand) for v in vitals])
+        return [self.fasta_db.sequence({'chr': v.seqid, 'start': v.start, 'stop': v.end, 'strand': v.strand})
+                for v in vitals]
 
 
 class SimpleFeatureGFF3(intervals.SimpleFeature):
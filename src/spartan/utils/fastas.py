@@ -11,21 +11,46 @@ Purpose:
 
 """
 import collections
-import gzip
 import os
 import sys
 import tempfile
-import math
-from spartan.utils.errors import InvalidFileFormatError, SanityCheckError
-from spartan.utils.externals import run_external_app
-from spartan.utils.misc import fold_seq
+import heapq
+import itertools
+import shelve
+import struct
+
+import numpy as np
+
+from spartan.utils.errors import InvalidFileFormatError, InvalidOptionError, SanityCheckError
+from spartan.utils.files import GzipReader, RecordWriter, map_file, newline_offsets, rewrite_lines
+from spartan.utils.misc import fold_seq, pool_imap
+from spartan.utils.seqs import revcomp, revcomp_batch, window_stats
 
 __author__ = 'Gus Dunn'
 
 
+def _file_mode(chmod):
+    """Returns int file mode from an octal int (0755), an octal str ('755') or a legacy decimal-looking int (755)."""
+    try:
+        if isinstance(chmod, basestring):
+            mode = int(chmod, 8)
+        elif isinstance(chmod, (int, long)) and chmod > 0777 and set(str(chmod)) <= set('01234567'):
+            mode = int(str(chmod), 8)
+        elif isinstance(chmod, (int, long)):
+            mode = chmod
+        else:
+            raise ValueError()
+        if not 0 <= mode <= 07777:
+            raise ValueError()
+    except ValueError:
+        raise InvalidOptionError(wrong_value=chmod, option_name='chmod',
+                                 valid_values="an octal int (0755) or octal str ('755')")
+    return mode
+
+
 class ParseFastA(object):
     """Returns a record-by-record fastA parser analogous to file.readline()."""
-    def __init__(self, filePath, joinWith='', key=None):
+    def __init__(self, filePath, joinWith='', key=None, gzThreads=None):
         """Returns a record-by-record fastA parser analogous to file.readline().
         Exmpl: parser.next()
         Its ALSO an iterator so "for rec in parser" works too!
@@ -34,10 +59,13 @@ class ParseFastA(object):
         joinWith='' results in a single line with no breaks (usually what you want!)
 
         <key> is func used to parse the recName from HeaderInfo.
+
+        <gzThreads> sets how many threads may inflate BGZF blocks of '*.gz' files
+        in parallel (see spartan.utils.files.GzipReader).
         """
 
         if filePath.endswith('.gz'):
-            self._file = gzip.open(filePath)
+            self._file = GzipReader(filePath, threads=gzThreads)
         else:
             self._file = open(filePath, 'rU')
 
@@ -52,6 +80,16 @@ class ParseFastA(object):
     def __iter__(self):
         return self
 
+    def close(self):
+        """Closes the underlying file (stopping a `GzipReader`'s inflating thread)."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def next(self):
         """Reads in next element, parses, and does minimal verification.
         Returns: tuple: (seqName,seqStr)"""
@@ -136,42 +174,638 @@ class ParseFastA(object):
         2) delim is what to spilt on
         3) order is a list of index numbers from the original header, reorganized for the new header.
            Exp: delim=' ',order=[2,0,1]  would produce what is seen above.
-        4) chmod= set new file with this mode (exp: 755)
-        5) lineLen sets fastaSeq line length in new file.
+        4) chmod= set new file with this mode: an octal int (exp: 0755) or octal str (exp: '755').
+           For backwards compatibility, ints above 0777 written with octal digits (exp: 755) are read
+           as octal digits.  A bad mode raises InvalidOptionError before anything is written.
+        5) lineLen sets fastaSeq line length in new file (None keeps the original sequence lines).
+        6) only the header lines go through Python: sequence data is copied (or refolded if lineLen is
+           not None) in large blocks by spartan.utils.files.rewrite_lines ('.gz' in/out ok).
         """
+        mode = _file_mode(chmod)
+        inPath = os.path.abspath(self._file.name)
+        self._file.close()
+
+        def new_header(line):
+            fSplit = self._key(line).lstrip('>').rstrip('\n').split(delim)
+            return '>%s' % (delim.join([fSplit[x] for x in order]))
+
+        if ow:
+            suffix = '.renamed.fas.gz' if inPath.endswith('.gz') else '.renamed.fas'
+            tmpFile = tempfile.NamedTemporaryFile(suffix=suffix, dir=os.path.dirname(inPath), delete=False)
+            tmpFile.close()
+            outPath = tmpFile.name
+        outPath = os.path.abspath(outPath)
+
+        rewrite_lines(inPath, outPath, lineFunc=new_header, linePrefixes=('>',), refold=lineLen)
 
         if ow:
-            outPath = tempfile.NamedTemporaryFile(suffix='.renamed.fas')
+            os.rename(outPath, inPath)
+            outPath = inPath
+
+        try:
+            os.chmod(outPath, mode)
+        except OSError as err:
+            sys.stderr.write('%s\n' % (err))
+
+
+class MappedFastARecord(object):
+    """
+    A fastA rec that is only a set of offsets into a memory mapped file.
+    Acts like the tuple (seqName,seqStr) returned by ParseFastA, but the name and
+    sequence are only copied out of the map (as strs) when they are accessed.
+    """
+    __slots__ = ('_parser', '_headStart', '_seqStart', '_end')
+
+    def __init__(self, parser, headStart, seqStart, end):
+        self._parser = parser
+        self._headStart = headStart
+        self._seqStart = seqStart
+        self._end = end
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        if i < 0:
+            i += 2
+        if i == 0:
+            return self.name
+        elif i == 1:
+            return self.seq
+        raise IndexError("fastA rec index out of range")
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        yield self.name
+        yield self.seq
+
+    def __repr__(self):
+        return 'MappedFastARecord%r' % (self.to_tuple(),)
+
+    @property
+    def header(self):
+        """Full header line (with its '>')."""
+        return self._parser._buf[self._headStart:self._seqStart].rstrip('\n')
+
+    @property
+    def name(self):
+        return self._parser._key(self.header)
+
+    @property
+    def seq(self):
+        seq = self._parser._buf[self._seqStart:self._end]
+        if seq.endswith('\n'):
+            seq = seq[:-1]
+        return seq.replace('\n', self._parser.joinWith)
+
+    def to_tuple(self):
+        return (self.name, self.seq)
+
+
+class MappedFastA(object):
+    """Memory-mapped, zero-copy alternative to ParseFastA for uncompressed fastA files."""
+    def __init__(self, filePath, joinWith='', key=None, blockSize=16777216):
+        """Maps <filePath> into memory and finds the headers in the map itself with NumPy,
+        <blockSize> bytes at a time.  Records are MappedFastARecord objects: they hold
+        offsets into the map and only build the name/sequence strings when they are used.
+        Its an iterator so "for rec in parser" works.
+
+        <joinWith> and <key> work as in ParseFastA.
+
+        NOTE: expects '\\n' line endings (unlike ParseFastA, '\\r' is not removed).
+        """
+        self.filePath = filePath
+        self.joinWith = joinWith
+        if key:
+            self._key = key
         else:
-            outPath = open(outPath, 'w')
+            self._key = lambda x:x[1:].split()[0]
+        self._blockSize = blockSize
+        self._buf, self._array = map_file(filePath)
+        self._recs = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._recs is None:
+            self._recs = self._iter_recs()
+        return self._recs.next()
+
+    def close(self):
+        if not isinstance(self._buf, str):
+            self._array = None
+            self._buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_header_offsets(self):
+        """Yields the offset of each header line's '>', in file order."""
+        size = len(self._array)
+        start = self._buf[:self._blockSize]
+        first = len(start) - len(start.lstrip('\n'))   # skip leading blank lines
+        if first < size:
+            if self._array[first] != 62:
+                raise InvalidFileFormatError('CheckFastaFile: The first line containing text does not start with ">".')
+            yield first
+        for pos in xrange(first, size, self._blockSize):
+            newLines = newline_offsets(self._array, pos, min(pos + self._blockSize, size - 1))
+            for offset in (newLines[self._array[newLines + 1] == 62] + 1).tolist():
+                yield offset
+
+    def _iter_recs(self):
+        buf = self._buf
+        headStart = None
+        for nextHead in itertools.chain(self.iter_header_offsets(), [len(buf)]):
+            if headStart is not None:
+                headEnd = buf.find('\n', headStart, nextHead)
+                seqStart = nextHead if headEnd == -1 else headEnd + 1
+                yield MappedFastARecord(self, headStart, seqStart, nextHead)
+            headStart = nextHead
+
+    def to_dict(self):
+        """Returns a single Dict populated with the fastaRecs contained in the file."""
+        fasDict = {}
+        for rec in self:
+            name, seq = rec
+            if name in fasDict:
+                raise InvalidFileFormatError, "DuplicateFastaRec: %s occurs in your file more than once." % (name)
+            fasDict[name] = seq
+        return fasDict
+
+
+#### ----- faidx-style indexed access  <BEGIN> ----- ####
+def build_fai(fastaPath, faiPath=None):
+    """
+    Writes a samtools faidx compatible index of the uncompressed fastA file at <fastaPath>
+    to <faiPath> (default: <fastaPath>.fai) and returns <faiPath>.
+
+    Each line of the index holds: name, length, offset, bases per line, bytes per line.
+    As with samtools, every sequence line except the last one of a record must have the same length.
+
+    :param fastaPath: path to fastA file
+    :param faiPath: path to the new index
+    """
+    if faiPath is None:
+        faiPath = fastaPath + '.fai'
+
+    fasta = MappedFastA(fastaPath)
+    array = fasta._array
+    names = set()
+    rows = []
+    for rec in fasta._iter_recs():
+        name = rec.name
+        if name in names:
+            raise InvalidFileFormatError("DuplicateFastaRec: %s occurs in your file more than once." % (name))
+        names.add(name)
+
+        seqStart, end = rec._seqStart, rec._end
+        newLines = newline_offsets(array, seqStart, end)
+        lineStarts = np.concatenate([[seqStart], newLines + 1])
+        lineEnds = np.append(newLines, end)
+        lineLens = lineEnds - lineStarts
+        # drop the empty tail left by the record's final '\n' (and any trailing blank lines)
+        filled = np.flatnonzero(lineLens)
+        lineLens = lineLens[:filled[-1] + 1] if len(filled) else lineLens[:0]
+
+        if len(lineLens) > 1 and ((lineLens[:-1] != lineLens[0]).any() or lineLens[-1] > lineLens[0]):
+            raise InvalidFileFormatError("Different line lengths in sequence '%s' of %s." % (name, fastaPath))
+
+        lineBases = lineLens[0] if len(lineLens) else 0
+        rows.append('%s\t%s\t%s\t%s\t%s\n' % (name, lineLens.sum(), seqStart, lineBases,
+                                              lineBases + 1 if lineBases else 0))
+    fasta.close()
+
+    with open(faiPath, 'w') as out:
+        out.writelines(rows)
+    return faiPath
+
+
+class IndexedSeq(object):
+    """One sequence of an IndexedFastA or PackedGenome: supports len() and 0-based slicing, like pyfasta's records."""
+    def __init__(self, fasta, name):
+        self._fasta = fasta
+        self.name = name
+
+    def __len__(self):
+        return self._fasta.length(self.name)
+
+    def __getitem__(self, i):
+        length = len(self)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(length)
+            if start >= stop:
+                return ''
+            seq = self._fasta.fetch(self.name, start + 1, stop)
+            return seq if step == 1 else seq[::step]
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError("sequence index out of range")
+        return self._fasta.fetch(self.name, i + 1, i + 1)
+
+    def __str__(self):
+        return self._fasta.fetch(self.name)
+
+
+class SeqStore(object):
+    """
+    Shared interface of the random access sequence stores (IndexedFastA, PackedGenome).
+
+    Subclasses set ``self._names`` (names in file order), ``self._index`` (name -> info, length first),
+    ``self._buf``/``self._array`` (see spartan.utils.files.map_file) and provide ``self.fetch()``.
+    """
+    def keys(self):
+        """Returns list of sequence names in file order."""
+        return list(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError(name)
+        return IndexedSeq(self, name)
+
+    def close(self):
+        if not isinstance(self._buf, str):
+            self._array = None
+            self._buf.close()
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *args):
+        self.close()
+
+    def length(self, name):
+        """Returns length of sequence <name>."""
+        return self._index[name][0]
+
+    def sequence(self, interval, one_based=True):
+        """
+        pyfasta compatible fetch: <interval> is dict-like with keys 'chr', 'start', 'stop' and
+        optionally 'strand' (1/-1 or '+'/'-'). Coordinates are inclusive and 1-based unless <one_based> is False.
+        """
+        start = interval['start'] + (0 if one_based else 1)
+        stop = interval['stop']
+        return self.fetch(interval['chr'], start, stop, interval.get('strand', 1))
+
+    def iter_fetch_many(self, regions, chunkSize=10000, maxSpan=4194304):
+        """
+        Yields the sequences of many <regions> IN INPUT ORDER.
+
+        Each region is a sequence: (name, start, end[, strand]) using the coordinates of ``self.fetch()``;
+        a list of tuples or a NumPy record array both work.  Regions are taken <chunkSize> at a time and
+        sorted by their position in the file.  Neighbouring regions of a sequence then share a single
+        read of up to <maxSpan> bases (longer regions are read on their own), and all minus-strand
+        regions of a chunk are reverse complemented in one go.
+        """
+        order = dict((name, i) for i, name in enumerate(self._names))
+        regions = iter(regions)
         while 1:
-            try:
-                f = self.next()
-            except StopIteration:
+            chunk = [tuple(region) for region in itertools.islice(regions, chunkSize)]
+            if not chunk:
                 break
-            fSplit  = f[0].lstrip('>').rstrip('\n').split(delim)
-            newHead = delim.join([fSplit[x] for x in order])
-            outPath.write('>%s\n%s\n' % (newHead, '\n'.join(fold_seq(f[1], lineLen))))
+            for seq in self._fetch_chunk(chunk, order, maxSpan):
+                yield seq
+
+    def fetch_many(self, regions, **kwargs):
+        """Returns list of the sequences of <regions> in input order (see ``self.iter_fetch_many()``)."""
+        return list(self.iter_fetch_many(regions, **kwargs))
+
+    def _fetch_chunk(self, chunk, order, maxSpan):
+        names = [region[0] for region in chunk]
+        starts = [int(region[1]) for region in chunk]
+        ends = [min(int(region[2]), self.length(name)) for region, name in zip(chunk, names)]
+        if min(starts) < 1:
+            raise ValueError("`start` must be >= 1 (1-based coordinates), not %s." % (min(starts)))
+
+        seqs = [''] * len(chunk)
+        span = None   # [name, start, end, member indexes]
+
+        def read_span(name, spanStart, spanEnd, members):
+            text = self.fetch(name, spanStart, spanEnd)
+            for i in members:
+                seqs[i] = text[starts[i] - spanStart:ends[i] - spanStart + 1]
+
+        for i in sorted(range(len(chunk)), key=lambda i: (order[names[i]], starts[i])):
+            if starts[i] > ends[i]:
+                continue
+            if span is not None and span[0] == names[i] and max(span[2], ends[i]) - span[1] < maxSpan:
+                span[2] = max(span[2], ends[i])
+                span[3].append(i)
+            else:
+                if span is not None:
+                    read_span(*span)
+                span = [names[i], starts[i], ends[i], [i]]
+        if span is not None:
+            read_span(*span)
+
+        minus = [i for i, region in enumerate(chunk) if len(region) > 3 and region[3] in (-1, '-', '-1')]
+        if minus:
+            for i, seq in zip(minus, revcomp_batch([seqs[i] for i in minus])):
+                seqs[i] = seq
+        return seqs
+
+    def write_regions(self, regions, outPath, names=None, lineLen=60, compressLevel=None, **kwargs):
+        """
+        Writes the sequences of <regions> (see ``self.iter_fetch_many()``) to the fastA file <outPath>
+        ('.gz' ok) in input order and returns the number written.
 
-        self._file.close()
+        <names> gives the header of each region; default: 'name:start-end(strand)'.
+        """
+        regions, forNames = itertools.tee(regions)
+        if names is None:
+            names = ('%s:%s-%s(%s)' % (region[0], region[1], region[2], '-' if len(region) > 3 and
+                                        region[3] in (-1, '-', '-1') else '+') for region in forNames)
+        count = 0
+        with RecordWriter(outPath, compressLevel=compressLevel) as out:
+            for name, seq in itertools.izip(names, self.iter_fetch_many(regions, **kwargs)):
+                out.write('>%s\n%s\n' % (name, '\n'.join(fold_seq(seq, lineLen))))
+                count += 1
+        return count
+
+
+class IndexedFastA(SeqStore):
+    """Random access to the sequences of an uncompressed fastA file through a .fai index and a memory map."""
+    def __init__(self, fastaPath, faiPath=None, rebuild=False):
+        """Maps <fastaPath> and loads its samtools style index <faiPath> (default: <fastaPath>.fai).
+        The index is (re)built if it is missing, older than the fastA file or <rebuild> is True.
+
+        Nothing but the index is ever loaded: lengths come straight from the index and
+        subsequences are sliced out of the map.
+
+        Exmpl:
+        fasta = IndexedFastA('genome.fa')
+        fasta.length('chr1')
+        fasta.fetch('chr1', 1001, 2000, strand=-1)   # 1-based, inclusive
+        fasta['chr1'][1000:2000]                     # 0-based, half open (like pyfasta)
+        """
+        if faiPath is None:
+            faiPath = fastaPath + '.fai'
+        if rebuild or not os.path.exists(faiPath) or os.path.getmtime(faiPath) < os.path.getmtime(fastaPath):
+            build_fai(fastaPath, faiPath)
+
+        self.fastaPath = fastaPath
+        self.faiPath = faiPath
+        self._names = []
+        self._index = {}
+        with open(faiPath) as fai:
+            for line in fai:
+                fields = line.rstrip('\n').split('\t')
+                self._names.append(fields[0])
+                self._index[fields[0]] = tuple(int(x) for x in fields[1:5])
+        self._buf, self._array = map_file(fastaPath)
+
+    def _byte_offset(self, name, pos):
+        """Returns offset in the file of 0-based position <pos> of sequence <name>."""
+        length, offset, lineBases, lineWidth = self._index[name]
+        return offset + (pos // lineBases) * lineWidth + (pos % lineBases)
+
+    def fetch(self, name, start=1, end=None, strand=1):
+        """
+        Returns the sequence of <name> from <start> to <end> (1-based, inclusive; <end> is
+        clipped to the sequence length).  A <strand> of -1 or '-' returns the reverse complement.
+        """
+        length = self._index[name][0]
+        if end is None or end > length:
+            end = length
+        if start < 1:
+            raise ValueError("`start` must be >= 1 (1-based coordinates), not %s." % (start))
+        if start > end:
+            return ''
 
-        absPath = os.path.abspath
-        if ow:
-            outPath.flush()
-            outPath.delete = False
-            os.rename(absPath(outPath.name), absPath(self._file.name))
+        seq = self._buf[self._byte_offset(name, start - 1):self._byte_offset(name, end - 1) + 1].replace('\n', '')
+        if strand in (-1, '-', '-1'):
+            seq = revcomp(seq)
+        return seq
+
+#### ----- faidx-style indexed access  <END> ----- ####
 
-            try:
-                chmodResult = run_external_app('chmod', '%s %s' % (chmod, absPath(self._file.name)))
-            except ExternalError as err:
-                sys.stderr.write('%s\n' % (err))
-        else:
-            try:
-                outPath.close()
-                chmodResult = run_external_app('chmod', '%s %s' % (chmod, absPath(outPath.name)))
-            except ExternalError as err:
-                sys.stderr.write('%s\n' % (err))
+
+#### ----- 2-bit packed genomes  <BEGIN> ----- ####
+PACKED_MAGIC = 'SPTNPKG1'
+
+# byte -> 2-bit code (A=0, C=1, G=2, T=3); everything else is stored as 0 and covered by an N run
+_PACK_CODES = np.zeros(256, dtype=np.uint8)
+_PACK_IS_N = np.ones(256, dtype=bool)
+for _code, _base in enumerate('ACGT'):
+    for _b in (_base, _base.lower()):
+        _PACK_CODES[ord(_b)] = _code
+        _PACK_IS_N[ord(_b)] = False
+
+# packed byte -> its 4 bases (first base in the high bits)
+_UNPACK_BASES = np.array([[ord('ACGT'[(byte >> shift) & 3]) for shift in (6, 4, 2, 0)] for byte in range(256)],
+                         dtype=np.uint8)
+
+
+def _true_runs(mask):
+    """Returns int64 array (n, 2) of the [start, end) runs of True in boolean array <mask>."""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.view(np.int8), [0]])))
+    return edges.reshape(-1, 2).astype(np.int64)
+
+
+def _write_aligned(out, data):
+    """Writes <data> to <out> starting on an 8-byte boundary and returns the offset it starts at."""
+    pad = -out.tell() % 8
+    out.write('\0' * pad)
+    offset = out.tell()
+    out.write(data)
+    return offset
+
+
+def pack_fasta(fastaPath, packedPath=None):
+    """
+    Writes the records of <fastaPath> to a single PackedGenome file (default: <fastaPath>.spkg) and returns its path.
+
+    Each sequence is stored as 2 bits per base plus two run tables: one for N (any non-ACGT letter;
+    IUPAC ambiguity codes come back as 'N') and one for lowercase (soft-masked) stretches.
+    Records are streamed one at a time.
+
+    File layout: magic, per sequence: packed bases, N runs, mask runs (8-byte aligned),
+    then a tab delimited index and a trailer holding the index's offset and size.
+    """
+    if packedPath is None:
+        packedPath = fastaPath + '.spkg'
+
+    index = []
+    names = set()
+    with open(packedPath, 'wb') as out:
+        out.write(PACKED_MAGIC)
+        for name, seq in ParseFastA(fastaPath):
+            if name in names:
+                raise InvalidFileFormatError("DuplicateFastaRec: %s occurs in your file more than once." % (name))
+            names.add(name)
+
+            bases = np.frombuffer(seq, dtype=np.uint8) if seq else np.zeros(0, dtype=np.uint8)
+            codes = np.zeros(4 * ((len(bases) + 3) // 4), dtype=np.uint8)
+            codes[:len(bases)] = _PACK_CODES[bases]
+            codes = codes.reshape(-1, 4)
+            packed = (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+
+            nRuns = _true_runs(_PACK_IS_N[bases])
+            maskRuns = _true_runs(bases >= ord('a'))
+
+            index.append('\t'.join(map(str, [name, len(bases),
+                                             _write_aligned(out, packed.tostring()),
+                                             _write_aligned(out, nRuns.tostring()), len(nRuns),
+                                             _write_aligned(out, maskRuns.tostring()), len(maskRuns)])))
+
+        indexText = '\n'.join(index)
+        indexOffset = _write_aligned(out, indexText)
+        out.write(struct.pack('<QQ', indexOffset, len(indexText)))
+
+    return packedPath
+
+
+def is_packed_genome(path):
+    """Returns True if <path> is a PackedGenome file."""
+    with open(path, 'rb') as f:
+        return f.read(len(PACKED_MAGIC)) == PACKED_MAGIC
+
+
+class PackedGenome(SeqStore):
+    """2-bit packed, memory-mapped genome with N and soft-mask run tables (see pack_fasta)."""
+    def __init__(self, path, packedPath=None, rebuild=False):
+        """Opens the PackedGenome file <path>.  If <path> is a fastA file instead, its packed version
+        <packedPath> (default: <path>.spkg) is opened, after (re)building it if it is missing,
+        older than the fastA file or <rebuild> is True.
+
+        The file is memory-mapped read-only, so many processes opening the same file share one copy.
+        Slices are decoded with NumPy lookups straight from the map.
+
+        Exmpl:
+        genome = PackedGenome('genome.fa')
+        genome.fetch('chr1', 1001, 2000, strand=-1)   # 1-based, inclusive
+        genome['chr1'][1000:2000]                     # 0-based, half open (like pyfasta)
+        """
+        if not is_packed_genome(path):
+            if packedPath is None:
+                packedPath = path + '.spkg'
+            if rebuild or not os.path.exists(packedPath) or os.path.getmtime(packedPath) < os.path.getmtime(path):
+                pack_fasta(path, packedPath)
+            path = packedPath
+
+        self.path = path
+        self._buf, self._array = map_file(path)
+        indexOffset, indexLen = struct.unpack('<QQ', self._buf[-16:])
+        self._names = []
+        self._index = {}
+        for line in self._buf[indexOffset:indexOffset + indexLen].split('\n'):
+            if not line:
+                continue
+            fields = line.split('\t')
+            self._names.append(fields[0])
+            self._index[fields[0]] = tuple(int(x) for x in fields[1:])
+
+    def _runs(self, offset, count):
+        if not count:
+            return np.zeros((0, 2), dtype=np.int64)
+        return np.frombuffer(self._buf, dtype=np.int64, count=2 * count, offset=offset).reshape(-1, 2)
+
+    def _run_mask(self, runs, start, end):
+        """Returns boolean array over [start, end) (0-based) that is True inside <runs>, or None if none overlap."""
+        first = np.searchsorted(runs[:, 1], start, side='right')
+        last = np.searchsorted(runs[:, 0], end, side='left')
+        if first >= last:
+            return None
+        runs = np.clip(runs[first:last], start, end) - start
+        # runs never touch each other, so their edges are all distinct
+        edges = np.zeros(end - start + 1, dtype=np.int8)
+        edges[runs[:, 0]] += 1
+        edges[runs[:, 1]] -= 1
+        return np.cumsum(edges[:-1], dtype=np.int8).view(bool)
+
+    def fetch(self, name, start=1, end=None, strand=1):
+        """
+        Returns the sequence of <name> from <start> to <end> (1-based, inclusive; <end> is
+        clipped to the sequence length).  A <strand> of -1 or '-' returns the reverse complement.
+        """
+        length, packedOffset, nOffset, numN, maskOffset, numMask = self._index[name]
+        if end is None or end > length:
+            end = length
+        if start < 1:
+            raise ValueError("`start` must be >= 1 (1-based coordinates), not %s." % (start))
+        if start > end:
+            return ''
+
+        start0 = start - 1
+        firstByte = packedOffset + start0 // 4
+        lastByte = packedOffset + (end - 1) // 4 + 1
+        letters = _UNPACK_BASES[self._array[firstByte:lastByte]].ravel()[start0 % 4:start0 % 4 + end - start0]
+
+        isN = self._run_mask(self._runs(nOffset, numN), start0, end)
+        if isN is not None:
+            letters[isN] = ord('N')
+        isMasked = self._run_mask(self._runs(maskOffset, numMask), start0, end)
+        if isMasked is not None:
+            letters[isMasked] |= 0x20
+
+        seq = letters.tostring()
+        if strand in (-1, '-', '-1'):
+            seq = revcomp(seq)
+        return seq
+
+#### ----- 2-bit packed genomes  <END> ----- ####
+
+
+#### ----- sliding-window statistics  <BEGIN> ----- ####
+# store opened by each window statistics worker process (set by _set_window_store)
+_WINDOW_STORE = None
+
+
+def _set_window_store(storeFactory, path):
+    global _WINDOW_STORE
+    _WINDOW_STORE = storeFactory(path)
+
+
+def _store_window_stats(job):
+    seqid, winSize, step, partial = job
+    return seqid, window_stats(_WINDOW_STORE.fetch(seqid), winSize, step=step, partial=partial)
+
+
+def _rec_window_stats(job):
+    (seqid, seq), winSize, step, partial = job
+    return seqid, window_stats(seq, winSize, step=step, partial=partial)
+
+
+def fasta_window_stats(fastaPath, winSize, step=None, partial=False, processes=None, storeFactory=IndexedFastA):
+    """
+    Yields (seqid, `Bunch` from `seqs.window_stats`) for every record of a fastA file, in file order.
+
+    Uncompressed files are opened with ``storeFactory`` (``IndexedFastA`` or ``PackedGenome``) in each worker
+    and contigs are handed out to ``processes`` worker processes by name.  '.gz' files are streamed through
+    ``ParseFastA`` and their records sent to the workers.  Feed the results to `seqs.write_bedgraph` for
+    bedGraph output.
+
+    :param fastaPath: path to fastA file (or PackedGenome file)
+    :param winSize: window length
+    :param step: distance between window starts (default: ``winSize``)
+    :param partial: also return the shorter windows at the end of each contig
+    :param processes: number of worker processes
+    :param storeFactory: class used to open uncompressed files
+    """
+    if fastaPath.endswith('.gz'):
+        jobs = ((rec, winSize, step, partial) for rec in ParseFastA(fastaPath))
+        return pool_imap(_rec_window_stats, jobs, processes=processes)
+
+    jobs = [(seqid, winSize, step, partial) for seqid in storeFactory(fastaPath).keys()]
+    return pool_imap(_store_window_stats, jobs, processes=processes,
+                     initializer=_set_window_store, initargs=(storeFactory, fastaPath))
+
+#### ----- sliding-window statistics  <END> ----- ####
 
 
 def rename_fasta_headers(in_path, out_path, header_func):
@@ -191,86 +825,177 @@ def rename_fasta_headers(in_path, out_path, header_func):
         - out_path
         - header_func
     DOES:
-        - Reads in in_path file one line at a time
+        - Reads in in_path file a large block at a time
         - If the line is a fasta header (starts with '>')
           uses header_func logic to rearrange the header and
           writes out the changed line to out_path.
-        - If not a header, writes same line out to out_path.
-        - Closes both file objects.
+        - Copies all other lines to out_path untouched, as whole blocks
+          (see spartan.utils.files.rewrite_lines; '.gz' in/out ok).
     RETURNS:
         - None
     """
 
-    in_file = open(in_path,'rU')
-    out_file = open(out_path,'w')
+    rewrite_lines(in_path, out_path, lineFunc=lambda line: header_func(line + '\n').rstrip('\n'), linePrefixes=('>',))
 
-    for line in in_file:
-        if line.startswith('>'):
-            line = header_func(line)
-            # Handle and ensure that each modified line has one and only one \n
-            line = line.rstrip('\n') + '\n'
-        else:
-            pass
 
-        out_file.write(line)
+def fasta_rec_lengths(fasta_path, block_size=8388608, key=None):
+    """
+    Returns list of (recName, length) for every record in a fasta file, in file order,
+    without ever building the sequence strings.
+
+    The file is read in blocks of `block_size` bytes; sequence lengths are counted with `str.count()`
+    over whole runs of sequence lines and only header lines are turned into strings.
+
+    :param fasta_path: Path to fasta file ('.gz' ok)
+    :param block_size: bytes read at a time
+    :param key: func used to parse the recName from the header line (default as in `ParseFastA`)
+    """
+    if key is None:
+        key = lambda x: x[1:].split()[0]
+    if fasta_path.endswith('.gz'):
+        fasta = GzipReader(fasta_path)
+    else:
+        fasta = open(fasta_path, 'rb')
+
+    recs = []
+    name = None
+    length = 0
+    carry = ''
+    try:
+        while 1:
+            block = fasta.read(block_size)
+            buf = carry + block
+            cut = len(buf)
+            if block:
+                cut = buf.rfind('\n') + 1
+                if not cut:
+                    # no complete line yet: only hold on to it if it is (part of) a header
+                    if buf.startswith('>'):
+                        carry = buf
+                        continue
+                    cut = len(buf)
+            text, carry = buf[:cut], buf[cut:]
+
+            pos = 0
+            while pos < len(text):
+                if text.startswith('>', pos):
+                    head_end = text.find('\n', pos)
+                    if head_end == -1:
+                        head_end = len(text)
+                    if name is not None:
+                        recs.append((name, length))
+                    name = key(text[pos:head_end].rstrip('\r'))
+                    length = 0
+                    pos = head_end + 1
+                else:
+                    next_head = text.find('\n>', pos)
+                    seq_end = len(text) if next_head == -1 else next_head + 1
+                    bases = seq_end - pos - text.count('\n', pos, seq_end) - text.count('\r', pos, seq_end)
+                    if name is None and bases:
+                        raise InvalidFileFormatError('CheckFastaFile: The first line containing text does not start with ">".')
+                    length += bases
+                    pos = seq_end
+
+            if not block:
+                break
+    finally:
+        fasta.close()
+
+    if name is not None:
+        recs.append((name, length))
+    return recs
+
 
-    in_file.close()
-    out_file.close()
+def _fasta_rec_lengths_or_none(fasta_path):
+    """`fasta_rec_lengths` for `pool_imap`: returns None for files that are not valid fasta."""
+    try:
+        return fasta_rec_lengths(fasta_path)
+    except InvalidFileFormatError:
+        return None
 
 
-def fastaRec_length_indexer(fastaFiles):
+def fastaRec_length_indexer(fastaFiles, lengthsOnly=False, processes=None, cachePath=None):
     """
     GIVEN:
     1) fastaFiles: list of fasta files or dirs containing fasta files
+    2) lengthsOnly: if True, only lengths are measured (no sequences are kept)
+    3) processes: number of files measured at once in worker processes (lengthsOnly mode)
+    4) cachePath: shelve file caching each file's lengths, keyed by its path, size and mtime
+       (lengthsOnly mode; default None: no cache).  The shelve is not locked, so runs that may
+       overlap in time should not share one.
 
     DO:
     1) iterate through all fasta files recording recName and length to a dict
 
     RETURN:
-    1) dict with recName and lengths
+    1) tuple: (dict with recName and lengths, dict with recName and seqs)
+       the seq dict is None in lengthsOnly mode.
 
     NOTES:
     1) will complain if it sees more than one fastaRec with the same name ONLY
        if one of the length values disagrees with those already seen.
+    2) files that are not valid fasta (and subdirs of the given dirs) are ignored.
+    3) in lengthsOnly mode, files whose path, size and mtime match the cache are not read at all.
     """
     recDict = {}
     seqDict = {}
     tmpDict = collections.defaultdict(list)
 
+    paths = []
     for each in fastaFiles:
-        try:
+        if os.path.isdir(each):
             # if each is a directory, measure all recs in all fasta files in that dir (ignore subdirs)
-            paths = os.listdir(each)
-            for p in paths:
-                try:
-                    p = ParseFastA(p)
-                    for name,seq in p:
-                        tmpDict[name].append(len(seq))
-                        seqDict[name] = seq
-                except IOError:
-                    # most likely p was a dir, ignore
-                    ## TODO: logging code here to inform when this happens
-                    pass
-                except InvalidFileFormatError:
-                    # most likely p did not have valid fasta format, ignore
-                    ## TODO: logging code here to inform when this happens
-                    pass
-
-        except OSError as errTxt:
-            if not ('Not a directory' in errTxt):
-                raise
-            else:
-                # if each is a file, measure all recs in file
-                try:
-                    p = ParseFastA(each)
-                    for name,seq in p:
-                        tmpDict[name].append(len(seq))
-                        seqDict[name] = seq
-                except InvalidFileFormatError:
-                    # most likely p did not have valid fasta format, ignore
-                    ## TODO: logging code here to inform when this happens
-                    pass
+            paths.extend(p for p in sorted(os.path.join(each, name) for name in os.listdir(each))
+                         if os.path.isfile(p))
+        else:
+            paths.append(each)
+
+    if lengthsOnly:
+        seqDict = None
+        cache = None
+        if cachePath:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(cachePath))):
+                os.makedirs(os.path.dirname(os.path.abspath(cachePath)))
+            cache = shelve.open(cachePath)
 
+        try:
+            fileRecs = {}
+            toMeasure = []
+            for path in paths:
+                stat = os.stat(path)
+                cacheKey = os.path.abspath(path)
+                cached = cache.get(cacheKey) if cache is not None else None
+                if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime):
+                    fileRecs[path] = cached[2]
+                else:
+                    toMeasure.append(path)
+
+            for path, recs in itertools.izip(toMeasure, pool_imap(_fasta_rec_lengths_or_none, toMeasure,
+                                                                  processes=processes)):
+                fileRecs[path] = recs
+                if cache is not None:
+                    stat = os.stat(path)
+                    cache[os.path.abspath(path)] = (stat.st_size, stat.st_mtime, recs)
+        finally:
+            if cache is not None:
+                cache.close()
+
+        for path in paths:
+            # None: most likely path did not have valid fasta format, ignore
+            ## TODO: logging code here to inform when this happens
+            for name, length in fileRecs[path] or []:
+                tmpDict[name].append(length)
+    else:
+        for path in paths:
+            try:
+                p = ParseFastA(path)
+                for name,seq in p:
+                    tmpDict[name].append(len(seq))
+                    seqDict[name] = seq
+            except InvalidFileFormatError:
+                # most likely p did not have valid fasta format, ignore
+                ## TODO: logging code here to inform when this happens
+                pass
 
     for rec,lengths in tmpDict.iteritems():
         if not (len(set(lengths)) == 1):
@@ -283,32 +1008,126 @@ def fastaRec_length_indexer(fastaFiles):
     return (recDict,seqDict)
 
 
+def scan_fasta_headers(fasta_path, block_size=8388608, gz_threads=None):
+    """
+    Yields tuples: (offset, header) for every record in a fasta file without touching the sequence data.
+
+    The file is read in blocks of `block_size` bytes that are searched for '\\n>' (so the cost is about that of one
+    sequential read) and only the header lines are ever turned into strings.  `offset` is the position of the
+    header's '>' in the (uncompressed) data and `header` is the full header line including its '>'.
+
+    :param fasta_path: Path to fasta file ('.gz' ok)
+    :param block_size: bytes read at a time
+    :param gz_threads: passed on to `GzipReader` for '.gz' files
+    """
+    if fasta_path.endswith('.gz'):
+        fasta = GzipReader(fasta_path, threads=gz_threads)
+    else:
+        fasta = open(fasta_path, 'rb')
+
+    try:
+        first = fasta.read(block_size)
+        text = first.lstrip('\n')
+        if text and not text.startswith('>'):
+            raise InvalidFileFormatError('CheckFastaFile: The first line containing text does not start with ">".')
+
+        # `buf` always starts one char before the unsearched data so that a '\n>' split across blocks is found
+        buf = '\n' + text
+        buf_offset = len(first) - len(text) - 1   # file offset of buf[0]
+        at_eof = not first
+        while buf:
+            if not at_eof:
+                block = fasta.read(block_size)
+                at_eof = not block
+            else:
+                block = ''
+
+            pos = 0
+            keep_from = len(buf) - 1
+            while 1:
+                pos = buf.find('\n>', pos)
+                if pos == -1:
+                    break
+                line_end = buf.find('\n', pos + 1)
+                if line_end == -1:
+                    if not at_eof:
+                        # header runs into the next block
+                        keep_from = pos
+                        break
+                    line_end = len(buf)
+                yield buf_offset + pos + 1, buf[pos + 1:line_end].rstrip('\r')
+                pos = line_end
+
+            if at_eof and not block:
+                break
+            buf_offset += keep_from
+            buf = buf[keep_from:] + block
+    finally:
+        fasta.close()
+
+
 def count_fasta_recs_in_file(fasta_path):
     """
     Returns number of records contained in a fasta file.
 
+    Only the headers are scanned (see `scan_fasta_headers`), so sequence data is never loaded.
+    Raises InvalidFileFormatError if a record name (the header's first word) occurs more than once.
+
     :param fasta_path: Path to fasta file
     """
-    return len(ParseFastA(fasta_path).to_dict().keys())
+    names = set()
+    for offset, header in scan_fasta_headers(fasta_path):
+        name = header[1:].split()[0]
+        if name in names:
+            raise InvalidFileFormatError, "DuplicateFastaRec: %s occurs in your file more than once." % (name)
+        names.add(name)
+    return len(names)
+
 
+def _out_rec_size(name, length, balance_by, line_len):
+    """Returns the weight of a record in `divide_fasta_file`: its bases or the bytes it takes when written out."""
+    if balance_by == 'bases':
+        return length
+    num_lines = (length + line_len - 1) // line_len
+    return len(name) + 3 + length + max(num_lines - 1, 0)
 
-def divide_fasta_file(fasta_path, divide_by=2, out_path_base=None):
+
+def _fasta_rec_lengths(fasta_path):
+    """Returns list of (name, length) for the records of `fasta_path` from its .fai if current, else by a streaming pass."""
+    fai_path = fasta_path + '.fai'
+    if os.path.exists(fai_path) and os.path.getmtime(fai_path) >= os.path.getmtime(fasta_path):
+        with open(fai_path) as fai:
+            return [(fields[0], int(fields[1])) for fields in (line.split('\t') for line in fai)]
+    return fasta_rec_lengths(fasta_path)
+
+
+def divide_fasta_file(fasta_path, divide_by=2, out_path_base=None, balance_by='bases', method='greedy', line_len=100):
     """
-    Returns tuple of paths to resulting files.
-    Splits and writes out records in ``fasta_path`` to new files.
-    Default ``out_path_base`` derived from ``fasta_path``.
+    Returns list of paths to resulting files.
+    Splits and writes out records in ``fasta_path`` to ``divide_by`` new files so that each one ends up with about the
+    same total number of bases (or bytes), in a single streaming pass holding only one record in memory.
+    Default ``out_path_base`` derived from ``fasta_path``; shard ``n`` is written to ``<out_path_base>.<n><ext>``.
+    Resulting files are gzipped when their extension is '.gz' (ie when ``fasta_path`` is).
+    Shards that receive no records are not created.
+
+    Bin packing ``method``:
+
+    * 'greedy': each record goes to the currently lightest shard as it streams by (no extra pass).
+    * 'index': records are placed largest first into the lightest shard (LPT), which balances better when sizes
+      vary a lot.  Sizes come from ``<fasta_path>.fai`` when it is current, otherwise from an extra streaming pass.
 
     :param fasta_path: Path to fasta file
     :param divide_by: Number of files to divide the fasta records into
     :param out_path_base: Base path for resulting fasta files
-
+    :param balance_by: 'bases' or 'bytes' (size of the written records)
+    :param method: 'greedy' or 'index'
+    :param line_len: sequence line length in the resulting files
     """
     assert isinstance(divide_by, int)
-
-    num_fastas = count_fasta_recs_in_file(fasta_path)
-    recs_per_file = math.ceil(num_fastas/divide_by)
-
-    out_paths = []
+    if balance_by not in ('bases', 'bytes'):
+        raise InvalidOptionError(wrong_value=balance_by, option_name='balance_by', valid_values=['bases', 'bytes'])
+    if method not in ('greedy', 'index'):
+        raise InvalidOptionError(wrong_value=method, option_name='method', valid_values=['greedy', 'index'])
 
     ext = '.fas'
     if out_path_base is None:
@@ -317,38 +1136,38 @@ def divide_fasta_file(fasta_path, divide_by=2, out_path_base=None):
     out_path_template = "{out_base}.{file_num}{ext}"
     fasta_seq_template = ">{header}\n{seq_lines}\n"
 
-    for index, (header, seq) in enumerate(ParseFastA(fasta_path).to_dict().iteritems()):
-
-        # create a switch after every `recs_per_file` records that opens a new file for writing
-        if index % recs_per_file == 0:
-            current_out_path = out_path_template.format(out_base=out_path_base,
-                                                        file_num=index,
-                                                        ext=ext)
-            # Record out_path
-            out_paths.append(current_out_path)
-
-            # Close current file if it exists
-            try:
-                out_file.close()
-            except NameError:
-                pass
-
-            # create new out_file with current path
-            out_file = open(current_out_path, 'w')
-
-        # with this fasta dict item,
-        # fold seqs into '\n' delimited string
-        # append to new header
-        # write to file
-
-        seq_lines = fold_seq(seq, lineLen=100)
-
-        fasta_record = fasta_seq_template.format(header=header,
-                                                 seq_lines='\n'.join(seq_lines))
-        out_file.write(fasta_record)
-
-    return out_paths
-
-
-
-
+    # (shard weight, shard number) heap: the lightest shard is always on top
+    shard_heap = [(0, shard) for shard in range(divide_by)]
+
+    assignments = None
+    if method == 'index':
+        sizes = [_out_rec_size(name, length, balance_by, line_len) for name, length in _fasta_rec_lengths(fasta_path)]
+        assignments = [0] * len(sizes)
+        for ordinal in sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True):
+            weight, shard = heapq.heappop(shard_heap)
+            assignments[ordinal] = shard
+            heapq.heappush(shard_heap, (weight + sizes[ordinal], shard))
+
+    out_files = {}
+    try:
+        for ordinal, (header, seq) in enumerate(ParseFastA(fasta_path)):
+            if assignments is None:
+                weight, shard = heapq.heappop(shard_heap)
+                heapq.heappush(shard_heap, (weight + _out_rec_size(header, len(seq), balance_by, line_len), shard))
+            else:
+                shard = assignments[ordinal]
+
+            if shard not in out_files:
+                out_files[shard] = RecordWriter(out_path_template.format(out_base=out_path_base,
+                                                                         file_num=shard,
+                                                                         ext=ext),
+                                                bufferSize=1048576)
+
+            fasta_record = fasta_seq_template.format(header=header,
+                                                     seq_lines='\n'.join(fold_seq(seq, lineLen=line_len)))
+            out_files[shard].write(fasta_record)
+    finally:
+        for out_file in out_files.itervalues():
+            out_file.close()
+
+    return [out_files[shard].name for shard in sorted(out_files)]
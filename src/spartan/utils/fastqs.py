@@ -0,0 +1,509 @@
+# fastqs.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+#
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+fastqs.py
+=================================================
+Purpose:
+Batch-oriented tools for fastQ records as produced by ``spartan.utils.files.ParseFastQ``:
+read filters, subsampling and QC profiles.
+
+The read filters here work on whole batches of records (see ``ParseFastQ.iter_batches``) by decoding
+all quality strings of a batch into a single NumPy array.  Each filter is also callable on a single record,
+so they can be handed to anything expecting a ``filterFunc``/``key`` returning True/False.
+"""
+import abc
+import csv
+import itertools
+
+import numpy as np
+
+from spartan.utils.errors import InvalidFileFormatError
+from spartan.utils.files import ParseFastQ, RecordWriter
+from spartan.utils.misc import Bunch, pool_imap
+
+__author__ = 'Gus Dunn'
+
+
+#### ----- per-read quality math  <BEGIN> ----- ####
+def _as_uint8(text):
+    """Returns ``text`` as a uint8 array (empty strings included)."""
+    if not text:
+        return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(text, dtype=np.uint8)
+
+
+def qual_batch(recs, offset=33):
+    """
+    Returns `Bunch` with the quality strings of ``recs`` decoded into one concatenated array.
+
+    * ``quals``: int16 array of all phred scores, read after read
+    * ``starts``: index in ``quals`` where each read starts
+    * ``lengths``: length of each read
+
+    :param recs: list of fastQ recs: (seqHeader,seqStr,qualHeader,qualStr)
+    :param offset: phred ASCII offset (33 for sanger/illumina 1.8+, 64 for older illumina)
+    """
+    qualStrs = [rec[3] for rec in recs]
+    lengths = np.fromiter((len(q) for q in qualStrs), dtype=np.int64, count=len(qualStrs))
+    starts = np.zeros(len(qualStrs), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    quals = _as_uint8(''.join(qualStrs)).astype(np.int16) - offset
+
+    return Bunch(quals=quals, starts=starts, lengths=lengths)
+
+
+def _reduce_per_read(ufunc, values, starts, lengths, empty):
+    """Applies ``ufunc.reduceat`` over each read's slice of ``values``; reads of length 0 get ``empty``."""
+    result = np.empty(len(starts), dtype=np.result_type(values, np.asarray(empty)))
+    result.fill(empty)
+    notEmpty = lengths > 0
+    if notEmpty.any():
+        result[notEmpty] = ufunc.reduceat(values, starts[notEmpty])
+    return result
+
+
+def mean_quals(recs, offset=33):
+    """
+    Returns float array of the mean quality score of each rec in ``recs``.
+    """
+    b = qual_batch(recs, offset)
+    sums = _reduce_per_read(np.add, b.quals.astype(np.int64), b.starts, b.lengths, 0)
+    return sums / np.maximum(b.lengths, 1).astype(np.float64)
+
+
+def min_quals(recs, offset=33):
+    """
+    Returns int array of the lowest quality score of each rec in ``recs``.
+    """
+    b = qual_batch(recs, offset)
+    return _reduce_per_read(np.minimum, b.quals, b.starts, b.lengths, 0)
+
+
+def frac_quals_below(recs, threshold, offset=33):
+    """
+    Returns float array of the fraction of bases in each rec whose quality is below ``threshold``.
+    """
+    b = qual_batch(recs, offset)
+    lows = _reduce_per_read(np.add, (b.quals < threshold).astype(np.int64), b.starts, b.lengths, 0)
+    return lows / np.maximum(b.lengths, 1).astype(np.float64)
+
+
+def count_Ns(recs):
+    """
+    Returns int array of the number of 'N'/'n' bases in each rec.
+    """
+    seqStrs = [rec[1] for rec in recs]
+    lengths = np.fromiter((len(s) for s in seqStrs), dtype=np.int64, count=len(seqStrs))
+    starts = np.zeros(len(seqStrs), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    seqs = _as_uint8(''.join(seqStrs))
+    isN = ((seqs == ord('N')) | (seqs == ord('n'))).astype(np.int64)
+
+    return _reduce_per_read(np.add, isN, starts, lengths, 0)
+
+
+def trailing_trim_positions(recs, threshold, offset=33):
+    """
+    Returns int array with, for each rec, the length the read would have after trimming
+    the run of bases with quality below ``threshold`` off of its 3' end.
+    (Slicing ``seq[:pos]`` gives the trimmed read.)
+    """
+    b = qual_batch(recs, offset)
+    # 1-based position within the read of every base that passes, 0 for those that don't
+    positions = np.arange(len(b.quals), dtype=np.int64) - np.repeat(b.starts, b.lengths) + 1
+    positions[b.quals < threshold] = 0
+    return _reduce_per_read(np.maximum, positions, b.starts, b.lengths, 0)
+
+#### ----- per-read quality math  <END> ----- ####
+
+
+#### ----- read filters  <BEGIN> ----- ####
+class BatchReadFilter(object):
+    """
+    Base class for read filters that test whole batches of fastQ recs at once.
+
+    Subclasses define ``test_batch(recs)`` returning a bool array with ``True`` meaning the
+    read should be KEPT.  Calling the filter on a single rec works too, so filters can be passed
+    as ``filterFunc`` to ``spartan.utils.files.filter_PEfastQs`` or as ``key`` to
+    ``ParseFastQ.filter_SEfastQ_headings``; both detect ``test_batch`` and use it per batch.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def test_batch(self, recs):
+        """Returns bool array: one value per rec in ``recs``, ``True`` for reads to keep."""
+
+    def __call__(self, rec):
+        return bool(self.test_batch([rec])[0])
+
+
+class MeanQualFilter(BatchReadFilter):
+    """Keeps reads whose mean quality is at least ``minMean``."""
+
+    def __init__(self, minMean, offset=33):
+        self.minMean = minMean
+        self.offset = offset
+
+    def test_batch(self, recs):
+        return mean_quals(recs, self.offset) >= self.minMean
+
+
+class MinQualFilter(BatchReadFilter):
+    """Keeps reads whose lowest quality is at least ``minQual``."""
+
+    def __init__(self, minQual, offset=33):
+        self.minQual = minQual
+        self.offset = offset
+
+    def test_batch(self, recs):
+        return min_quals(recs, self.offset) >= self.minQual
+
+
+class LowQualFracFilter(BatchReadFilter):
+    """Keeps reads with no more than ``maxFrac`` of their bases below quality ``threshold``."""
+
+    def __init__(self, threshold, maxFrac, offset=33):
+        self.threshold = threshold
+        self.maxFrac = maxFrac
+        self.offset = offset
+
+    def test_batch(self, recs):
+        return frac_quals_below(recs, self.threshold, self.offset) <= self.maxFrac
+
+
+class NCountFilter(BatchReadFilter):
+    """Keeps reads with no more than ``maxNs`` 'N' bases."""
+
+    def __init__(self, maxNs):
+        self.maxNs = maxNs
+
+    def test_batch(self, recs):
+        return count_Ns(recs) <= self.maxNs
+
+
+class TrailingQualFilter(BatchReadFilter):
+    """Keeps reads that would still be at least ``minLength`` long after trimming
+    their trailing bases of quality below ``threshold``."""
+
+    def __init__(self, threshold, minLength, offset=33):
+        self.threshold = threshold
+        self.minLength = minLength
+        self.offset = offset
+
+    def test_batch(self, recs):
+        return trailing_trim_positions(recs, self.threshold, self.offset) >= self.minLength
+
+
+class AllOfFilter(BatchReadFilter):
+    """Keeps reads that pass every one of the BatchReadFilters it is given."""
+
+    def __init__(self, *filters):
+        self.filters = filters
+
+    def test_batch(self, recs):
+        keep = np.ones(len(recs), dtype=bool)
+        for readFilter in self.filters:
+            keep &= np.asarray(readFilter.test_batch(recs), dtype=bool)
+        return keep
+
+#### ----- read filters  <END> ----- ####
+
+
+#### ----- subsampling  <BEGIN> ----- ####
+def _iter_lockstep_chunks(parsers, batchSize, blockSize):
+    """
+    Yields lists with one (firstLineNumber, lines) chunk per parser, all holding the same number of records.
+    """
+    chunkIters = [parser.iter_line_chunks(batchSize, blockSize) for parser in parsers]
+    for chunks in itertools.izip_longest(*chunkIters):
+        if None in chunks or len(set(len(lines) for firstLine, lines in chunks)) != 1:
+            raise InvalidFileFormatError("Mate files do not hold the same number of records: %s"
+                                         % ([parser.filePath for parser in parsers]))
+        if len(chunks[0][1]) % 4:
+            # let the normal checks report the truncated record
+            for parser, (firstLine, lines) in zip(parsers, chunks):
+                parser.lines_to_batch(lines, firstLine)
+        yield chunks
+
+
+def _recs_at(parsers, chunks, indexes):
+    """Returns list with, for each index, a tuple of that record from every chunk (parsed and checked)."""
+    recs = []
+    for i in indexes:
+        start = 4 * i
+        recs.append(tuple([parser.lines_to_batch(lines[start:start + 4], firstLine + start)[0]
+                           for parser, (firstLine, lines) in zip(parsers, chunks)]))
+    return recs
+
+
+def subsample_fastqs(inPaths, outPaths, fraction=None, number=None, seed=None, batchSize=100000,
+                     blockSize=4194304, compressLevel=None):
+    """
+    Writes a random subsample of the records in one fastQ file, or of the mate pairs in a set of mate files
+    read in lockstep (the same records are picked from every file), in a single pass.
+
+    Exactly one of ``fraction`` or ``number`` must be given:
+
+    * ``fraction``: keeps every record with probability ``fraction``.  Records are handled as raw line chunks and only
+      the picked ones are turned into records (and checked), so skipping the rest costs next to nothing.
+    * ``number``: keeps exactly ``number`` records (or all of them if there are fewer) chosen uniformly by reservoir
+      sampling.  Each record draws a random key and the ``number`` lowest keys are kept; only records beating the
+      current cut-off are ever parsed, and no more than ``2 * number`` of them (plus the raw lines of one chunk)
+      are held in memory.
+
+    Records are written in their original order.
+
+    :param inPaths: list of fastQ paths (1 path or the mate files)
+    :param outPaths: list of output paths matching ``inPaths``
+    :param fraction: fraction of records to keep
+    :param number: number of records to keep
+    :param seed: seed for the random number generator
+    :param batchSize: records handled per chunk
+    :param blockSize: bytes read at a time
+    :param compressLevel: passed on to ``RecordWriter``
+    :returns: `Bunch` with ``total`` records seen and ``sampled`` records written (per file)
+    """
+    if (fraction is None) == (number is None):
+        raise ValueError("Give exactly one of `fraction` or `number`.")
+    if number is not None and number < 1:
+        raise ValueError("`number` must be at least 1, not %s." % (number))
+    if len(inPaths) != len(outPaths):
+        raise ValueError("`inPaths` and `outPaths` must be the same length.")
+
+    rand = np.random.RandomState(seed)
+    parsers = [ParseFastQ(path) for path in inPaths]
+    writers = [RecordWriter(path, compressLevel=compressLevel) for path in outPaths]
+    total = 0
+    sampled = 0
+
+    try:
+        if fraction is not None:
+            for chunks in _iter_lockstep_chunks(parsers, batchSize, blockSize):
+                numRecs = len(chunks[0][1]) // 4
+                picked = np.flatnonzero(rand.random_sample(numRecs) < fraction)
+                for recs in _recs_at(parsers, chunks, picked.tolist()):
+                    for writer, rec in zip(writers, recs):
+                        writer.write_record(rec)
+                total += numRecs
+                sampled += len(picked)
+        else:
+            keys = np.zeros(0)
+            ordinals = np.zeros(0, dtype=np.int64)
+            reservoir = []
+            cutOff = 1.0
+            for chunks in _iter_lockstep_chunks(parsers, batchSize, blockSize):
+                numRecs = len(chunks[0][1]) // 4
+                chunkKeys = rand.random_sample(numRecs)
+                picked = np.flatnonzero(chunkKeys < cutOff)
+
+                # add the picks <number> at a time, trimming back to <number> before the reservoir would pass 2x
+                for pieceStart in xrange(0, len(picked), number):
+                    piece = picked[pieceStart:pieceStart + number]
+                    piece = piece[chunkKeys[piece] < cutOff]
+                    if len(reservoir) + len(piece) > 2 * number:
+                        keep = np.argpartition(keys, number - 1)[:number]
+                        keys, ordinals = keys[keep], ordinals[keep]
+                        reservoir = [reservoir[i] for i in keep.tolist()]
+                        cutOff = keys.max()
+                        piece = piece[chunkKeys[piece] < cutOff]
+
+                    keys = np.concatenate([keys, chunkKeys[piece]])
+                    ordinals = np.concatenate([ordinals, piece + total])
+                    reservoir.extend(_recs_at(parsers, chunks, piece.tolist()))
+                total += numRecs
+
+            if len(reservoir) > number:
+                keep = np.argpartition(keys, number - 1)[:number]
+                ordinals = ordinals[keep]
+                reservoir = [reservoir[i] for i in keep.tolist()]
+
+            for i in np.argsort(ordinals).tolist():
+                for writer, rec in zip(writers, reservoir[i]):
+                    writer.write_record(rec)
+            sampled = len(reservoir)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    return Bunch(total=total, sampled=sampled)
+
+#### ----- subsampling  <END> ----- ####
+
+
+#### ----- QC profiles  <BEGIN> ----- ####
+MAX_PHRED = 93
+PROFILE_BASES = 'ACGTN'
+
+# byte -> column of PROFILE_BASES (anything not ACGT counts as N)
+_BASE_COLUMN = np.empty(256, dtype=np.int64)
+_BASE_COLUMN.fill(4)
+for _i, _base in enumerate('ACGT'):
+    _BASE_COLUMN[ord(_base)] = _i
+    _BASE_COLUMN[ord(_base.lower())] = _i
+
+
+class FastQProfiler(object):
+    """
+    Accumulates FastQC-style summaries of fastQ recs, a batch at a time:
+
+    * ``qualCounts``: (maxLen, MAX_PHRED + 1) counts of each quality score at each cycle
+    * ``baseCounts``: (maxLen, 5) counts of A, C, G, T and N at each cycle
+    * ``lengthCounts``: (maxLen + 1) read length histogram
+    * ``gcCounts``: (101) histogram of per-read GC percent (of the ACGT bases)
+
+    All accumulators have fixed sizes set by ``maxLen``, so memory does not depend on the input size.
+    Cycles past ``maxLen`` are pooled into the last cycle and lengths over ``maxLen`` into the last length bin.
+    Profilers with the same ``maxLen`` can be combined with ``self.merge()`` (e.g. across files or processes).
+    """
+
+    def __init__(self, maxLen=500, offset=33):
+        """
+        :param maxLen: number of cycles tracked
+        :param offset: phred ASCII offset
+        """
+        self.maxLen = maxLen
+        self.offset = offset
+        self.numReads = 0
+        self.qualCounts = np.zeros((maxLen, MAX_PHRED + 1), dtype=np.int64)
+        self.baseCounts = np.zeros((maxLen, len(PROFILE_BASES)), dtype=np.int64)
+        self.lengthCounts = np.zeros(maxLen + 1, dtype=np.int64)
+        self.gcCounts = np.zeros(101, dtype=np.int64)
+
+    def update(self, recs):
+        """
+        Adds a batch of fastQ recs (seqHeader,seqStr,qualHeader,qualStr) to the profile.
+        """
+        if not recs:
+            return
+        b = qual_batch(recs, self.offset)
+        seqs = _as_uint8(''.join([rec[1] for rec in recs]))
+
+        cycles = np.arange(len(b.quals), dtype=np.int64) - np.repeat(b.starts, b.lengths)
+        np.minimum(cycles, self.maxLen - 1, out=cycles)
+
+        quals = np.clip(b.quals, 0, MAX_PHRED).astype(np.int64)
+        self.qualCounts += np.bincount(cycles * (MAX_PHRED + 1) + quals,
+                                       minlength=self.qualCounts.size).reshape(self.qualCounts.shape)
+
+        baseCols = _BASE_COLUMN[seqs]
+        self.baseCounts += np.bincount(cycles * len(PROFILE_BASES) + baseCols,
+                                       minlength=self.baseCounts.size).reshape(self.baseCounts.shape)
+
+        self.lengthCounts += np.bincount(np.minimum(b.lengths, self.maxLen), minlength=self.maxLen + 1)
+
+        isGC = ((baseCols == 1) | (baseCols == 2)).astype(np.int64)
+        isACGT = (baseCols < 4).astype(np.int64)
+        gc = _reduce_per_read(np.add, isGC, b.starts, b.lengths, 0)
+        acgt = _reduce_per_read(np.add, isACGT, b.starts, b.lengths, 0)
+        hasBases = acgt > 0
+        gcPercent = np.rint(100.0 * gc[hasBases] / acgt[hasBases]).astype(np.int64)
+        self.gcCounts += np.bincount(gcPercent, minlength=101)
+
+        self.numReads += len(recs)
+
+    def merge(self, other):
+        """
+        Adds the counts of profiler ``other`` to this one and returns self.
+        """
+        if (other.maxLen, other.offset) != (self.maxLen, self.offset):
+            raise ValueError("Can not merge profiles with different maxLen/offset settings.")
+        self.numReads += other.numReads
+        self.qualCounts += other.qualCounts
+        self.baseCounts += other.baseCounts
+        self.lengthCounts += other.lengthCounts
+        self.gcCounts += other.gcCounts
+        return self
+
+    def qual_quantiles(self, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)):
+        """
+        Returns int array (maxLen, len(quantiles)) of quality score quantiles at each cycle
+        (0 for cycles no read reached).
+        """
+        cumCounts = np.cumsum(self.qualCounts, axis=1)
+        totals = cumCounts[:, -1:]
+        result = np.empty((self.maxLen, len(quantiles)), dtype=np.int64)
+        for i, q in enumerate(quantiles):
+            # first score whose cumulative count reaches the quantile
+            result[:, i] = (cumCounts < q * totals).sum(axis=1)
+        result[totals[:, 0] == 0] = 0
+        return result
+
+    def mean_quals(self):
+        """Returns float array of the mean quality score at each cycle (0 for cycles no read reached)."""
+        totals = self.qualCounts.sum(axis=1)
+        sums = np.dot(self.qualCounts, np.arange(MAX_PHRED + 1))
+        return sums / np.maximum(totals, 1).astype(np.float64)
+
+    def _last_cycle(self):
+        """Returns number of cycles that any read reached."""
+        reached = np.flatnonzero(self.baseCounts.sum(axis=1))
+        return reached[-1] + 1 if len(reached) else 0
+
+    def cycle_table(self):
+        """
+        Returns list of rows (header row first): one per cycle with the number of bases, mean quality,
+        quality quantiles and the fraction of each base.
+        """
+        numCycles = self._last_cycle()
+        totals = self.baseCounts.sum(axis=1)
+        means = self.mean_quals()
+        quantiles = self.qual_quantiles()
+        fracs = self.baseCounts / np.maximum(totals, 1)[:, None].astype(np.float64)
+
+        rows = [['cycle', 'bases', 'mean_qual', 'q10', 'q25', 'median', 'q75', 'q90'] + list(PROFILE_BASES)]
+        for c in range(numCycles):
+            rows.append([c + 1, totals[c], '%.3f' % means[c]] + quantiles[c].tolist()
+                        + ['%.4f' % f for f in fracs[c]])
+        return rows
+
+    def length_table(self):
+        """Returns list of rows (header row first): read length, number of reads."""
+        return [['length', 'reads']] + [[length, count] for length, count in enumerate(self.lengthCounts) if count]
+
+    def gc_table(self):
+        """Returns list of rows (header row first): GC percent, number of reads."""
+        return [['gc_percent', 'reads']] + [[gc, count] for gc, count in enumerate(self.gcCounts)]
+
+    def write_table(self, path, table='cycle'):
+        """
+        Writes one of the tables ('cycle', 'length' or 'gc') to ``path`` as tab delimited text.
+        """
+        tables = {'cycle': self.cycle_table, 'length': self.length_table, 'gc': self.gc_table}
+        try:
+            rows = tables[table]()
+        except KeyError:
+            raise ValueError("`table` must be one of %s, not '%s'." % (sorted(tables), table))
+        with open(path, 'wb') as out:
+            csv.writer(out, delimiter='\t', lineterminator='\n').writerows(rows)
+
+
+def _profile_fastq(job):
+    """Returns `FastQProfiler` for one file; ``job`` is: (path, maxLen, offset, batchSize)."""
+    path, maxLen, offset, batchSize = job
+    profiler = FastQProfiler(maxLen=maxLen, offset=offset)
+    for batch in ParseFastQ(path).iter_batches(batchSize):
+        profiler.update(batch)
+    return profiler
+
+
+def profile_fastqs(paths, maxLen=500, offset=33, batchSize=10000, processes=None):
+    """
+    Returns a single `FastQProfiler` covering all fastQ files in ``paths``.
+
+    :param paths: list of fastQ paths ('.gz' ok)
+    :param maxLen: number of cycles tracked
+    :param offset: phred ASCII offset
+    :param batchSize: records per batch
+    :param processes: number of files profiled at once in worker processes
+    """
+    total = FastQProfiler(maxLen=maxLen, offset=offset)
+    jobs = ((path, maxLen, offset, batchSize) for path in paths)
+    for profiler in pool_imap(_profile_fastq, jobs, processes=processes):
+        total.merge(profiler)
+    return total
+
+#### ----- QC profiles  <END> ----- ####
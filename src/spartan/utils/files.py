@@ -19,13 +19,27 @@ files.py
 
 import os
 import sys
+import atexit
+import weakref
 import collections
 import gzip
 import shutil
 import csv
+import struct
+import threading
+import multiprocessing
+import Queue
+import zlib
+import itertools
+import bisect
+import string
+import mmap
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 
 from spartan.utils.errors import *
-from spartan.utils.misc import Bunch
+from spartan.utils.misc import Bunch, pool_imap
 
 
 def mv_file_obj(fileObj,newPath='',chmod=False):
@@ -75,7 +89,136 @@ def mv_file_obj(fileObj,newPath='',chmod=False):
     
     
 
-def filter_PEfastQs(filterFunc,fwdMatePath,revMatePath,matchedPassPath1,matchedPassPath2,singlePassPath,nonPassPath):
+def apply_read_filter(filterFunc, recs, field=None):
+    """
+    Returns list of True/False values from testing each fastQ rec in ``recs`` with ``filterFunc``.
+    Filters offering a ``test_batch(recs)`` method (see ``spartan.utils.fastqs``) test the whole
+    list in one call, anything else is called once per rec: with the whole rec, or only with
+    ``rec[field]`` if ``field`` is given (e.g. 0 for the header).
+    """
+    try:
+        testBatch = filterFunc.test_batch
+    except AttributeError:
+        if field is None:
+            return [filterFunc(rec) for rec in recs]
+        return [filterFunc(rec[field]) for rec in recs]
+    return list(testBatch(recs))
+
+
+# filterFunc used by _filter_PE_chunk() in pool workers; set per worker by _set_PE_filterFunc()
+_PE_filterFunc = None
+
+
+def _set_PE_filterFunc(filterFunc):
+    global _PE_filterFunc
+    _PE_filterFunc = filterFunc
+
+
+def _filter_PE_chunk(chunk):
+    """
+    Applies a filterFunc to a chunk of mate pairs.
+
+    :param chunk: tuple (fwdBatch, revBatch, interleave, filterFunc) with two equal length lists of fastQ recs,
+                  whether passing pairs should be interleaved into the matchedPass1 text and the filterFunc
+                  (None in pool workers, which use the one _set_PE_filterFunc() gave the process).
+    :returns: tuple (outTexts, counts) with outTexts holding the text bound for
+              (matchedPass1, matchedPass2, singlePass, nonPass) and counts a dict of
+              this chunk's tallies.
+    """
+    fwdBatch, revBatch, interleave, filterFunc = chunk
+    if filterFunc is None:
+        filterFunc = _PE_filterFunc
+
+    counts = dict.fromkeys(['pairs_passed', 'fwd_passed_as_single', 'rev_passed_as_single',
+                            'fwd_failed', 'rev_failed', 'total'], 0)
+    mPassF, mPassR, sPass, nPass = [], [], [], []
+
+    counts['total'] = len(fwdBatch) + len(revBatch)
+    pairs = itertools.izip_longest(fwdBatch, revBatch)
+    keepers = itertools.izip_longest(apply_read_filter(filterFunc, fwdBatch),
+                                     apply_read_filter(filterFunc, revBatch))
+
+    # a mate missing because one file ran out is None (as is its keep value) and is simply not written
+    for (fwdMate, revMate), (keepFwd, keepRev) in itertools.izip(pairs, keepers):
+        if keepFwd and keepRev:
+            mPassF.append(fwdMate)
+            mPassR.append(revMate)
+            counts['pairs_passed'] += 1
+            continue
+
+        if keepFwd:
+            sPass.append(fwdMate)
+            counts['fwd_passed_as_single'] += 1
+        elif fwdMate is not None:
+            nPass.append(fwdMate)
+            counts['fwd_failed'] += 1
+
+        if keepRev:
+            sPass.append(revMate)
+            counts['rev_passed_as_single'] += 1
+        elif revMate is not None:
+            nPass.append(revMate)
+            counts['rev_failed'] += 1
+
+    if interleave:
+        mPassF = [mate for pair in itertools.izip(mPassF, mPassR) for mate in pair]
+        mPassR = []
+
+    outTexts = tuple([''.join(['%s\n' % ('\n'.join(rec)) for rec in recs]) for recs in (mPassF, mPassR, sPass, nPass)])
+    return outTexts, counts
+
+
+def mate_name(header):
+    """
+    Returns the read name shared by both mates of a pair from a fastQ header line:
+    '@HWI-ST619:70:B0BMTABXX:3:1102:9652:78621 1:N:0:TAGCTT' and '@read7/2' give
+    'HWI-ST619:70:B0BMTABXX:3:1102:9652:78621' and 'read7'.
+    """
+    name = header[1:].split(None, 1)[0]
+    if name[-2:] in ('/1', '/2'):
+        name = name[:-2]
+    return name
+
+
+def check_mate_names(fwdBatch, revBatch, firstRecNum=1):
+    """
+    Raises InvalidFileFormatError naming the first pair whose read names (see mate_name()) differ.
+    <firstRecNum> is the pair number of the first pair in the batches.
+    """
+    fwdNames = [mate_name(rec[0]) for rec in fwdBatch]
+    revNames = [mate_name(rec[0]) for rec in revBatch]
+    if fwdNames != revNames:
+        for i, (fwdName, revName) in enumerate(itertools.izip_longest(fwdNames, revNames)):
+            if fwdName != revName:
+                raise InvalidFileFormatError("Mate names do not match at read pair number %s: '%s' vs '%s'."
+                                             % (firstRecNum + i, fwdName, revName))
+
+
+def iter_PE_batches(fwdMates, revMates=None, n=10000, checkNames=False):
+    """
+    Yields tuples (fwdBatch, revBatch) of up to <n> mate pairs.
+
+    :param fwdMates: ParseFastQ of the fwd mates, or of interleaved pairs if <revMates> is None
+    :param revMates: ParseFastQ of the rev mates
+    :param checkNames: make sure both mates of every pair share their read name (always done for
+                       interleaved input)
+    """
+    if revMates is None:
+        batches = ((batch[0::2], batch[1::2]) for batch in fwdMates.iter_batches(2 * n))
+        checkNames = True
+    else:
+        batches = itertools.izip_longest(fwdMates.iter_batches(n), revMates.iter_batches(n), fillvalue=[])
+
+    pairNum = 1
+    for fwdBatch, revBatch in batches:
+        if checkNames:
+            check_mate_names(fwdBatch, revBatch, pairNum)
+        pairNum += len(fwdBatch)
+        yield fwdBatch, revBatch
+
+
+def filter_PEfastQs(filterFunc,fwdMatePath,revMatePath,matchedPassPath1,matchedPassPath2,singlePassPath,nonPassPath,
+                    processes=None,chunkSize=10000,compressLevel=None,checkNames=False):
     """
     Takes the paths to mated PE fastq files with coordinated read-ordering.
     Tests whether paired reads satisfy the provided filterFunc.
@@ -86,6 +229,10 @@ def filter_PEfastQs(filterFunc,fwdMatePath,revMatePath,matchedPassPath1,matchedP
     :param matchedPassPath2:
     :param singlePassPath:
     :param nonPassPath:
+    :param processes: number of worker processes to run filterFunc in (default: None = no pool).
+    :param chunkSize: number of mate pairs handed to a worker at a time.
+    :param compressLevel: gzip level for the outfiles (default: compress only paths ending in '.gz').
+    :param checkNames: check that the mates of each pair have the same read name.
     For example fastQs from hudsonAlpha should have either "Y" or "N" flag in their header:
     
     @HWI-ST619:70:B0BMTABXX:3:1102:9652:78621 1:N:0:TAGCTT
@@ -103,24 +250,40 @@ def filter_PEfastQs(filterFunc,fwdMatePath,revMatePath,matchedPassPath1,matchedP
     If only one mate satisfies the filter, it is written to singlePassPath regardles of fwd/rev.
     All reads that do not satisfy the filter are written to nonPassPath.
     
+    Interleaved data and pipes:
+    * If revMatePath is None, fwdMatePath holds interleaved pairs (fwd, rev, fwd, rev...).
+    * If matchedPassPath2 is None, passing pairs are written interleaved to matchedPassPath1.
+    * singlePassPath and/or nonPassPath may be None to throw those reads away.
+    * A path of '-' reads from stdin / writes to stdout (see filter_interleaved_PEfastQ()).
+    * Mate names are checked for interleaved input, or for two input files when checkNames is True.
+
     Notes:
     * The filterFunc does not have to be a simple lambda, but even something like "testMeanQualScore()",
       as long as it returns a True/False with True meaning that the read should be KEPT.
-    * Write-files are overwritten if they exist, created otherwise.
+      The filters in spartan.utils.fastqs (MeanQualFilter(20), NCountFilter(2), ...) test each
+      chunk of reads in one vectorized call.
+    * Write-files are overwritten if they exist, created otherwise.  They are written through RecordWriter
+      objects, so '*.gz' paths come out gzipped.
+    * Mate pairs are read <chunkSize> at a time.  With <processes> > 1 the chunks are filtered
+      by a pool of worker processes; output order and counts are the same as when run serially.
+      The workers are forked, so filterFunc may be a lambda or closure.
+    * If one file has more reads than the other, the extra reads are filtered as singles.
     """
     
     
     fwdMates = ParseFastQ(fwdMatePath)
-    revMates = ParseFastQ(revMatePath)
-    mPassF_file = open(matchedPassPath1, 'w')
-    mPassR_file = open(matchedPassPath2, 'w')
-    sPass_file  = open(singlePassPath, 'w')
-    nPass_file  = open(nonPassPath, 'w')
-    
-    outFiles = [mPassF_file,
-                mPassR_file,
-                sPass_file,
-                nPass_file]
+    if revMatePath is None:
+        revMates = None
+    else:
+        revMates = ParseFastQ(revMatePath)
+
+    outFiles = []
+    for outPath in (matchedPassPath1, matchedPassPath2, singlePassPath, nonPassPath):
+        if outPath is None:
+            outFiles.append(None)
+        else:
+            outFiles.append(RecordWriter(outPath, compressLevel=compressLevel))
+    interleave = matchedPassPath2 is None
     
     counts = Bunch({'pairs_passed':0,
                   'fwd_passed_as_single':0,
@@ -128,61 +291,29 @@ def filter_PEfastQs(filterFunc,fwdMatePath,revMatePath,matchedPassPath1,matchedP
                   'fwd_failed':0,
                   'rev_failed':0,
                   'total':0})
-    
-    while 1:
-        # get next fastq Records or set mates to None
-        try:
-            fwdMate = fwdMates.next()
-            counts.total += 1
-        except StopIteration:
-            fwdMate = None
-        
-        try:
-            revMate = revMates.next()
-            counts.total += 1
-        except StopIteration:
-            revMate = None
-        
-        # break out if both files are empty 
-        if (fwdMate == None) and (revMate == None):
-            break
 
-        # set up logical switches to guide the outWriting/counting
-        if fwdMate == None:
-            keepFwd = None
-        else:
-            keepFwd = filterFunc(fwdMate)
-        if revMate == None:
-            keepRev = None
-        else:
-            keepRev = filterFunc(revMate)
-            
-        #print "fwdMate %s\nkeepFwd %s\nrevMate %s\nkeepRev %s" % (fwdMate[0],keepFwd,revMate[0],keepRev)
-        #break
-            
-        # write fwd and rev to appropriate files and += respective counts
-        if keepFwd and keepRev:
-            mPassF_file.write('%s\n' % ('\n'.join(fwdMate)))
-            mPassR_file.write('%s\n' % ('\n'.join(revMate)))
-            counts.pairs_passed += 1
-        if keepFwd and not keepRev:
-            sPass_file.write('%s\n' % ('\n'.join(fwdMate)))
-            nPass_file.write('%s\n' % ('\n'.join(revMate)))
-            counts.fwd_passed_as_single += 1
-            counts.rev_failed += 1
-        if not keepFwd and keepRev:
-            nPass_file.write('%s\n' % ('\n'.join(fwdMate)))
-            sPass_file.write('%s\n' % ('\n'.join(revMate)))
-            counts.fwd_failed += 1
-            counts.rev_passed_as_single += 1
-        if not keepFwd and not keepRev:
-            nPass_file.write('%s\n' % ('\n'.join(fwdMate)))
-            nPass_file.write('%s\n' % ('\n'.join(revMate)))
-            counts.fwd_failed += 1
-            counts.rev_failed += 1
+    # serially the filterFunc rides along with each chunk, so concurrent calls can not swap filters through
+    # the module global; pool workers get it once each from the initializer instead of pickled per chunk
+    if processes is None or processes == 1:
+        chunkFunc, initializer = filterFunc, None
+    else:
+        chunkFunc, initializer = None, _set_PE_filterFunc
+    chunks = ((fwdBatch, revBatch, interleave, chunkFunc)
+              for fwdBatch, revBatch in iter_PE_batches(fwdMates, revMates, chunkSize, checkNames))
+    results = pool_imap(_filter_PE_chunk, chunks, processes=processes,
+                        initializer=initializer, initargs=(filterFunc,))
+
+    for outTexts, chunkCounts in results:
+        # write in chunk order so the outfiles match the serial ordering
+        for outFile, text in zip(outFiles, outTexts):
+            if outFile is not None:
+                outFile.write(text)
+        for key, value in chunkCounts.iteritems():
+            counts[key] += value
     
     for f in outFiles:
-        f.close()
+        if f is not None:
+            f.close()
     
     reportTxt = '''================
 Filtered your files using the supplied filter function:
@@ -201,6 +332,23 @@ nonPassPath:\t\t%s\n----\n''' % (fwdMatePath,revMatePath,matchedPassPath1,matche
                                                                                                                            counts.fwd_failed,
                                                                                                                            counts.rev_failed)
     sys.stderr.write("%s\n" % (reportTxt))
+
+    return counts
+
+
+def filter_interleaved_PEfastQ(filterFunc,inPath='-',matchedPassPath='-',singlePassPath=None,nonPassPath=None,**kwargs):
+    """
+    Filters interleaved PE fastQ data (fwd, rev, fwd, rev...) with filter_PEfastQs() and writes the
+    pairs where both mates pass interleaved to <matchedPassPath>.  By default reads stdin and writes
+    stdout so it can sit in a shell pipeline:
+
+        aligner ... | filter_interleaved_fastq --min-mean-qual 20 | trimmer ...
+
+    Mates are checked to share their read name.  Reads passing alone or failing are only kept if
+    <singlePassPath>/<nonPassPath> are given.  Extra keyword arguments go to filter_PEfastQs().
+    Returns the counts Bunch.
+    """
+    return filter_PEfastQs(filterFunc, inPath, None, matchedPassPath, None, singlePassPath, nonPassPath, **kwargs)
     
 
 #def strip_str_of_comments(string,commentStr='#'):
@@ -231,22 +379,132 @@ def open_wo_comments(filePath,commentStr):
 
 
 def unSoftMask(inFastaPath,outFastaPath):
-    # TODO: replace unSoftMask() with mask_converter() that provides multiple options for changing the masking of sequences
     """
     UPPERcases any lowercased nucs in the fasta recs.
     Writes new file.
+    (Same as: mask_converter(inFastaPath, outFastaPath, mode='unmask'))
+    """
+    mask_converter(inFastaPath, outFastaPath, mode='unmask')
+
+
+MASK_MODES = ('unmask', 'hardmask', 'soft2hard', 'bed')
+
+
+def _lower_runs(segment, pos, openStart):
+    """
+    Finds the lowercase runs in <segment> (sequence lines of one rec whose first base is at <pos>).
+    <openStart> is the start of a run left open by the previous segment (or None).
+    Returns tuple: (list of finished (start, end) runs, start of the run left open or None, number of bases).
     """
-    inFasta  = open(inFastaPath, 'rU')
-    outFasta = open(outFastaPath, 'w')
-    for line in inFasta:
-        if line.startswith('>'):
-            outFasta.write(line)
+    bases = np.frombuffer(segment, dtype=np.uint8)
+    bases = bases[(bases != 10) & (bases != 13)]
+    if not len(bases):
+        return [], openStart, 0
+    isLower = (bases >= ord('a')).view(np.int8)
+    edges = (np.flatnonzero(np.diff(np.concatenate([[0], isLower, [0]]))) + pos).tolist()
+    finished = []
+    if openStart is not None:
+        if edges and edges[0] == pos:
+            edges[0] = openStart
         else:
-            outFasta.write(line.upper())
-    inFasta.close()
-    outFasta.close()
-    
-    
+            finished.append((openStart, pos))
+    runs = zip(edges[0::2], edges[1::2])
+    newOpen = None
+    if runs and runs[-1][1] == pos + len(bases):
+        newOpen = runs.pop()[0]
+    return finished + runs, newOpen, len(bases)
+
+
+def iter_soft_masked_runs(fastaPath, blockSize=8388608):
+    """
+    Yields tuples: (recName, start, end) for every run of lowercase (soft-masked) bases in a fastA file,
+    with 0-based, half open coordinates (as in BED).  recName is the first word of the header.
+
+    Works on blocks of <blockSize> bytes with NumPy; runs spanning lines or blocks are joined.
+    """
+    inFile = GzipReader(fastaPath) if fastaPath.endswith('.gz') else open(fastaPath, 'rb')
+    name = None
+    pos = 0           # bases of the current rec seen so far
+    openStart = None  # start of a run still going at the end of the last segment
+
+    try:
+        carry = ''
+        while 1:
+            block = inFile.read(blockSize)
+            buf = carry + block
+            if block:
+                cut = buf.rfind('\n') + 1
+                text, carry = buf[:cut], buf[cut:]
+            else:
+                text, carry = buf, ''
+
+            prev = 0
+            heads = _find_line_starts(text, ('>',))
+            for start in heads + [None]:
+                segment = text[prev:start]
+                if segment:
+                    if name is None:
+                        if segment.strip():
+                            raise InvalidFileFormatError('The first line containing text does not start with ">".')
+                    else:
+                        runs, openStart, numBases = _lower_runs(segment, pos, openStart)
+                        pos += numBases
+                        for runStart, runEnd in runs:
+                            yield name, runStart, runEnd
+                if start is None:
+                    break
+                # new rec: close the last run of the old one
+                if openStart is not None:
+                    yield name, openStart, pos
+                end = text.find('\n', start)
+                end = len(text) if end == -1 else end
+                name = text[start + 1:end].split()[0]
+                pos = 0
+                openStart = None
+                prev = end + 1
+
+            if not block:
+                break
+        if openStart is not None:
+            yield name, openStart, pos
+    finally:
+        inFile.close()
+
+
+def mask_converter(inFastaPath, outPath, mode='unmask', maskChar='N', blockSize=8388608, compressLevel=None):
+    """
+    Changes the masking of the sequences in a fastA file, a block at a time with ``str.translate``
+    (headers are left alone); '.gz' input and output are fine.
+
+    <mode>:
+    * 'unmask': UPPERcase every lowercased (soft-masked) base.
+    * 'hardmask': replace every lowercased base with <maskChar>; 'soft2hard' is the same.
+    * 'bed': write the soft-masked runs as BED intervals (recName, start, end) instead of a fastA file.
+
+    :param inFastaPath: path to fastA file
+    :param outPath: path to new fastA (or BED) file
+    :param mode: one of MASK_MODES
+    :param maskChar: char written over soft-masked bases in 'hardmask' mode
+    """
+    if mode not in MASK_MODES:
+        raise InvalidOptionError(wrong_value=mode, option_name='mode', valid_values=MASK_MODES)
+
+    if mode == 'bed':
+        with RecordWriter(outPath, compressLevel=compressLevel) as out:
+            for run in iter_soft_masked_runs(inFastaPath, blockSize=blockSize):
+                out.write('%s\t%s\t%s\n' % run)
+        return
+
+    lowers = string.ascii_lowercase
+    if mode == 'unmask':
+        table = string.maketrans(lowers, string.ascii_uppercase)
+    else:
+        table = string.maketrans(lowers, maskChar * len(lowers))
+    rewrite_lines(inFastaPath, outPath, lineFunc=lambda line: line, linePrefixes=('>',),
+                  segmentFunc=lambda segment: segment.translate(table), blockSize=blockSize,
+                  compressLevel=compressLevel)
+
+
 def tableFile2namedTuple(tablePath, sep='\t', headers=None):
     """Returns namedTuple from table file using first row fields as
     col headers or a list supplied by user."""
@@ -266,9 +524,655 @@ def tableFile2namedTuple(tablePath, sep='\t', headers=None):
     return data
 
 
+#### ----- gzip decompression layer  <BEGIN> ----- ####
+GZIP_MAGIC = '\x1f\x8b'
+
+
+def bgzf_block_size(header):
+    """
+    Returns the total size of the BGZF block whose header starts ``header`` or ``None`` if
+    ``header`` is not the start of a BGZF block.
+
+    :param header: at least the first 18 bytes of a gzip member
+    """
+    if len(header) < 18 or not header.startswith('\x1f\x8b\x08') or not (ord(header[3]) & 4):
+        return None
+    xLen = struct.unpack('<H', header[10:12])[0]
+    extra = header[12:12 + xLen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        subId = extra[pos:pos + 2]
+        subLen = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+        if subId == 'BC' and subLen == 2:
+            return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + subLen
+    return None
+
+
+def is_bgzf(path):
+    """
+    Returns ``True`` if ``path`` is a BGZF (blocked gzip) file, ``False`` otherwise.
+    """
+    with open(path, 'rb') as f:
+        return bgzf_block_size(f.read(18)) is not None
+
+
+def inflate_bgzf_block(block):
+    """
+    Returns the decompressed contents of a single, complete BGZF block.
+    Checks the stored CRC32 and size just like ``gzip`` would.
+    """
+    xLen = struct.unpack('<H', block[10:12])[0]
+    data = zlib.decompress(block[12 + xLen:-8], -15)
+    crc, iSize = struct.unpack('<iI', block[-8:])
+    if (zlib.crc32(data) != crc) or (len(data) != iSize):
+        raise IOError("CRC check failed on BGZF block.")
+    return data
+
+
+def iter_bgzf_blocks(fileObj):
+    """
+    Yields the raw (still compressed) BGZF blocks of ``fileObj`` from its current position.
+    Only the block headers are parsed; nothing is inflated.
+    """
+    while 1:
+        header = fileObj.read(18)
+        if not header:
+            break
+        blockSize = bgzf_block_size(header)
+        if blockSize is None:
+            raise IOError("Not a BGZF block at offset %s of %s." % (fileObj.tell() - len(header), fileObj.name))
+        body = fileObj.read(blockSize - len(header))
+        if len(body) != blockSize - len(header):
+            raise IOError("BGZF file %s ended in the middle of a block." % (fileObj.name))
+        yield header + body
+
+
+def _member_ended(decomp):
+    """
+    Returns ``True`` if the zlib decompressobj <decomp> has read its member's whole trailer (whose CRC32 and
+    size zlib has then checked).  Python 2's decompressobj has no ``eof``, but once a stream has ended any
+    further input is left in ``unused_data``, so a probe byte tells the two cases apart.
+    """
+    if decomp.unused_data:
+        return True
+    try:
+        decomp.decompress('\x00')
+    except zlib.error:
+        return False
+    return decomp.unused_data == '\x00'
+
+
+class _GzipInflater(object):
+    """
+    Background half of a `GzipReader`: inflates the file into a queue from its own thread.
+
+    It holds no reference to the reader, so a reader that is dropped without being closed can still be
+    garbage collected, which stops the thread (see ``GzipReader.__del__``).
+    """
+    def __init__(self, path, bgzf, threads, chunkSize, queue, stopEvent):
+        self.name = path
+        self.bgzf = bgzf
+        self.threads = threads
+        self._chunkSize = chunkSize
+        self._queue = queue
+        self._stopEvent = stopEvent
+
+    def _put(self, item):
+        """Blocks until ``item`` is queued; returns ``False`` if we were told to stop."""
+        while not self._stopEvent.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def run(self, blockOffset):
+        try:
+            if self.bgzf:
+                self._inflate_bgzf(blockOffset)
+            else:
+                self._inflate_stream(blockOffset)
+        except Exception:
+            self._put(('error', sys.exc_info()))
+        else:
+            self._put(None)
+
+    def _inflate_stream(self, blockOffset):
+        with open(self.name, 'rb') as f:
+            f.seek(blockOffset)
+            decomp = zlib.decompressobj(31)
+            started = False
+            while not self._stopEvent.is_set():
+                chunk = f.read(self._chunkSize)
+                if not chunk:
+                    break
+                data = []
+                while chunk:
+                    if not started:
+                        # gzip allows zero padding between/after members
+                        chunk = chunk.lstrip('\x00')
+                        if not chunk:
+                            break
+                        started = True
+                    try:
+                        data.append(decomp.decompress(chunk))
+                    except zlib.error as err:
+                        raise IOError("Not a gzipped file or corrupted data in %s: %s" % (self.name, err))
+                    chunk = decomp.unused_data
+                    if chunk:
+                        # member ended inside this chunk: start a new one with the rest
+                        data.append(decomp.flush())
+                        decomp = zlib.decompressobj(31)
+                        started = False
+                if not self._put(''.join(data)):
+                    return
+            if self._stopEvent.is_set():
+                return
+            if started and not _member_ended(decomp):
+                raise IOError("Gzip file %s ended in the middle of a member (truncated?)." % (self.name))
+            self._put(decomp.flush())
+
+    def _inflate_bgzf(self, blockOffset):
+        pool = ThreadPool(self.threads)
+        try:
+            with open(self.name, 'rb') as f:
+                f.seek(blockOffset)
+                blocks = iter_bgzf_blocks(f)
+                batch = []
+                batchBytes = 0
+                for block in blocks:
+                    batch.append(block)
+                    batchBytes += len(block)
+                    if batchBytes >= self._chunkSize * self.threads:
+                        if not self._put(''.join(pool.map(inflate_bgzf_block, batch))):
+                            return
+                        batch = []
+                        batchBytes = 0
+                if batch:
+                    self._put(''.join(pool.map(inflate_bgzf_block, batch)))
+        finally:
+            pool.close()
+
+
+class GzipReader(object):
+    """
+    Read-only file-like object over a gzip file that does its inflating in a background thread so
+    that decompression overlaps with whatever is consuming the data (parsing, filtering...).
+
+    Supports the parts of the file interface the parsers use: read(), readline(), iteration, close().
+
+    BGZF files (and other multi-member files built the same way) are split into their blocks
+    without decompressing anything, and the blocks are inflated in parallel by <threads> threads
+    (zlib releases the GIL while it works).  Plain gzip files (single or multi-member) are
+    inflated as a stream by the one background thread.
+
+    Output is byte-identical to ``gzip.GzipFile(path).read()``, and like it a file that ends inside a member
+    (e.g. a partial download) raises IOError once the data before the cut has been read.
+
+    Call close() (or use a ``with`` block) when done early; a reader that is garbage collected or still
+    open at interpreter exit stops its thread too.
+    """
+    def __init__(self, path, threads=None, chunkSize=1048576, queueSize=16):
+        """
+        :param path: path to gzip file
+        :param threads: number of threads used to inflate BGZF blocks (default: number of cpus)
+        :param chunkSize: approximate number of compressed bytes handled per unit of work
+        :param queueSize: max number of decompressed chunks held in memory ahead of the consumer
+        """
+        self.name = path
+        self.threads = threads or multiprocessing.cpu_count()
+        self.bgzf = is_bgzf(path)
+        self.closed = False
+        self._chunkSize = chunkSize
+        self._queueSize = queueSize
+        self._start()
+        _LIVE_GZIP_READERS.add(self)
+
+    def _start(self, blockOffset=0):
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._queue = Queue.Queue(self._queueSize)
+        self._stopEvent = threading.Event()
+        inflater = _GzipInflater(self.name, self.bgzf, self.threads, self._chunkSize, self._queue, self._stopEvent)
+        self._thread = threading.Thread(target=inflater.run, args=(blockOffset,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self):
+        """Moves the next decompressed chunk into the buffer. Returns ``False`` at EOF."""
+        while not self._eof:
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+                break
+            if isinstance(item, tuple):
+                self._eof = True
+                raise item[1][0], item[1][1], item[1][2]
+            if item:
+                self._buf = self._buf[self._pos:] + item
+                self._pos = 0
+                return True
+        return False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            data = self._buf[self._pos:]
+        else:
+            while (len(self._buf) - self._pos < size) and self._fill():
+                pass
+            data = self._buf[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readline(self):
+        searchFrom = self._pos
+        while 1:
+            end = self._buf.find('\n', searchFrom)
+            if end >= 0:
+                end += 1
+                break
+            searchFrom = len(self._buf) - self._pos
+            if not self._fill():
+                end = len(self._buf)
+                break
+            # _fill() moved the unread data to the start of the buffer
+        line = self._buf[self._pos:end]
+        self._pos = end
+        return line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def skip(self, size):
+        """Reads and discards the next ``size`` bytes without holding them all in memory."""
+        while size > 0:
+            skipped = len(self.read(min(size, self._chunkSize)))
+            if not skipped:
+                break
+            size -= skipped
+
+    def seek(self, offset):
+        """
+        Moves to the uncompressed byte ``offset``.
+        gzip streams can not be entered mid-way so this re-inflates the file from its start.
+        """
+        self._stop()
+        self._start()
+        self.skip(offset)
+
+    def seek_block(self, blockOffset, innerOffset=0):
+        """
+        Moves to the member (BGZF block) starting at compressed byte ``blockOffset`` of the file and
+        then ``innerOffset`` bytes into its decompressed data.  Together the two values act as a
+        decompressor checkpoint: no data before ``blockOffset`` is read.
+        """
+        self._stop()
+        self._start(blockOffset)
+        self.skip(innerOffset)
+
+    def _stop(self):
+        self._stopEvent.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        self._buf = ''
+        self._pos = 0
+
+    def close(self):
+        if not self.closed:
+            self._stop()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        # the inflating thread holds no reference to us: tell it to quit rather than wait on a full queue
+        stopEvent = self.__dict__.get('_stopEvent')
+        if stopEvent is not None:
+            stopEvent.set()
+
+
+# open readers, so that their threads can be stopped before the interpreter tears down the modules they use
+_LIVE_GZIP_READERS = weakref.WeakSet()
+
+
+@atexit.register
+def _stop_live_gzip_readers():
+    for reader in list(_LIVE_GZIP_READERS):
+        reader._stopEvent.set()
+
+
+def open_gzip_or_not(path, threads=None):
+    """
+    Returns a ``GzipReader`` for ``path`` if it is gzip compressed, a plain binary file object otherwise.
+
+    :param path: path to file
+    :param threads: passed on to ``GzipReader``
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == GZIP_MAGIC:
+        return GzipReader(path, threads=threads)
+    else:
+        return open(path, 'rb')
+
+#### ----- gzip decompression layer  <END> ----- ####
+
+
+class RecordWriter(object):
+    """
+    Write-only file-like object that collects what it is given into large buffers before writing it out.
+
+    Paths ending in '.gz' (or any path when <compressLevel> is given) are written gzip compressed, with the
+    compression done by a background thread so that it overlaps with the work producing the records.
+
+    Exmpl:
+    with RecordWriter('passed.fastq.gz', compressLevel=4) as out:
+        out.write_records(recs)
+    """
+    def __init__(self, path, bufferSize=4194304, compressLevel=None, queueSize=8):
+        """
+        :param path: path of file to (over)write ('-' writes to stdout)
+        :param bufferSize: number of characters collected before a write
+        :param compressLevel: gzip compression level 1-9 (default: 6 for '*.gz' paths, no compression otherwise)
+        :param queueSize: max number of filled buffers waiting to be compressed
+        """
+        self.name = path
+        self.closed = False
+        self._bufferSize = bufferSize
+        self._buf = []
+        self._bufLen = 0
+        self._error = None
+
+        if compressLevel is None and path.endswith('.gz'):
+            compressLevel = 6
+
+        if path == '-':
+            self._stream = sys.stdout
+        else:
+            self._stream = None
+
+        if compressLevel is None:
+            self._file = self._stream or open(path, 'w')
+            self._queue = None
+        else:
+            if self._stream is None:
+                self._file = gzip.GzipFile(path, 'wb', compressLevel)
+            else:
+                self._file = gzip.GzipFile('', 'wb', compressLevel, self._stream)
+            self._queue = Queue.Queue(queueSize)
+            self._thread = threading.Thread(target=self._compress)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _compress(self):
+        while 1:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    break
+                if self._error is None:
+                    self._file.write(data)
+            except Exception:
+                self._error = sys.exc_info()
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+
+    def _write_buffer(self):
+        if not self._buf:
+            return
+        data = ''.join(self._buf)
+        self._buf = []
+        self._bufLen = 0
+        if self._queue is None:
+            self._file.write(data)
+        else:
+            self._check_error()
+            self._queue.put(data)
+
+    def write(self, text):
+        self._buf.append(text)
+        self._bufLen += len(text)
+        if self._bufLen >= self._bufferSize:
+            self._write_buffer()
+
+    def write_record(self, rec):
+        """Writes one record given as a list/tuple of its lines (like the ones ParseFastQ returns)."""
+        self.write('%s\n' % ('\n'.join(rec)))
+
+    def write_records(self, recs):
+        """Writes many records given as lists/tuples of their lines."""
+        self.write(''.join(['%s\n' % ('\n'.join(rec)) for rec in recs]))
+
+    def flush(self):
+        self._write_buffer()
+        if self._queue is not None:
+            self._queue.join()
+            self._check_error()
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._write_buffer()
+        finally:
+            if self._queue is not None:
+                self._queue.put(None)
+                self._thread.join()
+            if self._file is self._stream:
+                self._file.flush()
+            else:
+                self._file.close()
+            if self._stream is not None:
+                self._stream.flush()
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FastQIndex(object):
+    """
+    On-disk record-offset index of a fastQ file with a checkpoint every <every> records.
+
+    Each checkpoint stores the record's ordinal, its byte offset in the (decompressed) data and the
+    decompressor state needed to get there without reading the preceding data:
+
+    * plain files: the byte offset itself.
+    * BGZF files: (offset of the BGZF block holding the record, offset within that block's data).
+    * other gzip files: gzip streams can only be entered at a member start, so there is no usable
+      decompressor state; seeking re-inflates from the start of the file.
+
+    The index is a small tab-delimited text file (default: '<fastq_path>.fqi') written the first time
+    it is needed and reused until the fastQ file's size or mtime change.
+    """
+    def __init__(self, fastqPath, every=1000, idxPath=None, rebuild=False):
+        """
+        :param fastqPath: path to fastQ file (plain, gzip or BGZF)
+        :param every: records between checkpoints (ignored when a current index already exists)
+        :param idxPath: where to store the index (default: fastqPath + '.fqi')
+        :param rebuild: build a new index even if a current one exists
+        """
+        self.fastqPath = fastqPath
+        self.idxPath = idxPath or fastqPath + '.fqi'
+
+        if rebuild or not self._load():
+            self.every = every
+            self._build()
+            self._save()
+
+    def _file_stats(self):
+        stats = os.stat(self.fastqPath)
+        return stats.st_size, int(stats.st_mtime)
+
+    def _load(self):
+        """Loads the index file. Returns ``False`` if it is missing or out of date."""
+        try:
+            idxFile = open(self.idxPath, 'rU')
+        except IOError:
+            return False
+
+        with idxFile:
+            header = dict(field.split('=') for field in idxFile.readline().rstrip('\n').split('\t')[1:])
+            if (int(header['size']), int(header['mtime'])) != self._file_stats():
+                return False
+            self.every = int(header['every'])
+            self.numRecs = int(header['records'])
+            self.dataSize = int(header['data_size'])
+            self.compression = header['compression']
+            rows = [map(int, line.split('\t')) for line in idxFile if line.strip()]
+        self.offsets = [row[1] for row in rows]
+        self.checkpoints = [(row[2], row[3]) for row in rows]
+        return True
+
+    def _save(self):
+        size, mtime = self._file_stats()
+        with open(self.idxPath, 'w') as idxFile:
+            idxFile.write('#fqi\tevery=%s\trecords=%s\tdata_size=%s\tcompression=%s\tsize=%s\tmtime=%s\n'
+                          % (self.every, self.numRecs, self.dataSize, self.compression, size, mtime))
+            for i, (offset, (blockOffset, innerOffset)) in enumerate(zip(self.offsets, self.checkpoints)):
+                idxFile.write('%s\t%s\t%s\t%s\n' % (i * self.every, offset, blockOffset, innerOffset))
+
+    def _iter_data_blocks(self):
+        """Yields tuples (blockData, blockOffset, nextBlockOffset) of decompressed data along with
+        the compressed offsets that act as checkpoints for data in that block."""
+        with open(self.fastqPath, 'rb') as f:
+            magic = f.read(2)
+            f.seek(0)
+            if is_bgzf(self.fastqPath):
+                self.compression = 'bgzf'
+                blockOffset = 0
+                for block in iter_bgzf_blocks(f):
+                    yield inflate_bgzf_block(block), blockOffset, blockOffset + len(block)
+                    blockOffset += len(block)
+                return
+            elif magic == GZIP_MAGIC:
+                self.compression = 'gzip'
+                f = GzipReader(self.fastqPath)
+            else:
+                self.compression = 'none'
+
+            offset = 0
+            while 1:
+                block = f.read(4194304)
+                if not block:
+                    break
+                if self.compression == 'none':
+                    yield block, offset, offset + len(block)
+                else:
+                    yield block, 0, 0
+                offset += len(block)
+            f.close()
+
+    def _build(self):
+        lineStep = 4 * self.every
+        self.offsets = []
+        self.checkpoints = []
+        self.dataSize = 0
+        numLines = 0
+        lastChar = '\n'
+
+        if os.path.getsize(self.fastqPath):
+            # line 0 is the first record
+            self.offsets.append(0)
+            self.checkpoints.append((0, 0))
+
+        for block, blockOffset, nextBlockOffset in self._iter_data_blocks():
+            if not block:
+                continue
+            newLines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            # index of the first newline in this block that ends a checkpoint's previous line
+            first = (-(numLines + 1)) % lineStep
+            for pos in (newLines[first::lineStep] + 1).tolist():
+                self.offsets.append(self.dataSize + pos)
+                if self.compression == 'none':
+                    self.checkpoints.append((self.dataSize + pos, 0))
+                elif self.compression == 'bgzf' and pos == len(block):
+                    self.checkpoints.append((nextBlockOffset, 0))
+                elif self.compression == 'bgzf':
+                    self.checkpoints.append((blockOffset, pos))
+                else:
+                    self.checkpoints.append((0, self.dataSize + pos))
+            numLines += len(newLines)
+            self.dataSize += len(block)
+            lastChar = block[-1]
+
+        if lastChar != '\n':
+            numLines += 1
+        self.numRecs = numLines // 4
+        # a checkpoint sitting at EOF does not point at a record
+        while self.offsets and self.offsets[-1] >= self.dataSize:
+            self.offsets.pop()
+            self.checkpoints.pop()
+
+    def checkpoint_for(self, ordinal):
+        """
+        Returns tuple (checkpointOrdinal, offset, (blockOffset, innerOffset)) for the last checkpoint at or
+        before record ``ordinal``.
+        """
+        if not (0 <= ordinal < self.numRecs):
+            raise IndexError("Record %s requested from %s which has %s records." % (ordinal, self.fastqPath,
+                                                                                    self.numRecs))
+        i = ordinal // self.every
+        return i * self.every, self.offsets[i], self.checkpoints[i]
+
+    def split_ranges(self, parts):
+        """
+        Returns list of up to ``parts`` `Bunch` objects describing consecutive runs of whole records
+        holding roughly equal numbers of bytes: ``startRec``, ``numRecs``, ``startOffset``, ``endOffset``.
+        Ranges always begin at a checkpoint, so they are only as fine-grained as the index.
+        """
+        bounds = [0]
+        for part in range(1, parts):
+            target = self.dataSize * part // parts
+            i = bisect.bisect_left(self.offsets, target)
+            if i < len(self.offsets) and i > bounds[-1]:
+                bounds.append(i)
+        ranges = []
+        for j, i in enumerate(bounds):
+            if j + 1 < len(bounds):
+                endRec = bounds[j + 1] * self.every
+                endOffset = self.offsets[bounds[j + 1]]
+            else:
+                endRec = self.numRecs
+                endOffset = self.dataSize
+            startRec = i * self.every
+            if endRec > startRec:
+                ranges.append(Bunch(startRec=startRec, numRecs=endRec - startRec,
+                                    startOffset=self.offsets[i], endOffset=endOffset))
+        return ranges
+
+
 class ParseFastQ(object):
     """Returns a read-by-read fastQ parser analogous to file.readline()"""
-    def __init__(self,filePath,headerSymbols=['@','+']):
+    def __init__(self,filePath,headerSymbols=['@','+'],gzThreads=None):
         """Returns a read-by-read fastQ parser analogous to file.readline().
         Exmpl: parser.next()
         -OR-
@@ -277,25 +1181,39 @@ class ParseFastQ(object):
             ... do something with rec ...
 
         rec is tuple: (seqHeader,seqStr,qualHeader,qualStr)
+
+        <gzThreads> sets how many threads may inflate BGZF blocks of '*.gz' files
+        in parallel (see GzipReader).
+
+        A <filePath> of '-' reads uncompressed fastQ data from stdin.
         """
-        if filePath.endswith('.gz'):
-            self._file = self._open_gzip_or_not(filePath)
+        if filePath == '-':
+            self._file = sys.stdin
+        elif filePath.endswith('.gz'):
+            self._file = self._open_gzip_or_not(filePath, gzThreads)
         else:
             self._file = open(filePath, 'rU')
+        self.filePath = filePath
         self._currentLineNumber = 0
         self._hdSyms = headerSymbols
-        
+        self._index = None
+
     def __iter__(self):
         return self
 
-    def _open_gzip_or_not(filename):
-        f = open(filename,'rb')
-        if (f.read(2) == '\x1f\x8b'):
-            f.seek(0)
-            return gzip.GzipFile(fileobj=f)
-        else:
-            f.seek(0)
-            return f
+    def _open_gzip_or_not(self, filename, threads=None):
+        return open_gzip_or_not(filename, threads=threads)
+
+    def close(self):
+        """Closes the underlying file (stopping a `GzipReader`'s inflating thread); stdin is left open."""
+        if self._file is not sys.stdin:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def next(self):
         """Reads in next element, parses, and does minimal verification.
@@ -333,7 +1251,99 @@ class ParseFastQ(object):
         
         # ++++ Return fatsQ data as tuple ++++
         return tuple(elemList)
-    
+
+    def iter_batches(self, n=10000, blockSize=4194304):
+        """Block-buffered alternative to self.next().
+        Reads <blockSize> bytes at a time, splits them into lines in bulk and
+        yields lists of up to <n> records (the last batch may be shorter).
+
+        Each rec is the same tuple returned by self.next():
+        (seqHeader,seqStr,qualHeader,qualStr)
+
+        The same register, empty-line and length checks done by self.next() are
+        applied to each batch as a whole; a failure reports the line number of the
+        offending record.
+
+        NOTE: do not mix calls to self.next() and self.iter_batches() on the same parser.
+        """
+        for firstLine, lines in self.iter_line_chunks(n, blockSize):
+            yield self.lines_to_batch(lines, firstLine)
+
+    def iter_line_chunks(self, n, blockSize):
+        """Yields tuples: (lineNumberOfFirstLine, listOfLines) with listOfLines holding
+        the lines (minus their '\\n') of up to <n> records, unchecked.  Pass (slices of
+        four lines of) them to self.lines_to_batch() to get checked records; callers
+        that only want some of the records (e.g. subsampling) can skip the rest for free.
+
+        NOTE: like self.iter_batches(), do not mix with calls to self.next()."""
+        chunkLen = 4 * n
+        lines = []
+        remainder = ''
+        while 1:
+            block = self._file.read(blockSize)
+            if block:
+                newLines = (remainder + block).split('\n')
+                remainder = newLines.pop()
+                lines.extend(newLines)
+            elif remainder:
+                lines.append(remainder)
+                remainder = ''
+
+            # hand out as many full chunks as we have
+            start = 0
+            while len(lines) - start >= chunkLen:
+                firstLine = self._currentLineNumber + 1
+                self._currentLineNumber += chunkLen
+                yield firstLine, lines[start:start + chunkLen]
+                start += chunkLen
+            if start:
+                del lines[:start]
+
+            if not block:
+                break
+
+        if lines:
+            firstLine = self._currentLineNumber + 1
+            self._currentLineNumber += len(lines)
+            yield firstLine, lines
+
+    def lines_to_batch(self, lines, firstLine):
+        """Checks a chunk of fastQ lines in bulk and returns them as a list of 4-tuples.
+        Raises AssertionError (like self.next()) reporting the first bad line number."""
+        seqHeads = lines[0::4]
+        seqs = lines[1::4]
+        qualHeads = lines[2::4]
+        quals = lines[3::4]
+
+        # -- Make sure we got 4 full lines of data for every rec --
+        if (len(lines) % 4) or not all(lines):
+            badLine = firstLine + len(lines)
+            for i, line in enumerate(lines):
+                if not line:
+                    badLine = firstLine + i
+                    break
+            raise AssertionError("** ERROR: It looks like I encountered a premature EOF or empty line.\n\
+               Please check FastQ file near line number %s and try again**" % (badLine))
+        # -- Make sure we are in the correct "register" --
+        for offset, symbol, heads in ((0, self._hdSyms[0], seqHeads), (2, self._hdSyms[1], qualHeads)):
+            if not all(map(str.startswith, heads, [symbol] * len(heads))):
+                for i, head in enumerate(heads):
+                    if not head.startswith(symbol):
+                        raise AssertionError("** ERROR: The %s line in fastq element does not start with '%s'.\n\
+               Please check FastQ file near line number %s and try again**" % (('1st', '3rd')[offset // 2],
+                                                                                symbol,
+                                                                                firstLine + (4 * i) + offset))
+        # -- Make sure the seq line and qual line have equal lengths --
+        seqLens = map(len, seqs)
+        qualLens = map(len, quals)
+        if seqLens != qualLens:
+            for i, (seqLen, qualLen) in enumerate(zip(seqLens, qualLens)):
+                if seqLen != qualLen:
+                    raise AssertionError("** ERROR: The length of Sequence data and Quality data of a record aren't equal.\n\
+               Please check FastQ file near line number %s and try again**" % (firstLine + (4 * i) + 3))
+
+        return zip(seqHeads, seqs, qualHeads, quals)
+
     def get_next_readSeq(self):
         """Convenience method: calls self.next and returns only the readSeq."""
         try:
@@ -342,41 +1352,291 @@ class ParseFastQ(object):
         except StopIteration:
             return None
         
-    def filter_SEfastQ_headings(self,filteredPath,key=None):
+    # ++++ Random access through a FastQIndex ++++
+    def load_index(self, every=1000, idxPath=None, rebuild=False):
+        """
+        Returns the FastQIndex of this file, building and saving it first if there is no
+        current one (see FastQIndex for <every>, <idxPath> and <rebuild>).
+        """
+        if rebuild or (self._index is None):
+            self._index = FastQIndex(self.filePath, every=every, idxPath=idxPath, rebuild=rebuild)
+        return self._index
+
+    def _skip_record(self):
+        for i in range(4):
+            self._file.readline()
+        self._currentLineNumber += 4
+
+    def seek_record(self, ordinal):
+        """
+        Positions the parser so that the next call to self.next() returns record
+        number <ordinal> (0-based).  Jumps to the closest checkpoint in the index and
+        reads forward from there.
+        """
+        cpOrdinal, offset, (blockOffset, innerOffset) = self.load_index().checkpoint_for(ordinal)
+
+        if isinstance(self._file, GzipReader) and self._file.bgzf:
+            self._file.seek_block(blockOffset, innerOffset)
+        else:
+            self._file.seek(offset)
+        self._currentLineNumber = 4 * cpOrdinal
+
+        for i in xrange(ordinal - cpOrdinal):
+            self._skip_record()
+
+    def get_record(self, ordinal):
+        """Returns record number <ordinal> (0-based) as a tuple like self.next()."""
+        self.seek_record(ordinal)
+        return self.next()
+
+    def get_records(self, ordinals):
+        """
+        Returns list of the records numbered in <ordinals>, in the order requested.
+        Records are fetched in file order, reading forward rather than seeking when the
+        next one is closer than the next checkpoint.
+        """
+        every = self.load_index().every
+        records = {}
+        for i, ordinal in enumerate(sorted(set(ordinals))):
+            gap = ordinal - (self._currentLineNumber // 4)
+            if (i == 0) or not (0 <= gap < every):
+                self.seek_record(ordinal)
+            else:
+                for j in xrange(gap):
+                    self._skip_record()
+            records[ordinal] = self.next()
+        return [records[ordinal] for ordinal in ordinals]
+
+    def split_ranges(self, parts):
+        """
+        Returns list of up to <parts> Bunch objects (startRec, numRecs, startOffset, endOffset)
+        splitting the file into runs of whole records with roughly equal byte counts.
+        Hand one to each worker and have it call ParseFastQ(path).iter_range(r.startRec, r.numRecs).
+        """
+        return self.load_index().split_ranges(parts)
+
+    def iter_range(self, startRec, numRecs, blockSize=4194304):
+        """
+        Yields the <numRecs> records starting at record number <startRec>, reading them
+        in blocks like self.iter_batches().
+        """
+        self.seek_record(startRec)
+        remaining = numRecs
+        for batch in self.iter_batches(max(min(numRecs, 10000), 1), blockSize):
+            for rec in batch[:remaining]:
+                yield rec
+            remaining -= len(batch)
+            if remaining <= 0:
+                break
+
+    def filter_SEfastQ_headings(self,filteredPath,key=None,batchSize=10000,compressLevel=None):
         """
         Iterates through a single-end fastQ file and writes only those recs
         that satisfy the <key> lambda func to <filteredPath>.
+        <filteredPath> is gzipped if it ends in '.gz' or <compressLevel> is given.
+
+        <key> is given the header of each rec, UNLESS it has a test_batch() method
+        (like the filters in spartan.utils.fastqs) in which case it is given
+        whole batches of recs.
         """
         fastqLen = 0
         filteredLen = 0
         
         if key == None:
             key = lambda x: x
-        filtered = open(filteredPath, 'w')
+        filtered = RecordWriter(filteredPath, compressLevel=compressLevel)
         
-        while 1:
-            try:
-                qRec = self.next()
-                fastqLen += 1
-            except StopIteration:
-                break
-            
-            if key(qRec[0]) == True:
-                for line in qRec:
-                    filtered.write('%s\n' % (line))
-                    filteredLen += 1
-            elif key(qRec[0]) == False:
-                pass
-            else:
-                raise UnexpectedValueError("ERROR: in ParseFastQ.filter_fastQ_headings() 'key' returned a non-T/F value.")
+        for batch in self.iter_batches(batchSize):
+            fastqLen += len(batch)
+
+            keeps = apply_read_filter(key, batch, field=0)
+
+            for qRec, keep in itertools.izip(batch, keeps):
+                if keep == True:
+                    filtered.write_record(qRec)
+                    filteredLen += 4
+                elif keep == False:
+                    pass
+                else:
+                    raise UnexpectedValueError("ERROR: in ParseFastQ.filter_fastQ_headings() 'key' returned a non-T/F value.")
         
         filtered.flush()
         filtered.close()
         
-        return Bag({"path":os.path.abspath(filtered.name),
+        return Bunch({"path":os.path.abspath(filtered.name),
                 "original":fastqLen,
                 "filtered":filteredLen})
-        
+
+
+#### ----- memory-mapped readers  <BEGIN> ----- ####
+def map_file(path):
+    """
+    Returns tuple: (buffer, array) where buffer is a read-only memory map of <path> and
+    array is a zero-copy uint8 NumPy view of it.
+    Empty files (which can not be mapped) give an empty str and array.
+    """
+    with open(path, 'rb') as fileObj:
+        if not os.fstat(fileObj.fileno()).st_size:
+            return '', np.zeros(0, dtype=np.uint8)
+        buf = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+    return buf, np.frombuffer(buf, dtype=np.uint8)
+
+
+def newline_offsets(array, start, end):
+    """Returns int64 array of the offsets of every '\\n' in array[start:end]."""
+    return np.flatnonzero(array[start:end] == 10).astype(np.int64) + start
+
+
+class MappedFastQRecord(object):
+    """
+    A fastQ rec that is only a set of offsets into a memory mapped file.
+    Acts like the tuple (seqHeader,seqStr,qualHeader,qualStr) returned by ParseFastQ,
+    but each field is only copied out of the map (as a str) when it is accessed.
+    """
+    __slots__ = ('_buf', '_starts')
+
+    def __init__(self, buf, starts):
+        """<starts> holds the offsets of the rec's 4 lines plus the offset just past its last line's newline."""
+        self._buf = buf
+        self._starts = starts
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        if i < 0:
+            i += 4
+        if not 0 <= i < 4:
+            raise IndexError("fastQ rec index out of range")
+        return self._buf[self._starts[i]:self._starts[i + 1] - 1]
+
+    def __len__(self):
+        return 4
+
+    def __iter__(self):
+        for i in range(4):
+            yield self[i]
+
+    def __repr__(self):
+        return 'MappedFastQRecord%r' % (self.to_tuple(),)
+
+    seqHeader = property(lambda self: self[0])
+    seq = property(lambda self: self[1])
+    qualHeader = property(lambda self: self[2])
+    qual = property(lambda self: self[3])
+
+    def seq_length(self):
+        """Returns length of the read without decoding it."""
+        return self._starts[2] - self._starts[1] - 1
+
+    def to_tuple(self):
+        return tuple(self)
+
+
+class MappedFastQ(object):
+    """Memory-mapped, zero-copy alternative to ParseFastQ for uncompressed fastQ files."""
+    def __init__(self, filePath, headerSymbols=['@','+'], blockSize=16777216):
+        """Maps <filePath> into memory and finds record boundaries in the map itself with NumPy,
+        <blockSize> bytes at a time.  Records are MappedFastQRecord objects: they hold
+        offsets into the map and only build strings for the fields that get used.
+
+        Its an iterator so you can do:
+        for rec in parser:
+            ... do something with rec ...
+
+        The same empty-line, register and length checks as ParseFastQ are applied
+        (vectorized per block) and raise AssertionError with the offending line number.
+
+        NOTE: expects '\\n' line endings (unlike ParseFastQ, '\\r' is not removed).
+        """
+        self.filePath = filePath
+        self._hdSyms = headerSymbols
+        self._blockSize = blockSize
+        self._buf, self._array = map_file(filePath)
+        self._recs = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._recs is None:
+            self._recs = itertools.chain.from_iterable(self.iter_batches())
+        return self._recs.next()
+
+    def close(self):
+        if not isinstance(self._buf, str):
+            self._array = None
+            self._buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_lines(self, starts, ends, firstLine):
+        """Vectorized version of ParseFastQ's checks over whole records' worth of line bounds."""
+        lineLens = ends - starts
+        if (lineLens == 0).any():
+            badLine = firstLine + np.flatnonzero(lineLens == 0)[0]
+            raise AssertionError("** ERROR: It looks like I encountered a premature EOF or empty line.\n\
+               Please check FastQ file near line number %s and try again**" % (badLine))
+        for offset, symbol in ((0, self._hdSyms[0]), (2, self._hdSyms[1])):
+            bad = np.flatnonzero(self._array[starts[offset::4]] != ord(symbol[0]))
+            if len(bad):
+                raise AssertionError("** ERROR: The %s line in fastq element does not start with '%s'.\n\
+               Please check FastQ file near line number %s and try again**" % (('1st', '3rd')[offset // 2],
+                                                                                symbol,
+                                                                                firstLine + (4 * bad[0]) + offset))
+        bad = np.flatnonzero(lineLens[1::4] != lineLens[3::4])
+        if len(bad):
+            raise AssertionError("** ERROR: The length of Sequence data and Quality data of the last record aren't equal.\n\
+               Please check FastQ file near line number %s and try again**" % (firstLine + (4 * bad[0]) + 3))
+
+    def iter_batches(self, n=None):
+        """Yields lists of MappedFastQRecord objects: all recs found in each block
+        (or batches of up to <n> recs if <n> is given)."""
+        size = len(self._array)
+        lineStart = 0        # offset of the first line not yet handed out
+        lineNumber = 1       # its line number
+        pending = np.zeros(0, dtype=np.int64)
+        pos = 0
+        while pos < size:
+            end = min(pos + self._blockSize, size)
+            newLines = np.concatenate([pending, newline_offsets(self._array, pos, end)])
+            pos = end
+            if pos == size and (not len(newLines) or newLines[-1] != size - 1):
+                # last line lacks its '\n'
+                newLines = np.append(newLines, size)
+            numLines = len(newLines) - (len(newLines) % 4)
+            if pos == size and numLines != len(newLines):
+                raise AssertionError("** ERROR: It looks like I encountered a premature EOF or empty line.\n\
+               Please check FastQ file near line number %s and try again**" % (lineNumber + len(newLines)))
+            pending = newLines[numLines:]
+            if not numLines:
+                continue
+
+            ends = newLines[:numLines]
+            starts = np.empty_like(ends)
+            starts[0] = lineStart
+            starts[1:] = ends[:-1] + 1
+            self._check_lines(starts, ends, lineNumber)
+
+            bounds = np.empty((numLines // 4, 5), dtype=np.int64)
+            bounds[:, :4] = starts.reshape(-1, 4)
+            bounds[:, 4] = ends[3::4] + 1
+            recs = [MappedFastQRecord(self._buf, rec) for rec in map(tuple, bounds.tolist())]
+            lineStart = ends[-1] + 1
+            lineNumber += numLines
+
+            if n is None:
+                yield recs
+            else:
+                for i in xrange(0, len(recs), n):
+                    yield recs[i:i + n]
+
+#### ----- memory-mapped readers  <END> ----- ####
+
+
 def onlyInA(fileA,fileB,outFile):
     """Takes two files. Writes a third file with the lines that are unique to
     fileA.  NOTE: Can be Memory intensive for large files."""
@@ -426,31 +1686,151 @@ def onlyInA(fileA,fileB,outFile):
 
 
     
+#### ----- line rewriting engine  <BEGIN> ----- ####
+def _fold_stream(seqLines, pending, lineLen):
+    """Adds the bases of <seqLines> to <pending> and returns tuple: (text of full <lineLen> lines, new pending)."""
+    pending += seqLines.replace('\n', '').replace('\r', '')
+    cut = len(pending) - (len(pending) % lineLen)
+    if not cut:
+        return '', pending
+    full = pending[:cut]
+    return ''.join([full[i:i + lineLen] + '\n' for i in xrange(0, cut, lineLen)]), pending[cut:]
+
+
+def _find_line_starts(text, prefixes):
+    """Returns sorted list of the offsets of lines in <text> (which starts at a line start) beginning with any of <prefixes>."""
+    starts = set()
+    for prefix in prefixes:
+        if text.startswith(prefix):
+            starts.add(0)
+        target = '\n' + prefix
+        pos = text.find(target)
+        while pos != -1:
+            starts.add(pos + 1)
+            pos = text.find(target, pos + 1)
+    return sorted(starts)
+
+
+def rewrite_lines(inPath, outPath, lineFunc=None, linePrefixes=('>',), fieldFunc=None, fieldIndex=0, sep='\t',
+                  fieldPrefixes=None, commentPrefix=None, refold=None, segmentFunc=None, blockSize=8388608,
+                  compressLevel=None):
+    """
+    Copies <inPath> to <outPath> while rewriting only selected lines or fields; everything else is copied
+    as is, a whole block at a time.  Either file may be gzipped ('.gz', see GzipReader and RecordWriter).
+
+    * Lines starting with one of <linePrefixes> (e.g. fastA headers, '##contig=' or '@SQ' lines) are replaced
+      by lineFunc(line) (line given and returned without its '\\n').
+    * If <fieldFunc> is given, field <fieldIndex> (split on <sep>) of the other lines is replaced by
+      fieldFunc(field).  Only lines starting with one of <fieldPrefixes> are touched, or, if that is None,
+      all lines not starting with <commentPrefix>.  Results are cached per distinct field value, so
+      <fieldFunc> runs once per name (e.g. per chromosome) rather than once per line.
+    * If <refold> is an int, the lines between selected lines (fastA sequence) are re-wrapped to that
+      many characters per line.
+    * If <segmentFunc> is given, each run of lines between selected lines is replaced by segmentFunc(run)
+      (e.g. a ``str.translate`` of sequence data); it must keep the '\n's in place.
+
+    Lines are handled a block of <blockSize> bytes at a time.
+    """
+    if fieldFunc is not None and (refold is not None or segmentFunc is not None):
+        raise ValueError("`fieldFunc` can not be used with `refold` or `segmentFunc`.")
+    if segmentFunc is None:
+        segmentFunc = lambda segment: segment
+    if lineFunc is None:
+        linePrefixes = ()
+
+    inFile = GzipReader(inPath) if inPath.endswith('.gz') else open(inPath, 'rb')
+    outFile = RecordWriter(outPath, compressLevel=compressLevel)
+    fieldCache = {}
+
+    def new_field(value):
+        try:
+            return fieldCache[value]
+        except KeyError:
+            fieldCache[value] = fieldFunc(value)
+            return fieldCache[value]
+
+    try:
+        carry = ''
+        pending = ''    # bases waiting to be refolded
+        while 1:
+            block = inFile.read(blockSize)
+            buf = carry + block
+            if block:
+                cut = buf.rfind('\n') + 1
+                text, carry = buf[:cut], buf[cut:]
+                if not text:
+                    continue
+            else:
+                text, carry = buf, ''
+                if text and not text.endswith('\n'):
+                    text += '\n'
+
+            if fieldFunc is None:
+                # -- copy the runs of untouched lines between selected lines as single slices --
+                out = []
+                prev = 0
+                for start in _find_line_starts(text, linePrefixes):
+                    if refold is None:
+                        out.append(segmentFunc(text[prev:start]))
+                    else:
+                        folded, pending = _fold_stream(segmentFunc(text[prev:start]), pending, refold)
+                        out.append(folded)
+                        if pending:
+                            out.append(pending + '\n')
+                            pending = ''
+                    end = text.find('\n', start)
+                    out.append(lineFunc(text[start:end].rstrip('\r')) + '\n')
+                    prev = end + 1
+                if refold is None:
+                    out.append(segmentFunc(text[prev:]))
+                else:
+                    folded, pending = _fold_stream(segmentFunc(text[prev:]), pending, refold)
+                    out.append(folded)
+                outFile.write(''.join(out))
+            else:
+                # -- batch of lines with one field to rename --
+                lines = text.split('\n')
+                lines.pop()   # text ends with '\n'
+                for i, line in enumerate(lines):
+                    if linePrefixes and line.startswith(linePrefixes):
+                        lines[i] = lineFunc(line.rstrip('\r'))
+                    elif (line.startswith(fieldPrefixes) if fieldPrefixes is not None
+                          else not (line and commentPrefix is not None and line.startswith(commentPrefix))):
+                        if not line:
+                            continue
+                        fields = line.split(sep, fieldIndex + 1)
+                        if len(fields) > fieldIndex:
+                            fields[fieldIndex] = new_field(fields[fieldIndex])
+                            lines[i] = sep.join(fields)
+                lines.append('')
+                outFile.write('\n'.join(lines))
+
+            if not block:
+                break
+        if pending:
+            outFile.write(pending + '\n')
+    finally:
+        inFile.close()
+        outFile.close()
+
+#### ----- line rewriting engine  <END> ----- ####
+
+
 def renameChrom_in_SAM(path):
     """
+    Rewrites the SAM file at <path> in place (keeping the original as <path>.zap_me.backup):
+    '@SQ' lines get 'SN:<4th ':' field of the old SN value>' and 'HWI' read lines get
+    the 3rd ':' field of their RNAME.
     """
-    import fileinput
     path = os.path.abspath(path)
     bkExt = ".zap_me.backup"
     bkPath = path + bkExt
-    
-    try:
-        for line in fileinput.input(files=path, inplace=1, backup=bkExt,
-                                    bufsize=0,mode="r", openhook=None):
-            if line.startswith('@SQ'):
-                line = line.split('\t')
-                chrm = "SN:%s" % (line[1].split(':')[3])
-                line[1] = chrm
-                sys.stdout.write('\t'.join(line))
-            elif line.startswith('HWI'):
-                line = line.split('\t')
-                chrm = line[2].split(':')[2]
-                line[2] = chrm
-                sys.stdout.write('\t'.join(line))
-            else:
-                sys.stdout.write(line)
-    except:
-        raise
-
 
+    def rename_SQ(line):
+        line = line.split('\t')
+        line[1] = "SN:%s" % (line[1].split(':')[3])
+        return '\t'.join(line)
 
+    os.rename(path, bkPath)
+    rewrite_lines(bkPath, path, lineFunc=rename_SQ, linePrefixes=('@SQ',),
+                  fieldFunc=lambda rname: rname.split(':')[2], fieldIndex=2, fieldPrefixes=('HWI',))
@@ -12,7 +12,8 @@ Purpose:
 """
 __author__ = 'Gus Dunn'
 
-from spartan.utils.fastas import ParseFastA
+from spartan.utils.fastas import scan_fasta_headers
+from spartan.utils.files import rewrite_lines
 import re
 
 
@@ -29,9 +30,7 @@ def get_name_map_from_fasta_headers(fasta_path):
 
     scaffold = "genomic scaffold Scaffold"
 
-    fasta_recs = ParseFastA(fasta_path, key=lambda x: x[1:]).to_dict()
-
-    headers = fasta_recs.keys()
+    headers = [header[1:] for offset, header in scan_fasta_headers(fasta_path)]
 
     for header in headers:
         if scaffold in header:
@@ -122,21 +121,10 @@ def change_vcf_chrom_names(in_path, out_path, name_map):
     :param name_map: name_map to use
     :return: ``None``
     """
-    in_file = open(in_path,'rU')
-    out_file = open(out_path, 'w')
-
-    for line in in_file:
-
-        if line.startswith('#'):
-            if is_vcf_chrom_header(line):
-                out_file.write(replace_chrom_name_in_header(line, name_map))
-            else:
-                out_file.write(line)
-
-        else:
-            out_file.write(replace_chrom_name_in_call_line(line, name_map))
-
-    in_file.close()
-    out_file.close()
+    # header lines go through `replace_chrom_name_in_header`; the CHROM field of the call lines is
+    # renamed once per distinct name and the rest of each line is left as is
+    rewrite_lines(in_path, out_path,
+                  lineFunc=lambda line: replace_chrom_name_in_header(line, name_map), linePrefixes=('##contig=',),
+                  fieldFunc=lambda chrom: name_map[chrom.split(':')[-1]], fieldIndex=0, commentPrefix='#')
 
 #### ----- Rename VCF file's chrom names to `ScaffoldX` where needed  <END> ----- ####
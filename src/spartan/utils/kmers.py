@@ -0,0 +1,294 @@
+# kmers.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+#
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+kmers.py
+=================================================
+Purpose:
+Count k-mer spectra (k <= 31) of fastA and fastQ files, e.g. for genome size estimation and contamination checks.
+
+K-mers are packed two bits per base (A=0, C=1, G=2, T=3, first base in the high bits) into uint64 codes;
+k-mers containing anything but A, C, G or T (either case) are skipped.
+"""
+import numpy as np
+
+from spartan.utils.errors import InvalidOptionError
+from spartan.utils.fastas import ParseFastA
+from spartan.utils.files import ParseFastQ, open_gzip_or_not
+from spartan.utils.misc import pool_imap, split_stream
+
+__author__ = 'Gus Dunn'
+
+
+MAX_K = 31
+
+# sequence byte -> 2-bit base code (4 for anything but A, C, G or T)
+_BASE_CODES = np.empty(256, dtype=np.uint8)
+_BASE_CODES.fill(4)
+for _code, _base in enumerate('ACGT'):
+    _BASE_CODES[ord(_base)] = _BASE_CODES[ord(_base.lower())] = _code
+
+
+def encode_kmer(kmer):
+    """Returns the int code of the str <kmer>."""
+    code = 0
+    for base in kmer.upper():
+        code = (code << 2) | 'ACGT'.index(base)
+    return code
+
+
+def decode_kmer(code, k):
+    """Returns the k-mer str of int <code>."""
+    code = int(code)
+    return ''.join(['ACGT'[(code >> (2 * (k - 1 - i))) & 3] for i in range(k)])
+
+
+def _pack_windows(codes, k, lowFirst=False):
+    """
+    Returns uint64 array with the 2-bit codes in every window of length <k> of the base codes <codes>
+    (len(codes) - k + 1 of them) packed into one int: first base in the high bits, or in the low bits
+    if <lowFirst> (which packs the reverse of each window).
+
+    Rather than rolling over the sequence a base at a time, windows of 1, 2, 4 ... bases are built by
+    joining pairs of the shorter ones with whole-array shifts, and the ones making up <k> joined in turn,
+    so the work is log2(k) vector passes.
+    """
+    block = codes.astype(np.uint64)
+    blockLen = 1
+    result = None
+    resultLen = 0
+    remaining = k
+    while remaining:
+        if remaining & 1:
+            if result is None:
+                result = block
+            else:
+                count = len(block) - resultLen
+                if lowFirst:
+                    result = result[:count] | (block[resultLen:] << np.uint64(2 * resultLen))
+                else:
+                    result = (result[:count] << np.uint64(2 * blockLen)) | block[resultLen:]
+            resultLen += blockLen
+        remaining >>= 1
+        if remaining:
+            count = len(block) - blockLen
+            if lowFirst:
+                block = block[:count] | (block[blockLen:] << np.uint64(2 * blockLen))
+            else:
+                block = (block[:count] << np.uint64(2 * blockLen)) | block[blockLen:]
+            blockLen *= 2
+    return result
+
+
+def kmer_codes(seq, k, canonical=False):
+    """
+    Returns uint64 array with the code of every k-mer in the str <seq> (in order, skipping k-mers with non-ACGT
+    bases).  If <canonical>, each k-mer is replaced by its reverse complement when that codes lower.
+    """
+    if len(seq) < k:
+        return np.zeros(0, dtype=np.uint64)
+    codes = _BASE_CODES[np.frombuffer(seq, dtype=np.uint8)]
+    bad = codes == 4
+    codes[bad] = 0
+    badSeen = np.concatenate([[0], np.cumsum(bad)])
+    valid = badSeen[k:] == badSeen[:-k]
+
+    kmers = _pack_windows(codes, k)
+    if canonical:
+        # the reverse complement of a window is its complemented bases in reverse order
+        np.minimum(kmers, _pack_windows(3 - codes, k, lowFirst=True), out=kmers)
+    return kmers[valid]
+
+
+class KmerCounter(object):
+    """
+    Accumulates the counts of every k-mer seen in batches of records.
+
+    K-mer codes are buffered and folded into the sorted ``keys`` (uint64 codes) and ``counts`` arrays every
+    ``flushSize`` codes with ``np.unique``, so memory is about 16 bytes per distinct k-mer plus the buffer.
+    Counters with the same settings can be combined with ``self.merge()`` (e.g. across files or processes).
+    """
+
+    def __init__(self, k, canonical=False, flushSize=16777216, chunkSize=4194304):
+        """
+        :param k: k-mer length (1 to 31)
+        :param canonical: count each k-mer together with its reverse complement (as the lower of the two)
+        :param flushSize: number of buffered k-mer codes that triggers a fold into the counts
+        :param chunkSize: long sequences are coded this many bases at a time
+        """
+        if not 1 <= k <= MAX_K:
+            raise InvalidOptionError(wrong_value=k, option_name='k', valid_values='1 to %s' % MAX_K)
+        self.k = k
+        self.canonical = canonical
+        self.flushSize = flushSize
+        self.chunkSize = chunkSize
+        self.numSeqs = 0
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self._numPending = 0
+
+    def add_seq(self, seq):
+        """Counts the k-mers of the str <seq>."""
+        for chunkStart in xrange(0, max(len(seq) - self.k + 1, 0), self.chunkSize):
+            codes = kmer_codes(seq[chunkStart:chunkStart + self.chunkSize + self.k - 1], self.k, self.canonical)
+            self._pending.append(codes)
+            self._numPending += len(codes)
+            if self._numPending >= self.flushSize:
+                self._flush()
+        self.numSeqs += 1
+
+    def update(self, recs):
+        """
+        Counts the k-mers of a batch of fastA (seqName,seqStr) or fastQ (seqHeader,seqStr,qualHeader,qualStr) recs.
+        """
+        for rec in recs:
+            self.add_seq(rec[1])
+
+    def _flush(self):
+        if not self._pending:
+            return
+        keys, counts = np.unique(np.concatenate(self._pending), return_counts=True)
+        self._pending = []
+        self._numPending = 0
+        self._add_counts(keys, counts)
+
+    def _add_counts(self, keys, counts, unique=True):
+        """Folds <keys> with <counts> into the totals; <keys> are sorted and unique unless not <unique>."""
+        if unique and not len(self._keys):
+            self._keys, self._counts = keys, counts.astype(np.int64)
+            return
+        keys = np.concatenate([self._keys, keys])
+        counts = np.concatenate([self._counts, counts])
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        counts = counts[order]
+        firsts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        self._keys = keys[firsts]
+        self._counts = np.add.reduceat(counts, firsts).astype(np.int64)
+
+    @property
+    def keys(self):
+        """Sorted uint64 array of the distinct k-mer codes seen."""
+        self._flush()
+        return self._keys
+
+    @property
+    def counts(self):
+        """Int array of the count of each k-mer in ``self.keys``."""
+        self._flush()
+        return self._counts
+
+    def __len__(self):
+        return len(self.keys)
+
+    def total(self):
+        """Returns number of k-mers counted."""
+        return int(self.counts.sum())
+
+    def count(self, kmer):
+        """Returns count of the str <kmer> (under its canonical form if counting canonical k-mers)."""
+        if len(kmer) != self.k:
+            return 0
+        code = kmer_codes(kmer, self.k, self.canonical)
+        if not len(code):
+            return 0
+        index = np.searchsorted(self.keys, code[0])
+        return int(self._counts[index]) if index < len(self._keys) and self._keys[index] == code[0] else 0
+
+    def most_common(self, n=10):
+        """Returns list of the <n> most frequent (kmer, count) tuples."""
+        top = np.argsort(-self.counts, kind='mergesort')[:n]
+        return [(decode_kmer(self._keys[i], self.k), int(self._counts[i])) for i in top]
+
+    def merge(self, *others):
+        """
+        Adds the counts of the counters ``others`` to this one (in a single fold) and returns self.
+        """
+        for other in others:
+            if (other.k, other.canonical) != (self.k, self.canonical):
+                raise ValueError("Can not merge k-mer counts with different k/canonical settings.")
+        if not others:
+            return self
+        self._flush()
+        if len(others) == 1:
+            self._add_counts(others[0].keys, others[0].counts)
+        else:
+            self._add_counts(np.concatenate([other.keys for other in others]),
+                             np.concatenate([other.counts for other in others]), unique=False)
+        self.numSeqs += sum(other.numSeqs for other in others)
+        return self
+
+    def histogram(self):
+        """Returns int array whose item i is the number of distinct k-mers seen exactly i times."""
+        return np.bincount(self.counts) if len(self.counts) else np.zeros(1, dtype=np.int64)
+
+    def write_histogram(self, path):
+        """
+        Writes the k-mer spectrum to ``path`` as tab delimited lines: count, number of distinct k-mers with
+        that count (counts nothing has are left out, as in the histograms of common k-mer counters).
+        """
+        with open(path, 'w') as out:
+            for count, numKmers in enumerate(self.histogram()):
+                if count and numKmers:
+                    out.write('%s\t%s\n' % (count, numKmers))
+
+
+def _is_fastq(path):
+    """Returns True if the first character of the (possibly gzipped) file at <path> is '@'."""
+    handle = open_gzip_or_not(path, threads=1)
+    try:
+        return handle.read(1) == '@'
+    finally:
+        handle.close()
+
+
+def _iter_rec_batches(paths, batchSize):
+    """Yields lists of up to <batchSize> records from each fastA/fastQ file in <paths> in turn."""
+    for path in paths:
+        if _is_fastq(path):
+            batches = ParseFastQ(path).iter_batches(batchSize)
+        else:
+            batches = split_stream(ParseFastA(path), batchSize)
+        for batch in batches:
+            yield batch
+
+
+def _count_batch_kmers(job):
+    """Returns `KmerCounter` for one batch of records; ``job`` is: (recs, k, canonical)."""
+    recs, k, canonical = job
+    counter = KmerCounter(k, canonical=canonical)
+    counter.update(recs)
+    counter._flush()
+    return counter
+
+
+def count_kmers(paths, k, canonical=False, batchSize=10000, processes=None):
+    """
+    Returns a single `KmerCounter` covering all fastA/fastQ files in ``paths``.
+
+    Records are read here and counted in batches of ``batchSize`` by the worker processes, so a single
+    large file is spread over all of them.  The batch counts are folded into the total a flush's worth
+    at a time.
+
+    :param paths: list of fastA or fastQ paths ('.gz' ok; the format is taken from the first character)
+    :param k: k-mer length (1 to 31)
+    :param canonical: count each k-mer together with its reverse complement
+    :param batchSize: records per batch
+    :param processes: number of worker processes counting batches
+    """
+    total = KmerCounter(k, canonical=canonical)
+    jobs = ((recs, k, canonical) for recs in _iter_rec_batches(paths, batchSize))
+    pending = []
+    numPending = 0
+    for counter in pool_imap(_count_batch_kmers, jobs, processes=processes):
+        pending.append(counter)
+        numPending += len(counter)
+        if numPending >= total.flushSize:
+            total.merge(*pending)
+            pending = []
+            numPending = 0
+    return total.merge(*pending)
@@ -23,6 +23,11 @@ import smtplib
 import base64
 import time
 import re
+import collections
+import multiprocessing
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
 
 def split_stream(stream, divisor):
@@ -43,6 +48,51 @@ def split_stream(stream, divisor):
     yield group
 
 
+def pool_imap(func, iterable, processes=None, initializer=None, initargs=(), max_pending=None):
+    """
+    Yields ``func(item)`` for each item in ``iterable`` IN ORDER, using a pool of ``processes`` worker
+    processes.
+
+    Unlike ``multiprocessing.Pool.imap``, at most ``max_pending`` items (default: ``2 * processes``) are
+    read from ``iterable`` ahead of the results being consumed, so memory stays bounded on huge inputs.
+
+    If ``processes`` is ``None`` or ``1`` no pool is created: ``initializer`` is run once in this
+    process and the work is done serially.
+
+    :param func: module level function taking one item
+    :param iterable: items to process
+    :param processes: number of worker processes
+    :param initializer: called as ``initializer(*initargs)`` once in each worker
+    :param initargs: arguments for ``initializer`` (passed by ``fork``, so they need not be picklable)
+    :param max_pending: max number of submitted but not yet yielded items
+    """
+    if processes is None or processes == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in iterable:
+            yield func(item)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * processes
+
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    pending = collections.deque()
+    try:
+        for item in iterable:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
 def get_version_number(path_to_setup):
     """
     Provides access to current version info contained in setup.py
@@ -102,11 +152,20 @@ def uniques(seq):
     return [ x for x in seq if x not in seen and not seen_add(x)]
 
 
-def slidingWindow(sequence, winSize, step=1):
+def slidingWindow(sequence, winSize, step=1, asArray=False):
     """Returns a generator that will iterate through
     the defined chunks of input sequence.  Input sequence
-    must be iterable."""
+    must be iterable.
+
+    If <asArray>, returns the read-only 2D NumPy view from
+    window_view(sequence, winSize, step) instead: one row per
+    window and no copies."""
+    if asArray:
+        return window_view(sequence, winSize, step)
+    return _iter_window_slices(sequence, winSize, step)
 
+
+def _iter_window_slices(sequence, winSize, step):
     # Verify the inputs
     try: it = iter(sequence)
     except TypeError:
@@ -126,5 +185,46 @@ def slidingWindow(sequence, winSize, step=1):
         yield sequence[i:i+winSize]
 
 
+def _as_1d_array(buf):
+    """Returns 1D NumPy array over <buf>: itself if already an array, else a uint8 view of its bytes."""
+    if isinstance(buf, np.ndarray):
+        if buf.ndim != 1:
+            raise ValueError("Expected a 1D array, got %s dimensions." % buf.ndim)
+        return buf
+    if not len(buf):
+        return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(buf, dtype=np.uint8)
+
+
+def window_view(buf, winSize, step=1):
+    """
+    Returns a read-only 2D NumPy view of every full window of <buf>: row i is
+    buf[i * step:i * step + winSize].  No data is copied, so overlapping windows
+    share memory and vectorized math over the rows costs no Python object per window.
+
+    <buf> is a 1D NumPy array or a str/bytearray/buffer (viewed as uint8 bytes).
+    Windows that would run past the end are left out (0 rows if <winSize> > len(buf)).
+    """
+    if winSize < 1 or step < 1:
+        raise ValueError("winSize and step must be at least 1 (got %s and %s)." % (winSize, step))
+    array = _as_1d_array(buf)
+    numWindows = max(0, (len(array) - winSize) // step + 1)
+    return as_strided(array, shape=(numWindows, winSize), strides=(step * array.strides[0], array.strides[0]),
+                      writeable=False)
+
+
+def iter_window_blocks(buf, winSize, step=1, blockSize=65536):
+    """
+    Yields (start, block) tuples covering the windows of window_view(buf, winSize, step)
+    <blockSize> windows at a time: <block> is the read-only view of those windows and
+    <start> the offset in <buf> of its first window.  Lets scoring code stay vectorized
+    while bounding the size of anything it derives from each block.
+    """
+    array = _as_1d_array(buf)
+    windows = window_view(array, winSize, step)
+    for first in xrange(0, len(windows), blockSize):
+        yield first * step, windows[first:first + blockSize]
+
+
 def fold_seq(seq, lineLen=70):
     return [seq[i:i+lineLen] for i in xrange(0, len(seq), lineLen)]
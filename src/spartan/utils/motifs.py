@@ -0,0 +1,529 @@
+# motifs.py is part of the 'spartan' package.
+# It was written by Gus Dunn and was created on 10/18/26.
+#
+# Please see the license info in the root folder of this package.
+
+"""
+=================================================
+motifs.py
+=================================================
+Purpose:
+Scan genomes and read sets for many sequence motifs at once.
+
+Hits are returned as a `Bunch` of equal length NumPy columns:
+
+* ``seqid``: name of the sequence hit
+* ``start``, ``end``: 1-based, inclusive coordinates (as in GFF3 and ``IndexedFastA.fetch``)
+* ``strand``: 1 or -1
+* ``motif``: name of the motif
+
+`PWMScanner` hits also have ``score`` (log-odds bits) and ``pvalue`` columns.
+"""
+import abc
+
+import numpy as np
+
+from spartan.utils.fastas import IndexedFastA, ParseFastA
+from spartan.utils.errors import InvalidFileFormatError, InvalidOptionError
+from spartan.utils.misc import Bunch, pool_imap, split_stream
+
+__author__ = 'Gus Dunn'
+
+
+HIT_COLUMNS = ('seqid', 'start', 'end', 'strand', 'motif')
+PWM_HIT_COLUMNS = HIT_COLUMNS + ('score', 'pvalue')
+
+_COLUMN_DTYPES = {'seqid': 'S1', 'start': np.int64, 'end': np.int64, 'strand': np.int8, 'motif': 'S1',
+                  'score': np.float64, 'pvalue': np.float64}
+
+
+def empty_hits(columns=HIT_COLUMNS):
+    """Returns hit `Bunch` with no rows."""
+    return Bunch((column, np.zeros(0, dtype=_COLUMN_DTYPES[column])) for column in columns)
+
+
+def concat_hits(hitsList, columns=HIT_COLUMNS):
+    """Returns a single hit `Bunch` holding the rows of every hit `Bunch` in ``hitsList`` (in order)."""
+    hitsList = [hits for hits in hitsList if len(hits.start)]
+    if not hitsList:
+        return empty_hits(columns)
+    return Bunch((column, np.concatenate([hits[column] for hits in hitsList])) for column in columns)
+
+
+def _hits_from_lists(seqid, starts, ends, strands, motifs, scores=None, pvalues=None):
+    """Returns hit `Bunch` for one sequence, sorted by start, end, motif and strand (plus first).
+    ``scores`` and ``pvalues`` (given together) add the PWM_HIT_COLUMNS."""
+    columns = HIT_COLUMNS if scores is None else PWM_HIT_COLUMNS
+    if not starts:
+        return empty_hits(columns)
+    starts = np.array(starts, dtype=np.int64)
+    ends = np.array(ends, dtype=np.int64)
+    strands = np.array(strands, dtype=np.int8)
+    motifs = np.array(motifs)
+    order = np.lexsort((-strands, motifs, ends, starts))
+    hits = Bunch(seqid=np.array([seqid] * len(starts))[order],
+                 start=starts[order],
+                 end=ends[order],
+                 strand=strands[order],
+                 motif=motifs[order])
+    if scores is not None:
+        hits.score = np.array(scores, dtype=np.float64)[order]
+        hits.pvalue = np.array(pvalues, dtype=np.float64)[order]
+    return hits
+
+
+class ChunkedScanner(object):
+    """
+    Base class of the motif scanners: runs ``_scan_text`` over a sequence one chunk at a time.
+
+    Subclasses set ``columns`` (the hit columns they report), ``chunkSize`` and ``maxLen`` (longest motif), and
+    define ``_scan_text(text, offset, limit, hits)`` which appends the hits starting in the first ``limit``
+    bases of ``text`` (whose first base is 0-based position ``offset``) to the lists in ``hits``: one list
+    per column after 'seqid'.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    columns = HIT_COLUMNS
+    chunkSize = 4194304
+    maxLen = 0
+
+    @abc.abstractmethod
+    def _scan_text(self, text, offset, limit, hits):
+        pass
+
+    def scan_seq(self, seqid, seq):
+        """Returns hit `Bunch` of all motifs in the str <seq>."""
+        hits = tuple([] for column in self.columns[1:])
+        for chunkStart in xrange(0, len(seq), self.chunkSize):
+            text = seq[chunkStart:chunkStart + self.chunkSize + self.maxLen - 1]
+            self._scan_text(text, chunkStart, self.chunkSize, hits)
+        return _hits_from_lists(seqid, *hits)
+
+    def scan_store(self, store, seqid):
+        """Returns hit `Bunch` of all motifs in sequence <seqid> of <store> (IndexedFastA or PackedGenome),
+        fetching one chunk at a time so whole contigs are never held in memory."""
+        hits = tuple([] for column in self.columns[1:])
+        length = store.length(seqid)
+        for chunkStart in xrange(0, length, self.chunkSize):
+            text = store.fetch(seqid, chunkStart + 1, chunkStart + self.chunkSize + self.maxLen - 1)
+            self._scan_text(text, chunkStart, self.chunkSize, hits)
+        return _hits_from_lists(seqid, *hits)
+
+
+#### ----- IUPAC motif scanning  <BEGIN> ----- ####
+# one bit per base: A=1, C=2, G=4, T=8
+IUPAC_BITS = {'A': 1, 'C': 2, 'G': 4, 'T': 8,
+              'M': 3, 'R': 5, 'W': 9, 'S': 6, 'Y': 10, 'K': 12,
+              'V': 7, 'H': 11, 'D': 13, 'B': 14, 'X': 15, 'N': 15}
+
+# sequence byte -> its base bit (anything but A, C, G, T matches nothing)
+_SEQ_BITS = np.zeros(256, dtype=np.uint8)
+for _base in 'ACGT':
+    _SEQ_BITS[ord(_base)] = _SEQ_BITS[ord(_base.lower())] = IUPAC_BITS[_base]
+
+# base bits -> bits of the complementary bases
+_COMPL_BITS = np.array([((b & 1) << 3) | ((b & 2) << 1) | ((b & 4) >> 1) | ((b & 8) >> 3) for b in range(16)],
+                       dtype=np.uint8)
+
+
+def motif_bits(motif):
+    """Returns uint8 array with the allowed-base bits (see IUPAC_BITS) of each position of IUPAC ``motif``."""
+    try:
+        return np.array([IUPAC_BITS[letter] for letter in motif.upper()], dtype=np.uint8)
+    except KeyError as err:
+        raise ValueError("Motif '%s' contains a non-IUPAC character: %s" % (motif, err))
+
+
+def seq_bits(seq):
+    """Returns uint8 array with the base bit (see IUPAC_BITS) of each base of ``seq`` (0 for N etc; case ignored)."""
+    if not seq:
+        return np.zeros(0, dtype=np.uint8)
+    return _SEQ_BITS[np.frombuffer(seq, dtype=np.uint8)]
+
+
+class MotifScanner(ChunkedScanner):
+    """
+    Finds every (overlapping) match of a set of IUPAC motifs on both strands of a sequence.
+    """
+    def __init__(self, motifs, strands='both', chunkSize=4194304):
+        """
+        Compiles each motif once into a per-position mask of allowed bases, for the motif and for its
+        reverse complement (which finds the minus strand hits without reverse complementing the sequence).
+
+        Sequences are turned into one bit per base and each motif is matched with NumPy: candidate starts
+        come from the motif's most specific position and are then whittled down position by position,
+        so the cost is a couple of vector passes per motif and strand.  Case is ignored (soft-masked
+        bases are scanned) and IUPAC codes in the motifs only match A, C, G or T in the sequence.
+
+        :param motifs: list of IUPAC motifs, or dict of name -> motif
+        :param strands: 'both', 'plus' or 'minus'
+        :param chunkSize: sequences are scanned in windows of this many bases (overlapping by motif length - 1)
+        """
+        if strands not in ('both', 'plus', 'minus'):
+            raise InvalidOptionError(wrong_value=strands, option_name='strands', valid_values=['both', 'plus', 'minus'])
+        if isinstance(motifs, dict):
+            motifs = sorted(motifs.items())
+        else:
+            motifs = [(motif, motif) for motif in motifs]
+
+        self.names = [name for name, motif in motifs]
+        self.motifs = [motif.upper() for name, motif in motifs]
+        self.strands = strands
+        self.chunkSize = chunkSize
+        self.maxLen = max(len(motif) for motif in self.motifs) if self.motifs else 0
+
+        # per motif and strand: (name, strand, length, positions most specific first, their bits)
+        self._patterns = []
+        for name, motif in zip(self.names, self.motifs):
+            plus = motif_bits(motif)
+            minus = _COMPL_BITS[plus][::-1]
+            for strand, bits in ((1, plus), (-1, minus)):
+                if (strand == 1 and strands == 'minus') or (strand == -1 and strands == 'plus'):
+                    continue
+                order = np.argsort([bin(b).count('1') for b in bits], kind='mergesort')
+                self._patterns.append((name, strand, len(bits), order, bits[order]))
+
+    def _scan_text(self, text, offset, limit, hits):
+        """Appends hits starting before <limit> in <text> (whose first base is 0-based position <offset>) to <hits>."""
+        starts, ends, strands, names = hits
+        bits = seq_bits(text)
+        for name, strand, length, positions, posBits in self._patterns:
+            numStarts = min(limit, len(bits) - length + 1)
+            if numStarts <= 0:
+                continue
+            first = positions[0]
+            found = np.flatnonzero(bits[first:first + numStarts] & posBits[0])
+            for pos, allowed in zip(positions[1:], posBits[1:]):
+                if not len(found):
+                    break
+                found = found[(bits[found + pos] & allowed) != 0]
+            if len(found):
+                found = (found + offset + 1).tolist()
+                starts.extend(found)
+                ends.extend([start + length - 1 for start in found])
+                strands.extend([strand] * len(found))
+                names.extend([name] * len(found))
+
+
+#### ----- IUPAC motif scanning  <END> ----- ####
+
+
+#### ----- PWM scanning  <BEGIN> ----- ####
+# sequence byte -> one-hot column: A, C, G, T (either case) or 4 for anything else
+_SEQ_CODES = np.empty(256, dtype=np.uint8)
+_SEQ_CODES.fill(4)
+for _code, _base in enumerate('ACGT'):
+    _SEQ_CODES[ord(_base)] = _SEQ_CODES[ord(_base.lower())] = _code
+
+# score given to N etc and to positions past the end of the sequence: no window containing one is a hit
+_NO_BASE_SCORE = -2 ** 24
+
+
+def read_transfac(path, background=None, pseudocount=1.0, scale=100):
+    """
+    Returns list of `PositionWeightMatrix` for every count matrix in the TRANSFAC file at <path>, including
+    the files written by ``sandbox.meme_minimal2transfac``.
+
+    Matrix rows are read from 'MA' lines ('MA  01  A  C  G  T  consensus') or from the usual numbered lines
+    ('01  A  C  G  T  consensus').  Matrices are named by their 'ID' line, failing that their 'NA' line.
+    Records end at '//'.
+
+    :param path: path to TRANSFAC file
+    :param background: passed to `PositionWeightMatrix`
+    :param pseudocount: passed to `PositionWeightMatrix`
+    :param scale: passed to `PositionWeightMatrix`
+    """
+    matrices = []
+    names = {}
+    rows = []
+
+    def finish_record():
+        if rows:
+            name = names.get('ID', names.get('NA', 'motif_%s' % (len(matrices) + 1)))
+            matrices.append(PositionWeightMatrix(name, rows, background=background, pseudocount=pseudocount,
+                                                 scale=scale))
+        names.clear()
+        del rows[:]
+
+    with open(path, 'rU') as transfac:
+        for lineNum, line in enumerate(transfac, 1):
+            fields = line.split()
+            if not fields:
+                continue
+            tag = fields[0]
+            if tag == '//':
+                finish_record()
+            elif tag in ('ID', 'NA') and len(fields) > 1:
+                names.setdefault(tag, fields[1])
+            elif tag == 'MA' or tag.isdigit():
+                counts = fields[2:6] if tag == 'MA' else fields[1:5]
+                try:
+                    rows.append([float(count) for count in counts])
+                    if len(counts) != 4:
+                        raise ValueError()
+                except ValueError:
+                    raise InvalidFileFormatError('Line %s of %s is not a matrix row with counts for A, C, G and T: %s'
+                                                 % (lineNum, path, line.rstrip()))
+    finish_record()
+    return matrices
+
+
+def _score_tail(intScores, background):
+    """
+    Returns (minInt, tail) for the (motif length x 4) integer scores <intScores>, where tail[i] is the probability
+    that sequence drawn from base frequencies <background> scores at least i + minInt.
+    """
+    rowMins = intScores.min(1)
+    dist = np.ones(1)
+    for row, rowMin in zip(intScores, rowMins):
+        shifts = row - rowMin
+        newDist = np.zeros(len(dist) + shifts.max())
+        for shift, baseFreq in zip(shifts, background):
+            newDist[shift:shift + len(dist)] += baseFreq * dist
+        dist = newDist
+    return int(rowMins.sum()), np.minimum(dist[::-1].cumsum()[::-1], 1.0)
+
+
+def _tail_threshold(minInt, tail, pvalue):
+    """Returns the lowest integer score of a `_score_tail` whose p-value is <= <pvalue> (max + 1 if there is none)."""
+    passing = np.flatnonzero(tail <= pvalue)
+    return minInt + (passing[0] if len(passing) else len(tail))
+
+
+class PositionWeightMatrix(object):
+    """
+    Log-odds scoring matrix of a motif, with the exact distribution of its scores over background sequence.
+    """
+    def __init__(self, name, counts, background=None, pseudocount=1.0, scale=100):
+        """
+        Scores are log2(P(base | motif position) / P(base | background)) with ``pseudocount`` counts, spread in
+        proportion to the background, added to each position.  They are kept as integers in units of
+        1/``scale`` bits so that the p-value of every score can be tabled exactly by dynamic programming.
+
+        :param name: name of the motif
+        :param counts: (motif length x 4) counts (or frequencies) of A, C, G and T at each motif position
+        :param background: frequencies of A, C, G and T (default: uniform)
+        :param pseudocount: counts added to each position
+        :param scale: score units per bit
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        if counts.ndim != 2 or counts.shape[1] != 4 or not len(counts):
+            raise ValueError('counts for motif %s must be a (motif length x 4) matrix, not %s.' % (name, counts.shape))
+        background = np.array(background if background is not None else [0.25] * 4, dtype=np.float64)
+        background /= background.sum()
+
+        self.name = name
+        self.counts = counts
+        self.background = background
+        self.scale = scale
+
+        probs = (counts + pseudocount * background) / (counts.sum(1)[:, None] + pseudocount)
+        self.logOdds = np.log2(probs / background)
+        self.intScores = np.round(self.logOdds * scale).astype(np.int64)
+
+        # _tail[i]: probability that background sequence scores at least (i + _minInt) / scale
+        self._minInt, self._tail = _score_tail(self.intScores, background)
+
+    def __len__(self):
+        return len(self.logOdds)
+
+    @property
+    def min_score(self):
+        return self._minInt / float(self.scale)
+
+    @property
+    def max_score(self):
+        return (self._minInt + len(self._tail) - 1) / float(self.scale)
+
+    def int_threshold(self, pvalue):
+        """Returns the lowest integer score whose p-value is <= <pvalue> (max + 1 if there is none)."""
+        return _tail_threshold(self._minInt, self._tail, pvalue)
+
+    def score_threshold(self, pvalue):
+        """Returns the lowest score (in bits) whose p-value is <= <pvalue>."""
+        return self.int_threshold(pvalue) / float(self.scale)
+
+    def pvalues(self, intScores):
+        """Returns array with the p-values of the integer scores in <intScores>."""
+        index = np.clip(np.asarray(intScores) - self._minInt, 0, len(self._tail) - 1)
+        return self._tail[index]
+
+
+class PWMScanner(ChunkedScanner):
+    """
+    Scores every window of a sequence against many position weight matrices on both strands at once.
+    """
+    columns = PWM_HIT_COLUMNS
+
+    def __init__(self, matrices, pvalue=0.0001, score=None, strands='both', chunkSize=1048576, maxCells=1048576):
+        """
+        The matrices for both strands (the minus strand as the reversed, complemented matrix) are stacked
+        into one (motif position x base x matrix) array.  Sequence is one-hot encoded, so the scores of every
+        window against every matrix are the sum, over motif positions, of the rows picked out by the bases
+        at that offset: one vectorized pass per motif position, whatever the number of matrices.  Positions
+        are taken three at a time (the one-hot code of a 3-mer picks out the sum of three rows), which cuts
+        the passes to a third.
+
+        Windows overlapping N (or any non-ACGT base) or running off the end of the sequence are not scored.
+        Minus strand p-values come from the score distribution of the reversed, complemented matrix over the
+        background, which differs from the plus strand one unless the background is complement symmetric.
+
+        :param matrices: list of `PositionWeightMatrix` (see `read_transfac`)
+        :param pvalue: report windows scoring with at most this p-value (per strand)
+        :param score: if given, report windows scoring at least this many bits instead
+        :param strands: 'both', 'plus' or 'minus'
+        :param chunkSize: sequences are scanned in windows of this many bases
+        :param maxCells: windows x matrices scored per pass (bounds memory to about 4 bytes per cell)
+        """
+        if strands not in ('both', 'plus', 'minus'):
+            raise InvalidOptionError(wrong_value=strands, option_name='strands', valid_values=['both', 'plus', 'minus'])
+        self.matrices = list(matrices)
+        self.strands = strands
+        self.chunkSize = chunkSize
+        self.maxCells = maxCells
+        self.maxLen = max(len(matrix) for matrix in self.matrices) if self.matrices else 0
+
+        scaled = []
+        names = []
+        strandCodes = []
+        lengths = []
+        thresholds = []
+        tailStarts = []
+        minInts = []
+        scales = []
+        tails = []
+        tailStart = 0
+        for matrix in self.matrices:
+            for strand, intScores in ((1, matrix.intScores), (-1, matrix.intScores[::-1, ::-1])):
+                if (strand == 1 and strands == 'minus') or (strand == -1 and strands == 'plus'):
+                    continue
+                if strand == 1 or np.allclose(matrix.background, matrix.background[::-1]):
+                    minInt, tail = matrix._minInt, matrix._tail
+                else:
+                    minInt, tail = _score_tail(intScores, matrix.background)
+                if score is None:
+                    thresholds.append(_tail_threshold(minInt, tail, pvalue))
+                else:
+                    thresholds.append(int(np.ceil(score * matrix.scale)))
+                scaled.append(intScores)
+                names.append(matrix.name)
+                strandCodes.append(strand)
+                lengths.append(len(matrix))
+                tailStarts.append(tailStart)
+                minInts.append(minInt)
+                scales.append(matrix.scale)
+                tails.append(tail)
+                tailStart += len(tail)
+
+        # _weights[position, base code, column]; positions past a motif's end score 0 whatever the base
+        numTriplets = (self.maxLen + 2) // 3
+        weights = np.zeros((numTriplets * 3, 5, len(scaled)), dtype=np.int32)
+        for column, intScores in enumerate(scaled):
+            weights[:len(intScores), :4, column] = intScores
+            weights[:len(intScores), 4, column] = _NO_BASE_SCORE
+        # _tripletWeights[triplet, 3-mer code, column]: summed weights of motif positions 3 * triplet to + 2
+        self._tripletWeights = (weights[0::3, :, None, None, :] +
+                                weights[1::3, None, :, None, :] +
+                                weights[2::3, None, None, :, :]).reshape(numTriplets, 125, len(scaled))
+        self._names = np.array(names)
+        self._strands = np.array(strandCodes, dtype=np.int8)
+        self._lengths = np.array(lengths, dtype=np.int64)
+        self._thresholds = np.array(thresholds, dtype=np.int64)
+        self._tailStarts = np.array(tailStarts, dtype=np.int64)
+        self._minInts = np.array(minInts, dtype=np.int64)
+        self._tails = np.concatenate(tails) if tails else np.zeros(0)
+        self._scales = np.array(scales, dtype=np.float64)
+
+    def score_windows(self, triplets, numStarts):
+        """Returns (numStarts x columns) int32 array of the integer scores of the windows starting at each of the
+        first <numStarts> positions of 3-mer codes <triplets> (which must extend maxLen - 1 past them)."""
+        scores = self._tripletWeights[0][triplets[:numStarts]]
+        for triplet in xrange(1, len(self._tripletWeights)):
+            scores += self._tripletWeights[triplet][triplets[3 * triplet:3 * triplet + numStarts]]
+        return scores
+
+    def _scan_text(self, text, offset, limit, hits):
+        starts, ends, strands, names, scores, pvalues = hits
+        numStarts = min(limit, len(text))
+        if numStarts <= 0 or not len(self._names):
+            return
+        codes = np.empty(numStarts + 3 * len(self._tripletWeights) + 2, dtype=np.intp)
+        codes.fill(4)
+        codes[:len(text)] = _SEQ_CODES[np.frombuffer(text, dtype=np.uint8)][:len(codes)]
+        triplets = codes[:-2] * 25 + codes[1:-1] * 5 + codes[2:]
+
+        step = max(1, self.maxCells // len(self._names))
+        for blockStart in xrange(0, numStarts, step):
+            blockScores = self.score_windows(triplets[blockStart:], min(step, numStarts - blockStart))
+            rows, columns = np.nonzero(blockScores >= self._thresholds)
+            if not len(rows):
+                continue
+            intScores = blockScores[rows, columns].astype(np.int64)
+            rowStarts = rows + (blockStart + offset + 1)
+            starts.extend(rowStarts.tolist())
+            ends.extend((rowStarts + self._lengths[columns] - 1).tolist())
+            strands.extend(self._strands[columns].tolist())
+            names.extend(self._names[columns].tolist())
+            scores.extend((intScores / self._scales[columns]).tolist())
+            pvalues.extend(self._tails[self._tailStarts[columns] + intScores - self._minInts[columns]].tolist())
+
+#### ----- PWM scanning  <END> ----- ####
+
+
+#### ----- parallel scanning  <BEGIN> ----- ####
+# state of the scanning worker processes (set by _set_scan_state)
+_SCANNER = None
+_STORE = None
+
+
+def _set_scan_state(scanner, storeFactory=None, storeArg=None):
+    global _SCANNER, _STORE
+    _SCANNER = scanner
+    _STORE = storeFactory(storeArg) if storeFactory is not None else None
+
+
+def _scan_store_job(seqid):
+    return _SCANNER.scan_store(_STORE, seqid)
+
+
+def _scan_records_job(recs):
+    return concat_hits([_SCANNER.scan_seq(name, seq) for name, seq in recs], _SCANNER.columns)
+
+
+def scan_fasta(scanner, fastaPath, processes=None, storeFactory=IndexedFastA):
+    """
+    Returns hit `Bunch` of ``scanner``'s motifs over every record of a fastA file.
+
+    Uncompressed files are opened with ``storeFactory`` (``IndexedFastA`` or ``PackedGenome``) in each worker and
+    contigs are handed out to ``processes`` worker processes by name; each worker reads its contigs a chunk at
+    a time from the shared memory map.  '.gz' files are streamed through ``ParseFastA`` instead.
+
+    :param scanner: `MotifScanner` or `PWMScanner`
+    :param fastaPath: path to fastA file (or PackedGenome file)
+    :param processes: number of worker processes
+    :param storeFactory: class used to open uncompressed files
+    """
+    if fastaPath.endswith('.gz'):
+        return scan_records(scanner, ParseFastA(fastaPath), processes=processes, batchSize=1)
+
+    seqids = storeFactory(fastaPath).keys()
+    return concat_hits(pool_imap(_scan_store_job, seqids, processes=processes,
+                                 initializer=_set_scan_state, initargs=(scanner, storeFactory, fastaPath)),
+                       scanner.columns)
+
+
+def scan_records(scanner, recs, processes=None, batchSize=10000):
+    """
+    Returns hit `Bunch` of ``scanner``'s motifs over ``recs``: an iterable of (name, seq) tuples such as a
+    ``ParseFastA`` parser or, for reads, ``((rec[0], rec[1]) for rec in ParseFastQ(path))``.
+
+    :param scanner: `MotifScanner` or `PWMScanner`
+    :param recs: iterable of (name, seq)
+    :param processes: number of worker processes
+    :param batchSize: records sent to a worker at a time
+    """
+    return concat_hits(pool_imap(_scan_records_job, split_stream(recs, batchSize), processes=processes,
+                                 initializer=_set_scan_state, initargs=(scanner,)),
+                       scanner.columns)
+
+#### ----- parallel scanning  <END> ----- ####
@@ -1,3 +1,9 @@
+import string
+
+import numpy as np
+
+from spartan.utils.misc import Bunch
+
 
 compl_iupacdict = {'A':'T',
                    'C':'G',
@@ -16,19 +22,52 @@ compl_iupacdict = {'A':'T',
                    'X':'X',
                    'N':'N'}
 
-def compliment(seq, compl_iupacdict):
-    compl_seq = ""
-    for i in range(0,len(seq)):
-        letter = seq[i]
-        compl_seq = compl_seq + compl_iupacdict[letter]
-    return compl_seq
+def _compl_table(compl_dict):
+    """Returns a ``str.translate`` table for ``compl_dict`` that also maps the lowercased keys to lowercased values."""
+    keys = ''.join(compl_dict.keys())
+    values = ''.join(compl_dict.values())
+    return string.maketrans(keys + keys.lower(), values + values.lower())
+
+_COMPL_TABLE = _compl_table(compl_iupacdict)
+_COMPL_ARRAY = np.frombuffer(_COMPL_TABLE, dtype=np.uint8)
+
+
+def compliment(seq, compl_iupacdict=compl_iupacdict):
+    """
+    Returns the complement of ``seq`` using ``compl_iupacdict`` as a translation table.
+    Case is kept and chars that are not in the table (gaps, etc) are left as they are.
+    """
+    return seq.translate(_compl_table(compl_iupacdict))
 
 def reverse(text):
     return text[::-1]
 
 def revcomp(seq):
-    revCompSeq = reverse(compliment(seq, compl_iupacdict))
-    return revCompSeq
+    """Returns the reverse complement of ``seq`` (IUPAC codes, case kept)."""
+    return seq.translate(_COMPL_TABLE)[::-1]
+
+def revcomp_batch(seqs):
+    """
+    Returns the reverse complements of many seqs from one call:
+
+    * list/tuple of strs: list of strs (translated as one joined string)
+    * 2D uint8 NumPy array with one seq of bytes per row: new 2D uint8 array (one table lookup for all)
+    * NumPy array of strs (dtype 'S'): array of the same dtype
+    """
+    if isinstance(seqs, np.ndarray):
+        if seqs.dtype == np.uint8 and seqs.ndim == 2:
+            return _COMPL_ARRAY[seqs][:, ::-1]
+        if seqs.dtype.kind == 'S':
+            return np.array(revcomp_batch(seqs.tolist()), dtype=seqs.dtype)
+        raise ValueError("NumPy input must be a 2D uint8 array or an array of strs, not %s." % (seqs.dtype))
+
+    seqs = list(seqs)
+    if not seqs:
+        return []
+    # revcomp of the joined seqs == the joined revcomps in reverse order
+    rcs = revcomp('\0'.join(seqs)).split('\0')
+    rcs.reverse()
+    return rcs
 #=========================================================================
 
 def iupacList_2_regExList(motifList):
@@ -56,8 +95,100 @@ def iupac2regex(motif):
                  'X':'[ACGT]',
                  'N':'[ACGT]'}
 
-    transl_motif = ""
-    for i in range(0,len(motif)):
-        letter = motif[i]
-        transl_motif = transl_motif + iupacdict[letter]
-    return transl_motif
\ No newline at end of file
+    return ''.join([iupacdict[letter] for letter in motif.upper()])
+
+
+#=========================================================================
+WINDOW_STATS = ('gc', 'at_skew', 'n_frac', 'softmask_frac', 'cpg_oe')
+
+# sequence byte -> count column: A, C, G, T, N (either case) or 5 for anything else
+_WINDOW_BASES = np.empty(256, dtype=np.uint8)
+_WINDOW_BASES.fill(5)
+for _col, _base in enumerate('ACGTN'):
+    _WINDOW_BASES[ord(_base)] = _WINDOW_BASES[ord(_base.lower())] = _col
+
+
+def _window_sums(flags, starts, ends):
+    """Returns the number of True <flags> in each window [starts, ends)."""
+    sums = np.zeros(len(flags) + 1, dtype=np.int32)
+    np.cumsum(flags, dtype=np.int32, out=sums[1:])
+    return sums[ends] - sums[starts]
+
+
+def window_stats(seq, winSize, step=None, partial=False, blockSize=8388608):
+    """
+    Returns `Bunch` of float arrays with statistics of every window along ``seq``, plus the window ``start``
+    (0-based) and ``end`` (exclusive) arrays:
+
+    * ``gc``: (G + C) / (A + C + G + T)
+    * ``at_skew``: (A - T) / (A + T)
+    * ``n_frac``: fraction of the window that is N
+    * ``softmask_frac``: fraction of the window in lower case
+    * ``cpg_oe``: observed / expected CpG: CG dinucleotides * window length / (C * G)
+
+    Bases are counted without regard to case; ratios with nothing to divide by are NaN.
+
+    Unlike `misc.slidingWindow`, no substring is made per window: each statistic comes from cumulative
+    sums over the encoded sequence, so the cost does not depend on ``winSize``.  The sequence is encoded
+    ``blockSize`` bases at a time to bound memory on whole chromosomes.
+
+    :param seq: str of bases
+    :param winSize: window length
+    :param step: distance between window starts (default: ``winSize``)
+    :param partial: also return the shorter windows starting within ``winSize`` of the end
+    :param blockSize: about how many bases to encode at a time
+    """
+    step = step or winSize
+    if winSize < 1 or step < 1:
+        raise ValueError("winSize and step must be at least 1 (got %s and %s)." % (winSize, step))
+    starts = np.arange(0, len(seq) if partial else len(seq) - winSize + 1, step, dtype=np.int64)
+    ends = np.minimum(starts + winSize, len(seq))
+
+    stats = Bunch(start=starts, end=ends)
+    for stat in WINDOW_STATS:
+        stats[stat] = np.empty(len(starts), dtype=np.float64)
+
+    windowsPerBlock = max(1, blockSize // step)
+    for first in xrange(0, len(starts), windowsPerBlock):
+        last = min(first + windowsPerBlock, len(starts))
+        segStart = starts[first]
+        segment = np.frombuffer(seq[segStart:ends[last - 1]], dtype=np.uint8)
+        cols = _WINDOW_BASES[segment]
+        winStarts = starts[first:last] - segStart
+        winEnds = ends[first:last] - segStart
+
+        a, c, g, t, n = [_window_sums(cols == col, winStarts, winEnds).astype(np.float64) for col in range(5)]
+        lower = _window_sums((segment >= ord('a')) & (segment <= ord('z')), winStarts, winEnds)
+        # CG pairs starting in [start, end - 1) lie wholly inside the window
+        cpg = _window_sums((cols[:-1] == 1) & (cols[1:] == 2), winStarts, winEnds - 1)
+        lengths = (winEnds - winStarts).astype(np.float64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stats.gc[first:last] = (g + c) / (a + c + g + t)
+            stats.at_skew[first:last] = (a - t) / (a + t)
+            stats.n_frac[first:last] = n / lengths
+            stats.softmask_frac[first:last] = lower / lengths
+            stats.cpg_oe[first:last] = cpg * lengths / (c * g)
+    return stats
+
+
+def write_bedgraph(path, windowStats, stat='gc', trackLine=None):
+    """
+    Writes one of the WINDOW_STATS to ``path`` as bedGraph lines: seqid, start, end, value.  Windows where the
+    statistic is NaN are left out.  (bedGraph expects windows that do not overlap, i.e. step >= winSize.)
+
+    :param path: output path
+    :param windowStats: iterable of (seqid, `Bunch` from `window_stats`) tuples, e.g. from `fastas.fasta_window_stats`
+    :param stat: name of the statistic to write
+    :param trackLine: optional 'track ...' line written first
+    """
+    if stat not in WINDOW_STATS:
+        raise ValueError("`stat` must be one of %s, not '%s'." % (list(WINDOW_STATS), stat))
+    with open(path, 'w') as out:
+        if trackLine:
+            out.write(trackLine.rstrip('\n') + '\n')
+        for seqid, stats in windowStats:
+            keep = ~np.isnan(stats[stat])
+            out.writelines(['%s\t%d\t%d\t%.6g\n' % (seqid, start, end, value)
+                            for start, end, value in zip(stats.start[keep].tolist(), stats.end[keep].tolist(),
+                                                         stats[stat][keep].tolist())])